@@ -0,0 +1,66 @@
+"""Time the ways :class:`gorm.query.QueryEngine` runs queries on
+sqlite3: :meth:`sql`, which makes a new cursor every time, against
+:meth:`sqlone`, which keeps one for each query, and iterating a
+cursor against :meth:`sqlstream`, which fetches rows in batches.
+
+Run it as ``python bench.py``.
+
+"""
+from timeit import repeat
+from gorm.query import QueryEngine
+
+
+def setup(nodes=1000, revs=25):
+    qe = QueryEngine(':memory:', {}, False)
+    qe.initdb()
+    qe.new_graph('g', 'DiGraph')
+    qe.buffer_writes()
+    for node in range(nodes):
+        qe.exist_node('g', node, 'master', 0, True)
+        for rev in range(revs):
+            qe.node_val_set('g', node, 'w', 'master', rev, rev)
+    qe.unbuffer_writes()
+    return qe
+
+
+def best(stmt, number):
+    """Return the fastest of some runs of ``stmt``, in microseconds per
+    call.
+
+    """
+    return min(repeat(stmt, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    qe = setup()
+    (g, n, w) = map(qe._name_id, ('g', 500, 'w'))
+
+    def old_one(name, *args):
+        return qe.sql(name, *args).fetchone()
+
+    def old_dump():
+        for row in qe.sql('node_val_dump'):
+            pass
+
+    def new_dump():
+        for row in qe.sqlstream('node_val_dump'):
+            pass
+    print('{:<24}{:>10}{:>10}'.format('', 'sql', 'sqlone'))
+    for (name, args) in (
+            ('ctbranch', ('master',)),
+            ('node_exists', ('master', 10, g, n)),
+            ('node_val_get', ('master', 10, g, n, w))
+    ):
+        print('{:<24}{:>10.2f}{:>10.2f}  us'.format(
+            name,
+            best(lambda: old_one(name, *args), 10000),
+            best(lambda: qe.sqlone(name, *args), 10000)
+        ))
+    print('{:<24}{:>10.2f}{:>10.2f}  ms'.format(
+        'node_val_dump', best(old_dump, 5) / 1e3, best(new_dump, 5) / 1e3
+    ))
+    qe.close()
+
+
+if __name__ == '__main__':
+    main()
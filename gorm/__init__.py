@@ -1,116 +1,191 @@
 # This file is part of gorm, an object relational mapper for versioned graphs.
 # Copyright (C) 2014 Zachary Spector.
-from collections import defaultdict, deque
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+from threading import local
+import networkx
 from .graph import (
     Graph,
     DiGraph,
     MultiGraph,
     MultiDiGraph,
+    ordered_nodes
 )
 from .query import QueryEngine
+from .cache import FlatCache, AdjacencyIndex
+from .window import WindowDict, SharedWindowDict
 from .reify import reify
+from .codec import get_codec
+from .xjson import DEFAULT_CAPACITY
+from .stats import QueryStats
 
 
 class GraphNameError(KeyError):
     pass
 
 
+class PerGraphCache(dict):
+    """Dictionary of caches, one per graph, that fills in each graph's
+    cache from the database the first time it's asked for.
+
+    This way I only load the graphs that actually get used.
+
+    """
+    def __init__(self, factory, loader, lock):
+        """Remember how to make an empty cache for a graph, how to fill
+        it, and what lock to hold while I do.
+
+        ``loader`` gets called with the graph's name and its new
+        cache.
+
+        """
+        super(PerGraphCache, self).__init__()
+        self._factory = factory
+        self._loader = loader
+        self._lock = lock
+
+    def __missing__(self, graph):
+        with self._lock:
+            if graph in self:
+                # another thread loaded it while I waited
+                return dict.__getitem__(self, graph)
+            r = self._factory()
+            self._loader(graph, r)
+            self[graph] = r
+            return r
+
+    def new(self, graph):
+        """Make an empty cache for a graph that doesn't have any data in
+        the database yet, and return it.
+
+        """
+        r = self[graph] = self._factory()
+        return r
+
+
+class Cursor(object):
+    """Where in time I'm looking, and what's been worked out about it:
+    the lineage of branches back to master, and an
+    :class:`AdjacencyIndex` for each graph, along with the log of the
+    graph's edge changes it's caught up with, and how far.
+
+    """
+    def __init__(self, branch=None, rev=None):
+        self.branch = branch
+        self.rev = rev
+        self.lineage = None
+        self.adjacency = {}
+        self.edge_changes_seen = {}
+
+
+class ThreadCursor(Cursor, local):
+    """A :class:`Cursor` that each thread has its own of, starting where
+    the first one was made.
+
+    """
+
+
 class ORM(object):
     """Instantiate this with the same string argument you'd use for a
     SQLAlchemy ``create_engine`` call. This will be your interface to
     gorm.
 
     """
+    @reify
+    def _interned(self):
+        """Dictionary of the parts of keys in the caches, so that each is
+        stored only once.
+
+        """
+        return {}
+
     @reify
     def _graph_val_cache(self):
         assert(self.caching)
-        from .window import WindowDict
-        r = defaultdict(  # graph:
-            lambda: defaultdict(  # key:
-                lambda: defaultdict(  # branch:
-                    WindowDict  # rev: value
-                )
-            )
+
+        def load(graph, r):
+            for (_, key, branch, rev, value) in self.db.graph_val_dump(
+                    graph, defer=True
+            ):
+                r.window((key, branch))[rev] = value
+        return PerGraphCache(
+            # key, branch: rev: value
+            lambda: FlatCache(1, self._interned, self._window_factory),
+            load,
+            self.lock
         )
-        for (graph, key, branch, rev, value) in self.db.graph_val_dump():
-            r[graph][key][branch][rev] = value
-        return r
 
     @reify
     def _node_val_cache(self):
         assert(self.caching)
-        from .window import WindowDict
-        r = defaultdict(  # graph:
-            lambda: defaultdict(  # node:
-                lambda: defaultdict(  # key:
-                    lambda: defaultdict(  # branch:
-                        WindowDict  # rev: value
-                    )
-                )
-            )
+
+        def load(graph, r):
+            for (
+                    _, node, key, branch, rev, value
+            ) in self.db.node_val_dump(graph, defer=True):
+                r.window((node, key, branch))[rev] = value
+        return PerGraphCache(
+            # node, key, branch: rev: value
+            lambda: FlatCache(2, self._interned, self._window_factory),
+            load,
+            self.lock
         )
-        for (graph, node, key, branch, rev, value) in self.db.node_val_dump():
-            r[graph][node][key][branch][rev] = value
-        return r
 
     @reify
     def _nodes_cache(self):
         assert(self.caching)
-        from .window import WindowDict
-        r = defaultdict(  # graph:
-            lambda: defaultdict(  # node:
-                lambda: defaultdict(  # branch:
-                    WindowDict  # rev: extant
-                )
-            )
+
+        def load(graph, r):
+            for (_, node, branch, rev, extant) in self.db.nodes_dump(graph):
+                r.window((node, branch))[rev] = extant
+        return PerGraphCache(
+            # node, branch: rev: extant
+            lambda: FlatCache(1, self._interned, self._window_factory),
+            load,
+            self.lock
         )
-        for (graph, node, branch, rev, extant) in self.db.nodes_dump():
-            r[graph][node][branch][rev] = extant
-        return r
 
     @reify
     def _edge_val_cache(self):
         assert(self.caching)
-        from .window import WindowDict
-        r = defaultdict(  # graph:
-            lambda: defaultdict(  # nodeA:
-                lambda: defaultdict(  # nodeB:
-                    lambda: defaultdict(  # idx:
-                        lambda: defaultdict(  # key:
-                            lambda: defaultdict(  # branch:
-                                WindowDict  # rev: value
-                            )
-                        )
-                    )
-                )
-            )
+
+        def load(graph, r):
+            for (
+                    _, nodeA, nodeB, idx, key, branch, rev, value
+            ) in self.db.edge_val_dump(graph, defer=True):
+                r.window((nodeA, nodeB, idx, key, branch))[rev] = value
+        return PerGraphCache(
+            # nodeA, nodeB, idx, key, branch: rev: value
+            lambda: FlatCache(4, self._interned, self._window_factory),
+            load,
+            self.lock
         )
-        for (
-                graph, nodeA, nodeB, idx, key, branch, rev, value
-        ) in self.db.edge_val_dump():
-            r[graph][nodeA][nodeB][idx][key][branch][rev] = value
-        return r
 
     @reify
     def _edges_cache(self):
         assert self.caching
-        from .window import WindowDict
-        r = defaultdict(  # graph:
-            lambda: defaultdict(  # nodeA:
-                lambda: defaultdict(  # nodeB:
-                    lambda: defaultdict(  # idx:
-                        lambda: defaultdict(  # branch:
-                            WindowDict  # rev: extant
-                        )
-                    )
-                )
-            )
+
+        def load(graph, r):
+            for (
+                    _, nodeA, nodeB, idx, branch, rev, extant
+            ) in self.db.edges_dump(graph):
+                r.window((nodeA, nodeB, idx, branch))[rev] = extant
+        return PerGraphCache(
+            # nodeA, nodeB, idx, branch: rev: extant
+            lambda: FlatCache(3, self._interned, self._window_factory),
+            load,
+            self.lock
         )
-        for (
-                graph, nodeA, nodeB, idx, branch, rev, extant
-        ) in self.db.edges_dump():
-            r[graph][nodeA][nodeB][idx][branch][rev] = extant
-        return r
+
+    @property
+    def _adjacency_indices(self):
+        """Dictionary of :class:`AdjacencyIndex`, keyed by graph name, for
+        the present thread's cursor.
+
+        """
+        assert self.caching
+        return self._cursor.adjacency
 
     def __init__(
             self,
@@ -120,26 +195,96 @@ class ORM(object):
             query_engine_class=QueryEngine,
             json_dump=None,
             json_load=None,
-            caching=True
+            caching=True,
+            keyframe_interval=None,
+            write_buffer=None,
+            codec='json',
+            codec_cache_size=DEFAULT_CAPACITY,
+            delta_interval=None,
+            readers=None,
+            threadsafe=False,
+            query_stats=False
     ):
         """Make a SQLAlchemy engine if possible, else a sqlite3 connection. In
         either case, begin a transaction.
 
+        If ``keyframe_interval`` is an integer, I'll store a keyframe
+        of each graph's state once it's that many revisions out of
+        date, whenever the cursor moves forward.
+
+        If ``write_buffer`` is an integer, I'll keep up to that many
+        writes in memory and run them together, when the buffer's
+        full, or the branch or revision changes, or you commit.
+
+        ``codec`` is the name of a codec in ``gorm.codec.codecs``,
+        'json' or 'binary' unless you've registered more, or an
+        instance of one. It encodes names and values for the
+        database, and remembers up to ``codec_cache_size`` of those
+        it's recently dumped and loaded. It's in ``self.codec``. You
+        can override its methods with your own ``json_dump`` and
+        ``json_load``.
+
+        If ``delta_interval`` is an integer, I'll store changes to
+        dicts, lists, and tuples on nodes and edges as patches against
+        their previous values, with the whole value at least every
+        ``delta_interval`` revisions. See :class:`QueryEngine`.
+
+        If ``readers`` is an integer, the query engine will open that
+        many more connections to the database, for the read queries
+        of threads other than this one, so they needn't wait for each
+        other. They read what was last committed. See
+        :class:`QueryEngine`.
+
+        If ``threadsafe``, each thread gets its own ``branch`` and
+        ``rev``, starting where I was when I was made, so that threads
+        can look at different times in the same graphs at once,
+        sharing the caches. Moving a thread's cursor doesn't store it
+        in the database. Reading the caches takes no lock. Writes, and
+        loading a graph into the caches, hold ``self.lock``, which
+        you can hold yourself to make several changes at once. This
+        needs ``caching``.
+
+        If ``query_stats``, I'll count the queries I run, how long
+        they take, and how many rows they return, for :meth:`stats`.
+        Otherwise I only count them in blocks of :meth:`measure`.
+
         """
-        self.db = query_engine_class(dbstring, connect_args, alchemy, json_dump, json_load)
+        if threadsafe and not caching:
+            raise ValueError("Thread safety needs caching")
+        self.codec = get_codec(codec, codec_cache_size)
+        self.db = query_engine_class(
+            dbstring,
+            connect_args,
+            alchemy,
+            json_dump or self.codec.dump,
+            json_load or self.codec.load,
+            binary=self.codec.binary,
+            delta_interval=delta_interval,
+            readers=readers,
+            threadsafe=threadsafe
+        )
+        self.lock = self.db.lock
+        self.threadsafe = threadsafe
+        self.query_stats = QueryStats()
+        if query_stats:
+            self.db.record_stats(self.query_stats)
+        self._window_factory = partial(SharedWindowDict, self.lock) \
+            if threadsafe else WindowDict
         self._branches = {}
-        self._obranch = None
-        self._orev = None
+        self._cursor = Cursor()
+        self.caching = caching
+        self.keyframe_interval = keyframe_interval
         self.db.initdb()
+        if write_buffer:
+            self.db.buffer_writes(write_buffer)
         if caching:
-            self.caching = True
-            self._obranch = self.branch
-            self._orev = self.rev
+            self._cursor = (ThreadCursor if threadsafe else Cursor)(
+                self.branch, self.rev
+            )
             self._timestream = {'master': {}}
             self._branch_start = {}
             self._branches = {'master': self._timestream['master']}
             self._branch_parents = {}
-            self._active_branches_cache = []
             self.db.active_branches = self._active_branches
             todo = deque(self.db.timestream_data())
             while todo:
@@ -150,10 +295,21 @@ class ORM(object):
                     assert(branch not in self._branches)
                     self._branches[parent][branch] = {}
                     self._branches[branch] = self._branches[parent][branch]
-                    self._branch_parents['branch'] = parent
+                    self._branch_parents[branch] = parent
                     self._branch_start[branch] = parent_tick
                 else:
                     todo.append(working)
+        if threadsafe:
+            # graphs whose edges changed: what changed, in order, for
+            # each thread's adjacency index to catch up with
+            self._edge_changes = {}
+            # make the caches now, rather than whenever two threads
+            # first want them
+            for cache in (
+                    '_graph_val_cache', '_node_val_cache', '_nodes_cache',
+                    '_edge_val_cache', '_edges_cache'
+            ):
+                getattr(self, cache)
 
     def __enter__(self):
         """Enable the use of the ``with`` keyword"""
@@ -202,12 +358,13 @@ class ORM(object):
 
     @property
     def branch(self):
-        """Return the global value ``branch``, or ``self._obranch`` if it's
+        """Return the global value ``branch``, or my cursor's branch if it's
         set
 
         """
-        if self._obranch is not None:
-            return self._obranch
+        branch = self._cursor.branch
+        if branch is not None:
+            return branch
         return self.db.globl['branch']
 
     @branch.setter
@@ -218,38 +375,45 @@ class ORM(object):
         """
         curbranch = self.branch
         currev = self.rev
-        if not self._havebranch(v):
-            # assumes the present revision in the parent branch has
-            # been finalized.
-            self.db.new_branch(v, curbranch, currev)
-        if v == 'master':
-            return
-        # make sure I'll end up within the revision range of the
-        # destination branch
-        if self.caching:
-            if v not in self._branch_parents:
-                self._branch_parents[v] = curbranch
-                self._branch_start[v] = currev
-            parrev = self._branch_start[v]
-        else:
-            parrev = self.db.parrev(v)
-        if currev < parrev:
+        with self.lock:
+            if not self._havebranch(v):
+                # assumes the present revision in the parent branch has
+                # been finalized.
+                self.db.new_branch(v, curbranch, currev)
+            # make sure I'll end up within the revision range of the
+            # destination branch
+            if v != 'master':
+                if self.caching:
+                    if v not in self._branch_parents:
+                        self._branch_parents[v] = curbranch
+                        self._branch_start[v] = currev
+                    parrev = self._branch_start[v]
+                else:
+                    parrev = self.db.parrev(v)
+        if v != 'master' and currev < parrev:
             raise ValueError(
-                "Tried to jump to branch {br}, which starts at revision {rv}. "
-                "Go to rev {rv} or later to use this branch.".format(
+                "Tried to jump to branch {br}, which starts at "
+                "revision {rv}. Go to rev {rv} or later to use this "
+                "branch.".format(
                     br=v,
-                    rv=currev
+                    rv=parrev
                 )
             )
-        self.db.globl['branch'] = v
-        if self.engine.caching:
-            self._obranch = v
+        if not self.threadsafe:
+            self.db.globl['branch'] = v
+        if self.caching:
+            self._cursor.branch = v
+            self._cursor.lineage = None
 
     @property
     def rev(self):
-        """Return the global value ``rev``, or ``self._orev`` if that's set"""
-        if self._orev is not None:
-            return self._orev
+        """Return the global value ``rev``, or my cursor's rev if that's
+        set
+
+        """
+        rev = self._cursor.rev
+        if rev is not None:
+            return rev
         return self.db.globl['rev']
 
     @rev.setter
@@ -261,6 +425,7 @@ class ORM(object):
         """
         # first make sure the cursor is not before the start of this branch
         branch = self.branch
+        currev = self.rev
         if branch != 'master':
             if self.caching:
                 parent = self._branch_parents[branch]
@@ -273,10 +438,26 @@ class ORM(object):
                     "occurs before the start of "
                     "the branch {brnch}".format(revn=v, brnch=branch)
                 )
-        self.db.globl['rev'] = v
-        assert(self.rev == v)
+        if self.keyframe_interval and v > currev:
+            # assumes the revision I'm leaving has been finalized
+            self.db.keyframe_due(branch, currev, self.keyframe_interval)
+        if not self.threadsafe:
+            self.db.globl['rev'] = v
         if self.caching:
-            self._orev = v
+            self._cursor.rev = v
+            self._cursor.lineage = None
+        assert(self.rev == v)
+
+    def keyframe(self, name):
+        """Store a keyframe of the graph by the given name at the present
+        branch and revision, so that looking up its state later
+        needn't go through the whole history.
+
+        If the graph changes at this revision later, the keyframe will
+        be discarded.
+
+        """
+        self.db.keyframe(name, self.branch, self.rev)
 
     def commit(self):
         """Alias of ``self.db.commit``"""
@@ -286,6 +467,45 @@ class ORM(object):
         """Alias of ``self.db.close``"""
         self.db.close()
 
+    def bulk_ingest(self, check=True):
+        """Return a context manager in which to write lots of data
+        quickly, with no indices to keep up, and, with SQLite, no
+        syncing to disk. Afterward, the indices are made again, and,
+        with ``check``, the database's integrity is checked.
+
+        See :meth:`gorm.query.QueryEngine.bulk_ingest`.
+
+        """
+        return self.db.bulk_ingest(check)
+
+    def stats(self):
+        """Return the counts and times of the queries I've run, keyed by
+        their names, if I was made with ``query_stats``.
+
+        See :meth:`gorm.stats.QueryStats.stats`.
+
+        """
+        return self.query_stats.stats()
+
+    def reset_stats(self):
+        """Forget the queries :meth:`stats` has counted so far."""
+        self.query_stats.reset()
+
+    @contextmanager
+    def measure(self):
+        """Count the queries run in a ``with`` block, in the
+        :class:`gorm.stats.QueryStats` it gets ``as`` its target.
+
+        Queries that other threads run meanwhile get counted too.
+
+        """
+        stats = QueryStats()
+        self.db.record_stats(stats)
+        try:
+            yield stats
+        finally:
+            self.db.stop_recording(stats)
+
     def initdb(self):
         """Alias of ``self.db.initdb``"""
         self.db.initdb()
@@ -295,13 +515,90 @@ class ORM(object):
             raise GraphNameError("Already have a graph by that name")
         self.db.new_graph(name, type_s)
 
+    def _bulk_load(self, name, graph_type, data, attr):
+        """Write the contents of ``data``, and the graph attributes in
+        ``attr``, into the new graph ``name``, of type ``graph_type``,
+        at the present branch and revision.
+
+        ``data`` is anything networkx can make a graph out of. Rather
+        than adding the nodes and edges one at a time, I walk it once
+        and insert each table's records in batches, and fill in the
+        caches as I go.
+
+        """
+        template = getattr(networkx, graph_type)()
+        if data is None:
+            data = template
+        elif not (
+                isinstance(data, networkx.Graph) and
+                data.is_directed() == template.is_directed() and
+                data.is_multigraph() == template.is_multigraph()
+        ):
+            data = networkx.convert.to_networkx_graph(
+                data, create_using=template
+            )
+        branch = self.branch
+        rev = self.rev
+        directed = data.is_directed()
+        graph_val = dict(data.graph)
+        graph_val.update(attr)
+
+        def edges():
+            if data.is_multigraph():
+                for (u, v, k, d) in data.edges(keys=True, data=True):
+                    # same order as MultiGraphSuccessorsMapping.Successors
+                    if not directed:
+                        (u, v) = ordered_nodes(u, v)
+                    yield (u, v, k, d)
+            else:
+                # undirected edges get stored both ways, same as when
+                # networkx adds them
+                for (u, v, d) in data.edges(data=True):
+                    yield (u, v, 0, d)
+                    if not directed and u != v:
+                        yield (v, u, 0, d)
+
+        def write(table, rows):
+            if not self.caching:
+                self.db.bulk_insert(table, rows)
+                return
+            cache = getattr(self, '_' + table + '_cache').new(name)
+
+            def cacherows():
+                for row in rows:
+                    cache.window(row[1:-2])[row[-2]] = row[-1]
+                    yield row
+            self.db.bulk_insert(table, cacherows())
+
+        write('graph_val', (
+            (name, k, branch, rev, v) for (k, v) in graph_val.items()
+        ))
+        write('nodes', ((name, n, branch, rev, True) for n in data.nodes()))
+        write('node_val', (
+            (name, n, k, branch, rev, v)
+            for (n, d) in data.nodes(data=True)
+            for (k, v) in d.items()
+        ))
+        write('edges', (
+            (name, u, v, i, branch, rev, True) for (u, v, i, d) in edges()
+        ))
+        if self.caching:
+            self._adjacency_indices.pop(name, None)
+            self._cursor.edge_changes_seen.pop(name, None)
+        write('edge_val', (
+            (name, u, v, i, k, branch, rev, val)
+            for (u, v, i, d) in edges()
+            for (k, val) in d.items()
+        ))
+
     def new_graph(self, name, data=None, **attr):
         """Return a new instance of type Graph, initialized with the given
         data if provided.
 
         """
         self._init_graph(name, 'Graph')
-        return Graph(self, name, data, **attr)
+        self._bulk_load(name, 'Graph', data, attr)
+        return Graph(self, name)
 
     def new_digraph(self, name, data=None, **attr):
         """Return a new instance of type DiGraph, initialized with the given
@@ -309,7 +606,8 @@ class ORM(object):
 
         """
         self._init_graph(name, 'DiGraph')
-        return DiGraph(self, name, data, **attr)
+        self._bulk_load(name, 'DiGraph', data, attr)
+        return DiGraph(self, name)
 
     def new_multigraph(self, name, data=None, **attr):
         """Return a new instance of type MultiGraph, initialized with the given
@@ -317,7 +615,8 @@ class ORM(object):
 
         """
         self._init_graph(name, 'MultiGraph')
-        return MultiGraph(self, name, data, **attr)
+        self._bulk_load(name, 'MultiGraph', data, attr)
+        return MultiGraph(self, name)
 
     def new_multidigraph(self, name, data=None, **attr):
         """Return a new instance of type MultiDiGraph, initialized with the given
@@ -325,7 +624,8 @@ class ORM(object):
 
         """
         self._init_graph(name, 'MultiDiGraph')
-        return MultiDiGraph(self, name, data, **attr)
+        self._bulk_load(name, 'MultiDiGraph', data, attr)
+        return MultiDiGraph(self, name)
 
     def get_graph(self, name):
         """Return a graph previously created with ``new_graph``,
@@ -349,26 +649,107 @@ class ORM(object):
         # make sure the graph exists before deleting anything
         self.get_graph(name)
         self.db.del_graph(name)
+        if self.caching:
+            for cache in (
+                    self._graph_val_cache,
+                    self._node_val_cache,
+                    self._nodes_cache,
+                    self._edge_val_cache,
+                    self._edges_cache,
+                    self._adjacency_indices
+            ):
+                cache.pop(name, None)
+            if self.threadsafe:
+                # other threads' indices were caught up with this log,
+                # so without it they'll know to start over
+                self._edge_changes.pop(name, None)
+                self._cursor.edge_changes_seen.pop(name, None)
+
+    def _adjacency(self, graph):
+        """Private use. Return the :class:`AdjacencyIndex` for the graph
+        thus named, brought up to date with the present branch and
+        revision.
+
+        """
+        cursor = self._cursor
+        index = cursor.adjacency.get(graph)
+        if self.threadsafe and index is not None and \
+                cursor.edge_changes_seen[graph][0] is not \
+                self._edge_changes.get(graph):
+            # the graph was deleted since I made the index
+            index = None
+        if index is None:
+            edges = self._edges_cache[graph]
+            with self.lock:
+                # reading all the edges, so nobody may add any meanwhile
+                index = AdjacencyIndex(edges)
+                index.seek(self.branch, self.rev, self._active_branches)
+                if self.threadsafe:
+                    changes = self._edge_changes.setdefault(graph, [])
+                    cursor.edge_changes_seen[graph] = (changes, len(changes))
+            cursor.adjacency[graph] = index
+        if self.threadsafe:
+            (changes, seen) = cursor.edge_changes_seen[graph]
+            n = len(changes)
+            for change in changes[seen:n]:
+                index.changed(*change)
+            cursor.edge_changes_seen[graph] = (changes, n)
+        index.seek(self.branch, self.rev, self._active_branches)
+        return index
+
+    def _exist_edge(self, graph, nodeA, nodeB, idx, extant):
+        """Private use. Declare whether the edge exists at the present branch
+        and revision, in the database and, if caching, in the edges
+        cache and adjacency index.
+
+        """
+        branch = self.branch
+        rev = self.rev
+        with self.lock:
+            self.db.exist_edge(graph, nodeA, nodeB, idx, branch, rev, extant)
+            if not self.caching:
+                return
+            self._edges_cache[graph].window(
+                (nodeA, nodeB, idx, branch)
+            )[rev] = extant
+            if self.threadsafe:
+                self._edge_changes.setdefault(graph, []).append(
+                    (nodeA, nodeB, idx, branch, rev)
+                )
+            elif graph in self._adjacency_indices:
+                self._adjacency_indices[graph].changed(
+                    nodeA, nodeB, idx, branch, rev
+                )
 
     def _active_branches(self, branch=None, rev=None):
-        """Private use. Iterate over (branch, rev) pairs, where the branch is
-        a descendant of the previous (starting with whatever branch is
-        presently active and ending at 'master'), and the rev is the
-        latest revision in the branch that matters.
+        """Private use. Return a tuple of (branch, rev) pairs, where the
+        branch is a descendant of the previous (starting with whatever
+        branch is presently active and ending at 'master'), and the
+        rev is the latest revision in the branch that matters.
+
+        When caching, I compute the tuple for the present branch and
+        revision only once, and keep it until the cursor moves.
 
         """
-        b = branch or self.branch
-        r = rev or self.rev
         if self.caching:
-            yield b, r
+            cursor = self._cursor
+            if branch is None and rev is None:
+                if cursor.lineage is None:
+                    cursor.lineage = self._active_branches(
+                        cursor.branch, cursor.rev
+                    )
+                return cursor.lineage
+            b = cursor.branch if branch is None else branch
+            r = cursor.rev if rev is None else rev
+            lineage = [(b, r)]
             while b in self._branch_parents:
                 r = self._branch_start[b]
                 b = self._branch_parents[b]
-                yield b, r
-            return
-
-        for pair in self.db.active_branches(b, r):
-            yield pair
+                lineage.append((b, r))
+            return tuple(lineage)
+        b = self.branch if branch is None else branch
+        r = self.rev if rev is None else rev
+        return tuple(self.db.active_branches(b, r))
 
     def _branch_descendants(self, branch=None):
         """Iterate over all branches immediately descended from the current
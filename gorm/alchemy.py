@@ -9,6 +9,7 @@ from sqlalchemy import (
     Integer,
     Boolean,
     String,
+    LargeBinary,
     DateTime,
     MetaData,
     ForeignKey,
@@ -17,9 +18,11 @@ from sqlalchemy import (
     and_,
     null
 )
-from sqlalchemy.sql import bindparam
+from sqlalchemy.sql import bindparam, literal_column
 from sqlalchemy.sql.ddl import CreateTable, CreateIndex
-from sqlalchemy import create_engine
+from sqlalchemy.sql.expression import Insert
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy import create_engine, inspect
 from json import dumps
 
 length = 50
@@ -27,15 +30,89 @@ length = 50
 TEXT = String(length)
 
 
-def tables_for_meta(meta):
+class Upsert(Insert):
+    """An INSERT that updates the record with the same primary key
+    instead, if there is one.
+
+    """
+
+
+def upsert(table):
+    """Return an :class:`Upsert` into ``table``. Use ``values`` on it like
+    any insert; the values for columns not in the primary key are
+    the ones that get updated.
+
+    """
+    return Upsert(table)
+
+
+def _upsert_updates(insert):
+    return [
+        insert.table.c[name] for name in insert.parameters
+        if not insert.table.c[name].primary_key
+    ]
+
+
+@compiles(Upsert)
+def compile_upsert(insert, compiler, **kw):
+    """SQLite and PostgreSQL both have ``ON CONFLICT DO UPDATE``"""
+    quote = compiler.preparer.quote
+    return compiler.visit_insert(insert, **kw) + \
+        " ON CONFLICT ({}) DO UPDATE SET {}".format(
+            ", ".join(quote(c.name) for c in insert.table.primary_key),
+            ", ".join(
+                "{0} = excluded.{0}".format(quote(c.name))
+                for c in _upsert_updates(insert)
+            )
+        )
+
+
+@compiles(Upsert, 'mysql')
+def compile_upsert_mysql(insert, compiler, **kw):
+    quote = compiler.preparer.quote
+    return compiler.visit_insert(insert, **kw) + \
+        " ON DUPLICATE KEY UPDATE {}".format(
+            ", ".join(
+                "{0} = VALUES({0})".format(quote(c.name))
+                for c in _upsert_updates(insert)
+            )
+        )
+
+
+def dialect_supports_upsert(dialect):
+    """Can I compile an :class:`Upsert` that will work in this dialect?"""
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 24)
+    return dialect.name in ('postgresql', 'mysql')
+
+
+def tables_for_meta(meta, binary=False):
+    """Return a dictionary of the tables gorm uses, by name.
+
+    Values, and the keys of the ``global`` table, are stored however
+    the ORM's codec encodes them. If ``binary``, the codec encodes them
+    as ``bytes``, and they get BLOB columns instead of text.
+
+    Graph names, node names, and keys are encoded the same way, but
+    only once each, in the ``names`` table, which gives each an integer
+    ID. The other tables refer to them by ID, so that their indices
+    compare and store integers.
+
+    """
+    DATA = LargeBinary(length) if binary else TEXT
     return {
+        'names': Table(
+            'names', meta,
+            Column('id', Integer, primary_key=True, autoincrement=False),
+            Column('name', DATA, nullable=False, unique=True)
+        ),
         'global': Table(
             'global', meta,
-            Column('key', TEXT, primary_key=True),
+            Column('key', DATA, primary_key=True),
             Column('date', DateTime, nullable=True),
             Column('creator', TEXT, nullable=True),
             Column('description', TEXT, nullable=True),
-            Column('value', TEXT, nullable=True)
+            Column('value', DATA, nullable=True)
         ),
         'branches': Table(
             'branches', meta,
@@ -51,7 +128,8 @@ def tables_for_meta(meta):
         ),
         'graphs': Table(
             'graphs', meta,
-            Column('graph', TEXT, primary_key=True),
+            Column('graph', Integer, ForeignKey('names.id'),
+                   primary_key=True),
             Column('date', DateTime, nullable=True),
             Column('creator', TEXT, nullable=True),
             Column('description', TEXT, nullable=True),
@@ -62,22 +140,23 @@ def tables_for_meta(meta):
         ),
         'graph_val': Table(
             'graph_val', meta,
-            Column('graph', TEXT, ForeignKey('graphs.graph'),
+            Column('graph', Integer, ForeignKey('graphs.graph'),
+                   primary_key=True),
+            Column('key', Integer, ForeignKey('names.id'),
                    primary_key=True),
-            Column('key', TEXT, primary_key=True),
             Column('branch', TEXT, ForeignKey('branches.branch'),
                    primary_key=True, default='master'),
             Column('rev', Integer, primary_key=True, default=0),
             Column('date', DateTime, nullable=True),
             Column('contributor', TEXT, nullable=True),
             Column('description', TEXT, nullable=True),
-            Column('value', TEXT, nullable=True)
+            Column('value', DATA, nullable=True)
         ),
         'nodes': Table(
             'nodes', meta,
-            Column('graph', TEXT, ForeignKey('graphs.graph'),
+            Column('graph', Integer, ForeignKey('graphs.graph'),
                    primary_key=True),
-            Column('node', TEXT, primary_key=True),
+            Column('node', Integer, primary_key=True),
             Column('branch', TEXT, ForeignKey('branches.branch'),
                    primary_key=True, default='master'),
             Column('rev', Integer, primary_key=True, default=0),
@@ -88,26 +167,27 @@ def tables_for_meta(meta):
         ),
         'node_val': Table(
             'node_val', meta,
-            Column('graph', TEXT, primary_key=True),
-            Column('node', TEXT, primary_key=True),
-            Column('key', TEXT, primary_key=True),
+            Column('graph', Integer, primary_key=True),
+            Column('node', Integer, primary_key=True),
+            Column('key', Integer, ForeignKey('names.id'),
+                   primary_key=True),
             Column('branch', TEXT, ForeignKey('branches.branch'),
                    primary_key=True, default='master'),
             Column('rev', Integer, primary_key=True, default=0),
             Column('date', DateTime, nullable=True),
             Column('contributor', TEXT, nullable=True),
             Column('description', TEXT, nullable=True),
-            Column('value', TEXT, nullable=True),
+            Column('value', DATA, nullable=True),
             ForeignKeyConstraint(
                 ['graph', 'node'], ['nodes.graph', 'nodes.node']
             )
         ),
         'edges': Table(
             'edges', meta,
-            Column('graph', TEXT, ForeignKey('graphs.graph'),
+            Column('graph', Integer, ForeignKey('graphs.graph'),
                    primary_key=True),
-            Column('nodeA', TEXT, primary_key=True),
-            Column('nodeB', TEXT, primary_key=True),
+            Column('nodeA', Integer, primary_key=True),
+            Column('nodeB', Integer, primary_key=True),
             Column('idx', Integer, primary_key=True),
             Column('branch', TEXT, ForeignKey('branches.branch'),
                    primary_key=True, default='master'),
@@ -125,57 +205,163 @@ def tables_for_meta(meta):
         ),
         'edge_val': Table(
             'edge_val', meta,
-            Column('graph', TEXT, primary_key=True),
-            Column('nodeA', TEXT, primary_key=True),
-            Column('nodeB', TEXT, primary_key=True),
+            Column('graph', Integer, primary_key=True),
+            Column('nodeA', Integer, primary_key=True),
+            Column('nodeB', Integer, primary_key=True),
             Column('idx', Integer, primary_key=True),
-            Column('key', TEXT, primary_key=True),
+            Column('key', Integer, ForeignKey('names.id'),
+                   primary_key=True),
             Column('branch', TEXT, ForeignKey('branches.branch'),
                    primary_key=True, default='master'),
             Column('rev', Integer, primary_key=True, default=0),
             Column('date', DateTime, nullable=True),
             Column('contributor', TEXT, nullable=True),
             Column('description', TEXT, nullable=True),
-            Column('value', TEXT, nullable=True),
+            Column('value', DATA, nullable=True),
             ForeignKeyConstraint(
                 ['graph', 'nodeA', 'nodeB', 'idx'],
                 ['edges.graph', 'edges.nodeA', 'edges.nodeB', 'edges.idx']
             )
+        ),
+        'keyframes': Table(
+            'keyframes', meta,
+            Column('graph', Integer, ForeignKey('graphs.graph'),
+                   primary_key=True),
+            Column('branch', TEXT, ForeignKey('branches.branch'),
+                   primary_key=True, default='master'),
+            Column('rev', Integer, primary_key=True, default=0)
+        ),
+        'graph_val_keyframes': Table(
+            'graph_val_keyframes', meta,
+            Column('graph', Integer, primary_key=True),
+            Column('branch', TEXT, primary_key=True),
+            Column('rev', Integer, primary_key=True),
+            Column('key', Integer, primary_key=True),
+            Column('value', DATA),
+            ForeignKeyConstraint(
+                ['graph', 'branch', 'rev'],
+                ['keyframes.graph', 'keyframes.branch', 'keyframes.rev']
+            )
+        ),
+        'nodes_keyframes': Table(
+            'nodes_keyframes', meta,
+            Column('graph', Integer, primary_key=True),
+            Column('branch', TEXT, primary_key=True),
+            Column('rev', Integer, primary_key=True),
+            Column('node', Integer, primary_key=True),
+            ForeignKeyConstraint(
+                ['graph', 'branch', 'rev'],
+                ['keyframes.graph', 'keyframes.branch', 'keyframes.rev']
+            )
+        ),
+        'node_val_keyframes': Table(
+            'node_val_keyframes', meta,
+            Column('graph', Integer, primary_key=True),
+            Column('branch', TEXT, primary_key=True),
+            Column('rev', Integer, primary_key=True),
+            Column('node', Integer, primary_key=True),
+            Column('key', Integer, primary_key=True),
+            Column('value', DATA),
+            ForeignKeyConstraint(
+                ['graph', 'branch', 'rev'],
+                ['keyframes.graph', 'keyframes.branch', 'keyframes.rev']
+            )
+        ),
+        'edges_keyframes': Table(
+            'edges_keyframes', meta,
+            Column('graph', Integer, primary_key=True),
+            Column('branch', TEXT, primary_key=True),
+            Column('rev', Integer, primary_key=True),
+            Column('nodeA', Integer, primary_key=True),
+            Column('nodeB', Integer, primary_key=True),
+            Column('idx', Integer, primary_key=True),
+            ForeignKeyConstraint(
+                ['graph', 'branch', 'rev'],
+                ['keyframes.graph', 'keyframes.branch', 'keyframes.rev']
+            )
+        ),
+        'edge_val_keyframes': Table(
+            'edge_val_keyframes', meta,
+            Column('graph', Integer, primary_key=True),
+            Column('branch', TEXT, primary_key=True),
+            Column('rev', Integer, primary_key=True),
+            Column('nodeA', Integer, primary_key=True),
+            Column('nodeB', Integer, primary_key=True),
+            Column('idx', Integer, primary_key=True),
+            Column('key', Integer, primary_key=True),
+            Column('value', DATA),
+            ForeignKeyConstraint(
+                ['graph', 'branch', 'rev'],
+                ['keyframes.graph', 'keyframes.branch', 'keyframes.rev']
+            )
         )
     }
 
 
 def indices_for_table_dict(table):
+    """Return a dictionary of the indices gorm uses, besides the primary
+    keys.
+
+    Most queries want the latest revision of each key in one branch
+    of one graph, no later than some revision, so these are ordered
+    graph, branch, the key columns, then revision, and hold whatever
+    else such a query reads, so it needn't go to the table.
+    ``edges_reverse`` is for finding the predecessors of a node.
+
+    """
     return {
         'graph_val': Index(
-            "graph_val_idx",
+            "graph_val_branch_idx",
             table['graph_val'].c.graph,
-            table['graph_val'].c.key
+            table['graph_val'].c.branch,
+            table['graph_val'].c.key,
+            table['graph_val'].c.rev
         ),
         'nodes': Index(
-            "nodes_idx",
+            "nodes_branch_idx",
             table['nodes'].c.graph,
-            table['nodes'].c.node
+            table['nodes'].c.branch,
+            table['nodes'].c.node,
+            table['nodes'].c.rev,
+            table['nodes'].c.extant
         ),
         'node_val': Index(
-            "node_val_idx",
+            "node_val_branch_idx",
             table['node_val'].c.graph,
-            table['node_val'].c.node
+            table['node_val'].c.branch,
+            table['node_val'].c.node,
+            table['node_val'].c.key,
+            table['node_val'].c.rev
         ),
         'edges': Index(
-            "edges_idx",
+            "edges_branch_idx",
             table['edges'].c.graph,
+            table['edges'].c.branch,
             table['edges'].c.nodeA,
             table['edges'].c.nodeB,
-            table['edges'].c.idx
+            table['edges'].c.idx,
+            table['edges'].c.rev,
+            table['edges'].c.extant
+        ),
+        'edges_reverse': Index(
+            "edges_reverse_idx",
+            table['edges'].c.graph,
+            table['edges'].c.nodeB,
+            table['edges'].c.nodeA,
+            table['edges'].c.idx,
+            table['edges'].c.branch,
+            table['edges'].c.rev,
+            table['edges'].c.extant
         ),
         'edge_val': Index(
-            "edge_val_idx",
+            "edge_val_branch_idx",
             table['edge_val'].c.graph,
+            table['edge_val'].c.branch,
             table['edge_val'].c.nodeA,
             table['edge_val'].c.nodeB,
             table['edge_val'].c.idx,
-            table['edge_val'].c.key
+            table['edge_val'].c.key,
+            table['edge_val'].c.rev
         )
     }
 
@@ -317,11 +503,96 @@ def queries_for_table_dict(table):
                 table['edge_val'].c.nodeA == hirev.c.nodeA,
                 table['edge_val'].c.nodeB == hirev.c.nodeB,
                 table['edge_val'].c.idx == hirev.c.idx,
+                table['edge_val'].c.key == hirev.c.key,
                 table['edge_val'].c.branch == hirev.c.branch,
                 table['edge_val'].c.rev == hirev.c.rev
             )
         )
 
+    def keyframe_wheres(tab):
+        return and_(
+            table[tab].c.graph == bindparam('graph'),
+            table[tab].c.branch == bindparam('branch'),
+            table[tab].c.rev == bindparam('rev')
+        )
+
+    def lineage():
+        """The branch and revision given, then the branch it came from and
+        the revision it started at, and so on back to master.
+        ``depth`` counts how many branches back we've gone.
+
+        """
+        lin = select(
+            [
+                bindparam('branch', type_=TEXT).label('branch'),
+                bindparam('rev', type_=Integer).label('rev'),
+                literal_column('0').label('depth')
+            ]
+        ).cte('lineage', recursive=True)
+        return lin.union_all(
+            select(
+                [
+                    table['branches'].c.parent,
+                    table['branches'].c.parent_rev,
+                    lin.c.depth + literal_column('1')
+                ]
+            ).where(
+                and_(
+                    table['branches'].c.branch == lin.c.branch,
+                    lin.c.branch != literal_column("'master'")
+                )
+            )
+        )
+
+    def lineage_join(tab, keys, wheres):
+        """Join ``tab`` to the most recent record of each key in each
+        branch of the lineage.
+
+        Return the join and the subquery, whose ``depth`` column you
+        should order by, so that the nearest branch comes first.
+
+        """
+        t = table[tab]
+        lin = lineage()
+        cols = [t.c[k] for k in keys] + [t.c.branch]
+        hirev = select(
+            cols + [lin.c.depth, func.MAX(t.c.rev).label('rev')]
+        ).select_from(
+            t.join(
+                lin,
+                and_(
+                    t.c.branch == lin.c.branch,
+                    t.c.rev <= lin.c.rev
+                )
+            )
+        ).where(and_(*wheres)).group_by(*cols + [lin.c.depth]).alias('hirev')
+        return (
+            t.join(
+                hirev,
+                and_(*[
+                    t.c[k] == hirev.c[k] for k in keys + ['branch', 'rev']
+                ])
+            ),
+            hirev
+        )
+
+    def lineage_select(tab, columns, keys, wheres):
+        (join, hirev) = lineage_join(tab, keys, wheres)
+        return select(
+            [table[tab].c[col] for col in columns]
+        ).select_from(join).order_by(hirev.c.depth)
+
+    def lineage_first(tab, columns, keys, wheres):
+        """Like ``lineage_select``, but only the record from the nearest
+        branch.
+
+        """
+        # literal, and with an offset, so that neither becomes a
+        # parameter of the precompiled queries
+        return lineage_select(tab, columns, keys, wheres).limit(
+            literal_column('1')
+        ).offset(literal_column('0'))
+
     return {
         'ctbranch': select(
             [func.COUNT(table['branches'].c.branch)]
@@ -340,6 +611,16 @@ def queries_for_table_dict(table):
                 table['branches'].c.parent_rev
             ]
         ),
+        'names_dump': select(
+            [
+                table['names'].c.id,
+                table['names'].c.name
+            ]
+        ),
+        'name_ins': table['names'].insert().values(
+            id=bindparam('id'),
+            name=bindparam('name')
+        ),
         'global_get': select(
             [table['global'].c.value]
         ).where(
@@ -363,6 +644,7 @@ def queries_for_table_dict(table):
                 table['edge_val'].c.nodeA == bindparam('orig'),
                 table['edge_val'].c.nodeB == bindparam('dest'),
                 table['edge_val'].c.idx == bindparam('idx'),
+                table['edge_val'].c.key == bindparam('key'),
                 table['edge_val'].c.branch == bindparam('branch'),
                 table['edge_val'].c.rev == bindparam('rev')
             )
@@ -393,12 +675,18 @@ def queries_for_table_dict(table):
         'del_edge_val_graph': table['edge_val'].delete().where(
             table['edge_val'].c.graph == bindparam('graph')
         ),
+        'del_edge_graph': table['edges'].delete().where(
+            table['edges'].c.graph == bindparam('graph')
+        ),
         'del_node_val_graph': table['node_val'].delete().where(
             table['node_val'].c.graph == bindparam('graph')
         ),
         'del_node_graph': table['nodes'].delete().where(
             table['nodes'].c.graph == bindparam('graph')
         ),
+        'del_graph_val_graph': table['graph_val'].delete().where(
+            table['graph_val'].c.graph == bindparam('graph')
+        ),
         'del_graph': table['graphs'].delete().where(
             table['graphs'].c.graph == bindparam('graph')
         ),
@@ -424,30 +712,14 @@ def queries_for_table_dict(table):
         'global_del': table['global'].delete().where(
             table['global'].c.key == bindparam('key')
         ),
-        'nodes_extant': select(
-            [table['nodes'].c.node]
-        ).select_from(
-            hirev_nodes_join(
-                [
-                    table['nodes'].c.graph == bindparam('graph'),
-                    table['nodes'].c.branch == bindparam('branch'),
-                    table['nodes'].c.rev <= bindparam('rev')
-                ]
-            )
-        ).where(
-            table['nodes'].c.extant
-        ),
-        'node_exists': select(
-            [table['nodes'].c.extant]
-        ).select_from(
-            hirev_nodes_join(
-                [
-                    table['nodes'].c.graph == bindparam('graph'),
-                    table['nodes'].c.node == bindparam('node'),
-                    table['nodes'].c.branch == bindparam('branch'),
-                    table['nodes'].c.rev <= bindparam('rev')
-                ]
-            )
+        'node_exists': lineage_first(
+            'nodes',
+            ['extant'],
+            ['graph', 'node'],
+            [
+                table['nodes'].c.graph == bindparam('graph'),
+                table['nodes'].c.node == bindparam('node')
+            ]
         ),
         'exist_node_ins': table['nodes'].insert().values(
             graph=bindparam('graph'),
@@ -473,19 +745,14 @@ def queries_for_table_dict(table):
             table['nodes'].c.rev,
             table['nodes'].c.extant
         ]),
-        'graph_val_items': select(
-            [
-                table['graph_val'].c.key,
-                table['graph_val'].c.value
-            ]
-        ).select_from(
-            hirev_graph_val_join(
-                [
-                    table['graph_val'].c.graph == bindparam('graph'),
-                    table['graph_val'].c.branch == bindparam('branch'),
-                    table['graph_val'].c.rev <= bindparam('rev')
-                ]
-            )
+        'nodes_dump_graph': select([
+            table['nodes'].c.graph,
+            table['nodes'].c.node,
+            table['nodes'].c.branch,
+            table['nodes'].c.rev,
+            table['nodes'].c.extant
+        ]).where(
+            table['nodes'].c.graph == bindparam('graph')
         ),
         'graph_val_dump': select([
             table['graph_val'].c.graph,
@@ -494,19 +761,23 @@ def queries_for_table_dict(table):
             table['graph_val'].c.rev,
             table['graph_val'].c.value
         ]),
-        'graph_val_get': select(
+        'graph_val_dump_graph': select([
+            table['graph_val'].c.graph,
+            table['graph_val'].c.key,
+            table['graph_val'].c.branch,
+            table['graph_val'].c.rev,
+            table['graph_val'].c.value
+        ]).where(
+            table['graph_val'].c.graph == bindparam('graph')
+        ),
+        'graph_val_get': lineage_first(
+            'graph_val',
+            ['value'],
+            ['graph', 'key'],
             [
-                table['graph_val'].c.value
+                table['graph_val'].c.graph == bindparam('graph'),
+                table['graph_val'].c.key == bindparam('key')
             ]
-        ).select_from(
-            hirev_graph_val_join(
-                [
-                    table['graph_val'].c.graph == bindparam('graph'),
-                    table['graph_val'].c.key == bindparam('key'),
-                    table['graph_val'].c.branch == bindparam('branch'),
-                    table['graph_val'].c.rev <= bindparam('rev')
-                ]
-            )
         ),
         'graph_val_ins': table['graph_val'].insert().values(
             graph=bindparam('graph'),
@@ -525,21 +796,6 @@ def queries_for_table_dict(table):
                 table['graph_val'].c.rev == bindparam('rev')
             )
         ),
-        'node_val_items': select(
-            [
-                table['node_val'].c.key,
-                table['node_val'].c.value
-            ]
-        ).select_from(
-            node_val_hirev_join(
-                [
-                    table['node_val'].c.graph == bindparam('graph'),
-                    table['node_val'].c.node == bindparam('node'),
-                    table['node_val'].c.branch == bindparam('branch'),
-                    table['node_val'].c.rev <= bindparam('rev')
-                ]
-            )
-        ),
         'node_val_dump': select([
             table['node_val'].c.graph,
             table['node_val'].c.node,
@@ -548,23 +804,51 @@ def queries_for_table_dict(table):
             table['node_val'].c.rev,
             table['node_val'].c.value
         ]),
-        'node_val_get': select(
+        'node_val_dump_graph': select([
+            table['node_val'].c.graph,
+            table['node_val'].c.node,
+            table['node_val'].c.key,
+            table['node_val'].c.branch,
+            table['node_val'].c.rev,
+            table['node_val'].c.value
+        ]).where(
+            table['node_val'].c.graph == bindparam('graph')
+        ),
+        'node_val_get': lineage_first(
+            'node_val',
+            ['value', 'branch', 'rev'],
+            ['graph', 'node', 'key'],
             [
-                table['node_val'].c.value
+                table['node_val'].c.graph == bindparam('graph'),
+                table['node_val'].c.node == bindparam('node'),
+                table['node_val'].c.key == bindparam('key')
             ]
-        ).select_from(
-            node_val_hirev_join(
-                [
-                    table['node_val'].c.graph == bindparam('graph'),
-                    table['node_val'].c.node == bindparam('node'),
-                    table['node_val'].c.key == bindparam('key'),
-                    table['node_val'].c.branch == bindparam('branch'),
-                    table['node_val'].c.rev <= bindparam('rev')
-                ]
-            )
+        ),
+        'node_val_at': select(
+            [table['node_val'].c.value]
         ).where(
-            table['node_val'].c.value != null()
+            and_(
+                table['node_val'].c.graph == bindparam('graph'),
+                table['node_val'].c.node == bindparam('node'),
+                table['node_val'].c.key == bindparam('key'),
+                table['node_val'].c.branch == bindparam('branch'),
+                table['node_val'].c.rev == bindparam('rev')
+            )
         ),
+        'node_val_later': select(
+            [
+                table['node_val'].c.rev,
+                table['node_val'].c.value
+            ]
+        ).where(
+            and_(
+                table['node_val'].c.graph == bindparam('graph'),
+                table['node_val'].c.node == bindparam('node'),
+                table['node_val'].c.key == bindparam('key'),
+                table['node_val'].c.branch == bindparam('branch'),
+                table['node_val'].c.rev > bindparam('rev')
+            )
+        ).order_by(table['node_val'].c.rev),
         'node_val_ins': table['node_val'].insert().values(
             graph=bindparam('graph'),
             node=bindparam('node'),
@@ -584,79 +868,44 @@ def queries_for_table_dict(table):
                 table['node_val'].c.rev == bindparam('rev')
             )
         ),
-        'edge_exists': select(
-            [table['edges'].c.extant]
-        ).select_from(
-            edges_recent_join(
-                [
-                    table['edges'].c.graph == bindparam('graph'),
-                    table['edges'].c.nodeA == bindparam('nodeA'),
-                    table['edges'].c.nodeB == bindparam('nodeB'),
-                    table['edges'].c.idx == bindparam('idx'),
-                    table['edges'].c.branch == bindparam('branch'),
-                    table['edges'].c.rev <= bindparam('rev')
-                ]
-            )
-        ),
-        'edges_extant': select(
+        'edge_exists': lineage_first(
+            'edges',
+            ['extant'],
+            ['graph', 'nodeA', 'nodeB', 'idx'],
             [
-                table['edges'].c.nodeA,
-                table['edges'].c.extant
+                table['edges'].c.graph == bindparam('graph'),
+                table['edges'].c.nodeA == bindparam('orig'),
+                table['edges'].c.nodeB == bindparam('dest'),
+                table['edges'].c.idx == bindparam('idx')
             ]
-        ).select_from(
-            edges_recent_join(
-                [
-                    table['edges'].c.graph == bindparam('graph'),
-                    table['edges'].c.branch == bindparam('branch'),
-                    table['edges'].c.rev <= bindparam('rev')
-                ]
-            )
         ),
-        'nodeAs': select(
+        'nodeAs': lineage_select(
+            'edges',
+            ['nodeA', 'idx', 'extant'],
+            ['graph', 'nodeA', 'nodeB', 'idx'],
             [
-                table['edges'].c.nodeA,
-                table['edges'].c.extant
+                table['edges'].c.graph == bindparam('graph'),
+                table['edges'].c.nodeB == bindparam('dest')
             ]
-        ).select_from(
-            edges_recent_join(
-                [
-                    table['edges'].c.graph == bindparam('graph'),
-                    table['edges'].c.nodeB == bindparam('dest'),
-                    table['edges'].c.branch == bindparam('branch'),
-                    table['edges'].c.rev <= bindparam('rev')
-                ]
-            )
         ),
-        'nodeBs': select(
+        'nodeBs': lineage_select(
+            'edges',
+            ['nodeB', 'idx', 'extant'],
+            ['graph', 'nodeA', 'nodeB', 'idx'],
             [
-                table['edges'].c.nodeB,
-                table['edges'].c.extant
+                table['edges'].c.graph == bindparam('graph'),
+                table['edges'].c.nodeA == bindparam('orig')
             ]
-        ).select_from(
-            edges_recent_join(
-                [
-                    table['edges'].c.graph == bindparam('graph'),
-                    table['edges'].c.nodeA == bindparam('orig'),
-                    table['edges'].c.branch == bindparam('branch'),
-                    table['edges'].c.rev <= bindparam('rev')
-                ]
-            )
         ),
-        'multi_edges': select(
+        'multi_edges': lineage_select(
+            'edges',
+            ['idx', 'extant'],
+            ['graph', 'nodeA', 'nodeB', 'idx'],
             [
-                table['edges'].c.idx,
-                table['edges'].c.extant
+                table['edges'].c.graph == bindparam('graph'),
+                table['edges'].c.nodeA == bindparam('orig'),
+                table['edges'].c.nodeB == bindparam('dest')
             ]
-        ).select_from(
-            edges_recent_join(
-                [
-                    table['edges'].c.graph == bindparam('graph'),
-                    table['edges'].c.nodeA == bindparam('orig'),
-                    table['edges'].c.nodeB == bindparam('dest'),
-                    table['edges'].c.branch == bindparam('branch'),
-                    table['edges'].c.rev <= bindparam('rev')
-                ]
-            )
         ),
         'edges_dump': select([
             table['edges'].c.graph,
@@ -667,6 +916,17 @@ def queries_for_table_dict(table):
             table['edges'].c.rev,
             table['edges'].c.extant
         ]),
+        'edges_dump_graph': select([
+            table['edges'].c.graph,
+            table['edges'].c.nodeA,
+            table['edges'].c.nodeB,
+            table['edges'].c.idx,
+            table['edges'].c.branch,
+            table['edges'].c.rev,
+            table['edges'].c.extant
+        ]).where(
+            table['edges'].c.graph == bindparam('graph')
+        ),
         'edge_exist_ins': table['edges'].insert().values(
             graph=bindparam('graph'),
             nodeA=bindparam('orig'),
@@ -698,8 +958,268 @@ def queries_for_table_dict(table):
             table['edge_val'].c.rev,
             table['edge_val'].c.value
         ]),
-        'edge_val_items': select(
+        'edge_val_dump_graph': select([
+            table['edge_val'].c.graph,
+            table['edge_val'].c.nodeA,
+            table['edge_val'].c.nodeB,
+            table['edge_val'].c.idx,
+            table['edge_val'].c.key,
+            table['edge_val'].c.branch,
+            table['edge_val'].c.rev,
+            table['edge_val'].c.value
+        ]).where(
+            table['edge_val'].c.graph == bindparam('graph')
+        ),
+        'edge_val_get': lineage_first(
+            'edge_val',
+            ['value', 'branch', 'rev'],
+            ['graph', 'nodeA', 'nodeB', 'idx', 'key'],
+            [
+                table['edge_val'].c.graph == bindparam('graph'),
+                table['edge_val'].c.nodeA == bindparam('orig'),
+                table['edge_val'].c.nodeB == bindparam('dest'),
+                table['edge_val'].c.idx == bindparam('idx'),
+                table['edge_val'].c.key == bindparam('key')
+            ]
+        ),
+        'edge_val_at': select(
+            [table['edge_val'].c.value]
+        ).where(
+            and_(
+                table['edge_val'].c.graph == bindparam('graph'),
+                table['edge_val'].c.nodeA == bindparam('orig'),
+                table['edge_val'].c.nodeB == bindparam('dest'),
+                table['edge_val'].c.idx == bindparam('idx'),
+                table['edge_val'].c.key == bindparam('key'),
+                table['edge_val'].c.branch == bindparam('branch'),
+                table['edge_val'].c.rev == bindparam('rev')
+            )
+        ),
+        'edge_val_later': select(
+            [
+                table['edge_val'].c.rev,
+                table['edge_val'].c.value
+            ]
+        ).where(
+            and_(
+                table['edge_val'].c.graph == bindparam('graph'),
+                table['edge_val'].c.nodeA == bindparam('orig'),
+                table['edge_val'].c.nodeB == bindparam('dest'),
+                table['edge_val'].c.idx == bindparam('idx'),
+                table['edge_val'].c.key == bindparam('key'),
+                table['edge_val'].c.branch == bindparam('branch'),
+                table['edge_val'].c.rev > bindparam('rev')
+            )
+        ).order_by(table['edge_val'].c.rev),
+        'keyframes_dump': select(
+            [
+                table['keyframes'].c.graph,
+                table['keyframes'].c.branch,
+                table['keyframes'].c.rev
+            ]
+        ),
+        'keyframe_ins': table['keyframes'].insert().values(
+            graph=bindparam('graph'),
+            branch=bindparam('branch'),
+            rev=bindparam('rev')
+        ),
+        'del_keyframe': table['keyframes'].delete().where(
+            keyframe_wheres('keyframes')
+        ),
+        'graph_val_keyframe': select(
+            [
+                table['graph_val_keyframes'].c.key,
+                table['graph_val_keyframes'].c.value
+            ]
+        ).where(keyframe_wheres('graph_val_keyframes')),
+        'graph_val_keyframe_ins': table['graph_val_keyframes'].insert().values(
+            graph=bindparam('graph'),
+            branch=bindparam('branch'),
+            rev=bindparam('rev'),
+            key=bindparam('key'),
+            value=bindparam('value')
+        ),
+        'del_graph_val_keyframe': table['graph_val_keyframes'].delete().where(
+            keyframe_wheres('graph_val_keyframes')
+        ),
+        'graph_val_delta': select(
+            [
+                table['graph_val'].c.key,
+                table['graph_val'].c.value
+            ]
+        ).select_from(
+            hirev_graph_val_join(
+                [
+                    table['graph_val'].c.graph == bindparam('graph'),
+                    table['graph_val'].c.branch == bindparam('branch'),
+                    table['graph_val'].c.rev > bindparam('since'),
+                    table['graph_val'].c.rev <= bindparam('rev')
+                ]
+            )
+        ),
+        'nodes_keyframe': select(
+            [table['nodes_keyframes'].c.node]
+        ).where(keyframe_wheres('nodes_keyframes')),
+        'nodes_keyframe_ins': table['nodes_keyframes'].insert().values(
+            graph=bindparam('graph'),
+            branch=bindparam('branch'),
+            rev=bindparam('rev'),
+            node=bindparam('node')
+        ),
+        'del_nodes_keyframe': table['nodes_keyframes'].delete().where(
+            keyframe_wheres('nodes_keyframes')
+        ),
+        'nodes_delta': select(
+            [
+                table['nodes'].c.node,
+                table['nodes'].c.extant
+            ]
+        ).select_from(
+            hirev_nodes_join(
+                [
+                    table['nodes'].c.graph == bindparam('graph'),
+                    table['nodes'].c.branch == bindparam('branch'),
+                    table['nodes'].c.rev > bindparam('since'),
+                    table['nodes'].c.rev <= bindparam('rev')
+                ]
+            )
+        ),
+        'node_val_keyframe': select(
+            [
+                table['node_val_keyframes'].c.node,
+                table['node_val_keyframes'].c.key,
+                table['node_val_keyframes'].c.value
+            ]
+        ).where(keyframe_wheres('node_val_keyframes')),
+        'node_val_keyframe_node': select(
+            [
+                table['node_val_keyframes'].c.key,
+                table['node_val_keyframes'].c.value
+            ]
+        ).where(
+            and_(
+                keyframe_wheres('node_val_keyframes'),
+                table['node_val_keyframes'].c.node == bindparam('node')
+            )
+        ),
+        'node_val_keyframe_ins': table['node_val_keyframes'].insert().values(
+            graph=bindparam('graph'),
+            branch=bindparam('branch'),
+            rev=bindparam('rev'),
+            node=bindparam('node'),
+            key=bindparam('key'),
+            value=bindparam('value')
+        ),
+        'del_node_val_keyframe': table['node_val_keyframes'].delete().where(
+            keyframe_wheres('node_val_keyframes')
+        ),
+        'node_val_delta': select(
+            [
+                table['node_val'].c.node,
+                table['node_val'].c.key,
+                table['node_val'].c.value
+            ]
+        ).select_from(
+            node_val_hirev_join(
+                [
+                    table['node_val'].c.graph == bindparam('graph'),
+                    table['node_val'].c.branch == bindparam('branch'),
+                    table['node_val'].c.rev > bindparam('since'),
+                    table['node_val'].c.rev <= bindparam('rev')
+                ]
+            )
+        ),
+        'node_val_delta_node': select(
+            [
+                table['node_val'].c.key,
+                table['node_val'].c.value
+            ]
+        ).select_from(
+            node_val_hirev_join(
+                [
+                    table['node_val'].c.graph == bindparam('graph'),
+                    table['node_val'].c.branch == bindparam('branch'),
+                    table['node_val'].c.rev > bindparam('since'),
+                    table['node_val'].c.rev <= bindparam('rev'),
+                    table['node_val'].c.node == bindparam('node')
+                ]
+            )
+        ),
+        'edges_keyframe': select(
+            [
+                table['edges_keyframes'].c.nodeA,
+                table['edges_keyframes'].c.nodeB,
+                table['edges_keyframes'].c.idx
+            ]
+        ).where(keyframe_wheres('edges_keyframes')),
+        'edges_keyframe_ins': table['edges_keyframes'].insert().values(
+            graph=bindparam('graph'),
+            branch=bindparam('branch'),
+            rev=bindparam('rev'),
+            nodeA=bindparam('orig'),
+            nodeB=bindparam('dest'),
+            idx=bindparam('idx')
+        ),
+        'del_edges_keyframe': table['edges_keyframes'].delete().where(
+            keyframe_wheres('edges_keyframes')
+        ),
+        'edges_delta': select(
+            [
+                table['edges'].c.nodeA,
+                table['edges'].c.nodeB,
+                table['edges'].c.idx,
+                table['edges'].c.extant
+            ]
+        ).select_from(
+            edges_recent_join(
+                [
+                    table['edges'].c.graph == bindparam('graph'),
+                    table['edges'].c.branch == bindparam('branch'),
+                    table['edges'].c.rev > bindparam('since'),
+                    table['edges'].c.rev <= bindparam('rev')
+                ]
+            )
+        ),
+        'edge_val_keyframe': select(
+            [
+                table['edge_val_keyframes'].c.nodeA,
+                table['edge_val_keyframes'].c.nodeB,
+                table['edge_val_keyframes'].c.idx,
+                table['edge_val_keyframes'].c.key,
+                table['edge_val_keyframes'].c.value
+            ]
+        ).where(keyframe_wheres('edge_val_keyframes')),
+        'edge_val_keyframe_edge': select(
+            [
+                table['edge_val_keyframes'].c.key,
+                table['edge_val_keyframes'].c.value
+            ]
+        ).where(
+            and_(
+                keyframe_wheres('edge_val_keyframes'),
+                table['edge_val_keyframes'].c.nodeA == bindparam('orig'),
+                table['edge_val_keyframes'].c.nodeB == bindparam('dest'),
+                table['edge_val_keyframes'].c.idx == bindparam('idx')
+            )
+        ),
+        'edge_val_keyframe_ins': table['edge_val_keyframes'].insert().values(
+            graph=bindparam('graph'),
+            branch=bindparam('branch'),
+            rev=bindparam('rev'),
+            nodeA=bindparam('orig'),
+            nodeB=bindparam('dest'),
+            idx=bindparam('idx'),
+            key=bindparam('key'),
+            value=bindparam('value')
+        ),
+        'del_edge_val_keyframe': table['edge_val_keyframes'].delete().where(
+            keyframe_wheres('edge_val_keyframes')
+        ),
+        'edge_val_delta': select(
             [
+                table['edge_val'].c.nodeA,
+                table['edge_val'].c.nodeB,
+                table['edge_val'].c.idx,
                 table['edge_val'].c.key,
                 table['edge_val'].c.value
             ]
@@ -707,37 +1227,81 @@ def queries_for_table_dict(table):
             edge_val_recent_join(
                 [
                     table['edge_val'].c.graph == bindparam('graph'),
-                    table['edge_val'].c.nodeA == bindparam('orig'),
-                    table['edge_val'].c.nodeB == bindparam('dest'),
-                    table['edge_val'].c.idx == bindparam('idx'),
                     table['edge_val'].c.branch == bindparam('branch'),
+                    table['edge_val'].c.rev > bindparam('since'),
                     table['edge_val'].c.rev <= bindparam('rev')
                 ]
             )
         ),
-        'edge_val_get': select(
+        'edge_val_delta_edge': select(
             [
+                table['edge_val'].c.key,
                 table['edge_val'].c.value
             ]
         ).select_from(
             edge_val_recent_join(
                 [
                     table['edge_val'].c.graph == bindparam('graph'),
+                    table['edge_val'].c.branch == bindparam('branch'),
+                    table['edge_val'].c.rev > bindparam('since'),
+                    table['edge_val'].c.rev <= bindparam('rev'),
                     table['edge_val'].c.nodeA == bindparam('orig'),
                     table['edge_val'].c.nodeB == bindparam('dest'),
-                    table['edge_val'].c.idx == bindparam('idx'),
-                    table['edge_val'].c.key == bindparam('key'),
-                    table['edge_val'].c.branch == bindparam('branch'),
-                    table['edge_val'].c.rev <= bindparam('rev')
+                    table['edge_val'].c.idx == bindparam('idx')
                 ]
             )
+        ),
+        'global_upsert': upsert(table['global']).values(
+            key=bindparam('key'),
+            value=bindparam('value')
+        ),
+        'graph_val_upsert': upsert(table['graph_val']).values(
+            graph=bindparam('graph'),
+            key=bindparam('key'),
+            branch=bindparam('branch'),
+            rev=bindparam('rev'),
+            value=bindparam('value')
+        ),
+        'exist_node_upsert': upsert(table['nodes']).values(
+            graph=bindparam('graph'),
+            node=bindparam('node'),
+            branch=bindparam('branch'),
+            rev=bindparam('rev'),
+            extant=bindparam('extant')
+        ),
+        'node_val_upsert': upsert(table['node_val']).values(
+            graph=bindparam('graph'),
+            node=bindparam('node'),
+            key=bindparam('key'),
+            branch=bindparam('branch'),
+            rev=bindparam('rev'),
+            value=bindparam('value')
+        ),
+        'edge_exist_upsert': upsert(table['edges']).values(
+            graph=bindparam('graph'),
+            nodeA=bindparam('orig'),
+            nodeB=bindparam('dest'),
+            idx=bindparam('idx'),
+            branch=bindparam('branch'),
+            rev=bindparam('rev'),
+            extant=bindparam('extant')
+        ),
+        'edge_val_upsert': upsert(table['edge_val']).values(
+            graph=bindparam('graph'),
+            nodeA=bindparam('orig'),
+            nodeB=bindparam('dest'),
+            idx=bindparam('idx'),
+            key=bindparam('key'),
+            branch=bindparam('branch'),
+            rev=bindparam('rev'),
+            value=bindparam('value')
         )
     }
 
 
-def compile_sql(dialect, meta):
+def compile_sql(dialect, meta, binary=False):
     r = {}
-    table = tables_for_meta(meta)
+    table = tables_for_meta(meta, binary)
     index = indices_for_table_dict(table)
     query = queries_for_table_dict(table)
 
@@ -755,11 +1319,53 @@ class Alchemist(object):
     """Holds an engine and runs queries on it.
 
     """
-    def __init__(self, engine):
+    def __init__(self, engine, binary=False):
         self.engine = engine
         self.conn = self.engine.connect()
         self.meta = MetaData()
-        self.sql = compile_sql(self.engine.dialect, self.meta)
+        self.sql = compile_sql(self.engine.dialect, self.meta, binary)
+        self.supports_upsert = dialect_supports_upsert(self.engine.dialect)
+
+    def update_indices(self, old=()):
+        """Create the indices in my metadata that the database lacks, and
+        drop any of those named in ``old``.
+
+        """
+        inspector = inspect(self.conn)
+        for table in self.meta.tables.values():
+            have = dict(
+                (idx['name'], idx['column_names'])
+                for idx in inspector.get_indexes(table.name)
+            )
+            # a copy of the table to drop from, so the index isn't
+            # added to my metadata, to be made again by create_all
+            copy = table.tometadata(MetaData())
+            for name in old:
+                if name in have:
+                    Index(name, *[copy.c[c] for c in have[name]]).drop(
+                        self.conn
+                    )
+            for idx in table.indexes:
+                if idx.name not in have:
+                    idx.create(self.conn)
+
+    def table_names(self):
+        """Return the names of the tables in the database."""
+        return inspect(self.conn).get_table_names()
+
+    def drop_indices(self):
+        """Drop those of the indices in my metadata that the database
+        has.
+
+        """
+        inspector = inspect(self.conn)
+        for table in self.meta.tables.values():
+            have = set(
+                idx['name'] for idx in inspector.get_indexes(table.name)
+            )
+            for idx in table.indexes:
+                if idx.name in have:
+                    idx.drop(self.conn)
 
     def ctbranch(self, branch):
         """Query to count the number of branches that exist."""
@@ -781,6 +1387,27 @@ class Alchemist(object):
             self.sql['allbranch']
         )
 
+    def names_dump(self):
+        """Iterate over the ``(id, name)`` of every name in use."""
+        return self.conn.execute(
+            self.sql['names_dump']
+        )
+
+    def name_ins(self, id, name):
+        """Give the encoded ``name`` the integer ``id``."""
+        return self.conn.execute(
+            self.sql['name_ins'],
+            id=id,
+            name=name
+        )
+
+    def name_ins_many(self, rows):
+        """Insert many ``(id, name)`` records at once"""
+        return self.conn.execute(
+            self.sql['name_ins'],
+            [dict(id=id, name=name) for (id, name) in rows]
+        )
+
     def global_get(self, key):
         """Get the value for a global key."""
         return self.conn.execute(
@@ -834,6 +1461,13 @@ class Alchemist(object):
             graph=graph
         )
 
+    def del_edge_graph(self, graph):
+        """Delete all edges from ``graph``."""
+        return self.conn.execute(
+            self.sql['del_edge_graph'],
+            graph=graph
+        )
+
     def del_node_val_graph(self, graph):
         """Delete all node attributes from ``graph``."""
         return self.conn.execute(
@@ -848,6 +1482,13 @@ class Alchemist(object):
             graph=graph
         )
 
+    def del_graph_val_graph(self, graph):
+        """Delete all attributes of ``graph`` itself."""
+        return self.conn.execute(
+            self.sql['del_graph_val_graph'],
+            graph=graph
+        )
+
     def del_graph(self, graph):
         """Delete the graph header."""
         return self.conn.execute(
@@ -886,7 +1527,7 @@ class Alchemist(object):
             value=value
         )
 
-    def global_upd(self, key, value):
+    def global_upd(self, value, key):
         """Update the existing global record for ``key`` so that it is set to
         ``value``.
 
@@ -897,6 +1538,17 @@ class Alchemist(object):
             value=value
         )
 
+    def global_upsert(self, key, value):
+        """Set the global ``key`` to ``value``, whether or not it has a
+        record already
+
+        """
+        return self.conn.execute(
+            self.sql['global_upsert'],
+            key=key,
+            value=value
+        )
+
     def global_del(self, key):
         """Delete the record for global variable ``key``."""
         return self.conn.execute(
@@ -904,16 +1556,7 @@ class Alchemist(object):
             key=key
         )
 
-    def nodes_extant(self, graph, branch, rev):
-        """Query for nodes that exist in ``graph`` at ``(branch, rev)``."""
-        return self.conn.execute(
-            self.sql['nodes_extant'],
-            graph=graph,
-            branch=branch,
-            rev=rev
-        )
-
-    def node_exists(self, graph, node, branch, rev):
+    def node_exists(self, branch, rev, graph, node):
         """Query for whether or not ``node`` exists in ``graph`` at ``(branch,
         rev)``.
 
@@ -940,34 +1583,68 @@ class Alchemist(object):
             extant=extant
         )
 
-    def exist_node_upd(self, extant, graph, node, branch, rev):
-        """Update the record previously inserted by ``exist_node_ins``,
-        indicating whether ``node`` exists in ``graph`` at ``(branch,
-        rev)``.
+    def exist_node_ins_many(self, rows):
+        """Insert many ``(graph, node, branch, rev, extant)`` records at
+        once
 
         """
         return self.conn.execute(
-            self.sql['exist_node_upd'],
-            extant=extant,
+            self.sql['exist_node_ins'],
+            [
+                dict(
+                    graph=graph,
+                    node=node,
+                    branch=branch,
+                    rev=rev,
+                    extant=extant
+                )
+                for (graph, node, branch, rev, extant) in rows
+            ]
+        )
+
+    def exist_node_upsert(self, graph, node, branch, rev, extant):
+        """Insert this record, or update it if it\'s there already"""
+        return self.conn.execute(
+            self.sql['exist_node_upsert'],
             graph=graph,
             node=node,
             branch=branch,
-            rev=rev
+            rev=rev,
+            extant=extant
         )
 
-    def graph_val_items(self, graph, branch, rev):
-        """Query the most recent keys and values for the attributes of
-        ``graph`` at ``(branch, rev)``.
+    def exist_node_upsert_many(self, rows):
+        """Run ``exist_node_upsert`` on many records at once"""
+        return self.conn.execute(
+            self.sql['exist_node_upsert'],
+            [
+                dict(
+                    graph=graph,
+                    node=node,
+                    branch=branch,
+                    rev=rev,
+                    extant=extant
+                )
+                for (graph, node, branch, rev, extant) in rows
+            ]
+        )
+
+    def exist_node_upd(self, extant, graph, node, branch, rev):
+        """Update the record previously inserted by ``exist_node_ins``,
+        indicating whether ``node`` exists in ``graph`` at ``(branch,
+        rev)``.
 
         """
         return self.conn.execute(
-            self.sql['graph_val_items'],
+            self.sql['exist_node_upd'],
+            extant=extant,
             graph=graph,
+            node=node,
             branch=branch,
             rev=rev
         )
 
-    def graph_val_get(self, graph, key, branch, rev):
+    def graph_val_get(self, branch, rev, graph, key):
         """Query the most recent value for ``graph``'s ``key`` as of
         ``(branch, rev)``
 
@@ -994,6 +1671,43 @@ class Alchemist(object):
             value=value
         )
 
+    def graph_val_ins_many(self, rows):
+        """Insert many ``(graph, key, branch, rev, value)`` records at once"""
+        return self.conn.execute(
+            self.sql['graph_val_ins'],
+            [
+                dict(graph=graph, key=key, branch=branch, rev=rev, value=value)
+                for (graph, key, branch, rev, value) in rows
+            ]
+        )
+
+    def graph_val_upsert(self, graph, key, branch, rev, value):
+        """Insert this record, or update it if it\'s there already"""
+        return self.conn.execute(
+            self.sql['graph_val_upsert'],
+            graph=graph,
+            key=key,
+            branch=branch,
+            rev=rev,
+            value=value
+        )
+
+    def graph_val_upsert_many(self, rows):
+        """Run ``graph_val_upsert`` on many records at once"""
+        return self.conn.execute(
+            self.sql['graph_val_upsert'],
+            [
+                dict(
+                    graph=graph,
+                    key=key,
+                    branch=branch,
+                    rev=rev,
+                    value=value
+                )
+                for (graph, key, branch, rev, value) in rows
+            ]
+        )
+
     def graph_val_upd(self, value, graph, key, branch, rev):
         """Update the record previously inserted by ``graph_val_ins``"""
         return self.conn.execute(
@@ -1005,26 +1719,43 @@ class Alchemist(object):
             rev=rev
         )
 
-    def node_val_items(self, graph, node, branch, rev):
-        """Get all the most recent values of all the keys on ``node`` in
-        ``graph`` as of ``(branch, rev)``
+    def node_val_get(self, branch, rev, graph, node, key):
+        """Get the most recent value for ``key`` on ``node`` in ``graph`` as
+        of ``(branch, rev)``, and the branch and revision it was set
+        at
 
         """
         return self.conn.execute(
-            self.sql['node_val_items'],
+            self.sql['node_val_get'],
             graph=graph,
             node=node,
+            key=key,
             branch=branch,
             rev=rev
         )
 
-    def node_val_get(self, graph, node, key, branch, rev):
-        """Get the most recent value for ``key`` on ``node`` in ``graph`` as
-        of ``(branch, rev)``
+    def node_val_at(self, graph, node, key, branch, rev):
+        """Get the value for ``key`` on ``node`` in ``graph`` set at exactly
+        ``(branch, rev)``
 
         """
         return self.conn.execute(
-            self.sql['node_val_get'],
+            self.sql['node_val_at'],
+            graph=graph,
+            node=node,
+            key=key,
+            branch=branch,
+            rev=rev
+        )
+
+    def node_val_later(self, graph, node, key, branch, rev):
+        """Iterate over the revisions after ``rev`` at which ``key`` on
+        ``node`` in ``graph`` was set in ``branch``, in order, and the
+        values.
+
+        """
+        return self.conn.execute(
+            self.sql['node_val_later'],
             graph=graph,
             node=node,
             key=key,
@@ -1047,6 +1778,55 @@ class Alchemist(object):
             value=value
         )
 
+    def node_val_ins_many(self, rows):
+        """Insert many ``(graph, node, key, branch, rev, value)`` records at
+        once
+
+        """
+        return self.conn.execute(
+            self.sql['node_val_ins'],
+            [
+                dict(
+                    graph=graph,
+                    node=node,
+                    key=key,
+                    branch=branch,
+                    rev=rev,
+                    value=value
+                )
+                for (graph, node, key, branch, rev, value) in rows
+            ]
+        )
+
+    def node_val_upsert(self, graph, node, key, branch, rev, value):
+        """Insert this record, or update it if it\'s there already"""
+        return self.conn.execute(
+            self.sql['node_val_upsert'],
+            graph=graph,
+            node=node,
+            key=key,
+            branch=branch,
+            rev=rev,
+            value=value
+        )
+
+    def node_val_upsert_many(self, rows):
+        """Run ``node_val_upsert`` on many records at once"""
+        return self.conn.execute(
+            self.sql['node_val_upsert'],
+            [
+                dict(
+                    graph=graph,
+                    node=node,
+                    key=key,
+                    branch=branch,
+                    rev=rev,
+                    value=value
+                )
+                for (graph, node, key, branch, rev, value) in rows
+            ]
+        )
+
     def node_val_upd(self, value, graph, node, key, branch, rev):
         """Update the record previously inserted by ``node_val_ins``"""
         return self.conn.execute(
@@ -1059,7 +1839,7 @@ class Alchemist(object):
             rev=rev
         )
 
-    def edge_exists(self, graph, nodeA, nodeB, idx, branch, rev):
+    def edge_exists(self, branch, rev, graph, nodeA, nodeB, idx):
         """Query for whether a particular edge exists at a particular
         ``(branch, rev)``
 
@@ -1074,19 +1854,7 @@ class Alchemist(object):
             rev=rev
         )
 
-    def edges_extant(self, graph, branch, rev):
-        """Query for all edges that exist in ``graph`` as of ``(branch,
-        rev)``
-
-        """
-        return self.conn.execute(
-            self.sql['edges_extant'],
-            graph=graph,
-            branch=branch,
-            rev=rev
-        )
-
-    def nodeAs(self, graph, nodeB, branch, rev):
+    def nodeAs(self, branch, rev, graph, nodeB):
         """Query for edges that end at ``nodeB`` in ``graph`` as of ``(branch,
         rev)``
 
@@ -1099,7 +1867,7 @@ class Alchemist(object):
             rev=rev
         )
 
-    def nodeBs(self, graph, nodeA, branch, rev):
+    def nodeBs(self, branch, rev, graph, nodeA):
         """Query for the nodes at which edges that originate from ``nodeA``
         end.
 
@@ -1112,7 +1880,7 @@ class Alchemist(object):
             rev=rev
         )
 
-    def multi_edges(self, graph, nodeA, nodeB, branch, rev):
+    def multi_edges(self, branch, rev, graph, nodeA, nodeB):
         """Query for all edges from ``nodeA`` to ``nodeB``. Only makes sense
         if we're dealing with a :class:`MultiGraph` or
         :class:`MultiDiGraph`.
@@ -1146,6 +1914,58 @@ class Alchemist(object):
             extant=extant
         )
 
+    def edge_exist_ins_many(self, rows):
+        """Insert many ``(graph, nodeA, nodeB, idx, branch, rev, extant)``
+        records at once
+
+        """
+        return self.conn.execute(
+            self.sql['edge_exist_ins'],
+            [
+                dict(
+                    graph=graph,
+                    orig=nodeA,
+                    dest=nodeB,
+                    idx=idx,
+                    branch=branch,
+                    rev=rev,
+                    extant=extant
+                )
+                for (graph, nodeA, nodeB, idx, branch, rev, extant) in rows
+            ]
+        )
+
+    def edge_exist_upsert(self, graph, nodeA, nodeB, idx, branch, rev, extant):
+        """Insert this record, or update it if it\'s there already"""
+        return self.conn.execute(
+            self.sql['edge_exist_upsert'],
+            graph=graph,
+            orig=nodeA,
+            dest=nodeB,
+            idx=idx,
+            branch=branch,
+            rev=rev,
+            extant=extant
+        )
+
+    def edge_exist_upsert_many(self, rows):
+        """Run ``edge_exist_upsert`` on many records at once"""
+        return self.conn.execute(
+            self.sql['edge_exist_upsert'],
+            [
+                dict(
+                    graph=graph,
+                    orig=nodeA,
+                    dest=nodeB,
+                    idx=idx,
+                    branch=branch,
+                    rev=rev,
+                    extant=extant
+                )
+                for (graph, nodeA, nodeB, idx, branch, rev, extant) in rows
+            ]
+        )
+
     def edge_exist_upd(self, extant, graph, nodeA, nodeB, idx, branch, rev):
         """Update a record previously inserted with ``edge_exist_ins``."""
         return self.conn.execute(
@@ -1159,28 +1979,45 @@ class Alchemist(object):
             rev=rev
         )
 
-    def edge_val_items(self, graph, nodeA, nodeB, idx, branch, rev):
-        """Iterate over key-value pairs that are set on an edge as of
-        ``(branch, rev)``
+    def edge_val_get(self, branch, rev, graph, nodeA, nodeB, idx, key):
+        """Get the value of a key on an edge that is relevant as of ``(branch,
+        rev)``, and the branch and revision it was set at
 
         """
         return self.conn.execute(
-            self.sql['edge_val_items'],
+            self.sql['edge_val_get'],
             graph=graph,
             orig=nodeA,
             dest=nodeB,
             idx=idx,
+            key=key,
             branch=branch,
             rev=rev
         )
 
-    def edge_val_get(self, graph, nodeA, nodeB, idx, key, branch, rev):
-        """Get the value of a key on an edge that is relevant as of ``(branch,
+    def edge_val_at(self, graph, nodeA, nodeB, idx, key, branch, rev):
+        """Get the value of a key on an edge set at exactly ``(branch,
         rev)``
 
         """
         return self.conn.execute(
-            self.sql['edge_val_get'],
+            self.sql['edge_val_at'],
+            graph=graph,
+            orig=nodeA,
+            dest=nodeB,
+            idx=idx,
+            key=key,
+            branch=branch,
+            rev=rev
+        )
+
+    def edge_val_later(self, graph, nodeA, nodeB, idx, key, branch, rev):
+        """Iterate over the revisions after ``rev`` at which a key on an edge
+        was set in ``branch``, in order, and the values.
+
+        """
+        return self.conn.execute(
+            self.sql['edge_val_later'],
             graph=graph,
             orig=nodeA,
             dest=nodeB,
@@ -1207,10 +2044,66 @@ class Alchemist(object):
             value=value
         )
 
+    def edge_val_ins_many(self, rows):
+        """Insert many ``(graph, nodeA, nodeB, idx, key, branch, rev,
+        value)`` records at once
+
+        """
+        return self.conn.execute(
+            self.sql['edge_val_ins'],
+            [
+                dict(
+                    graph=graph,
+                    orig=nodeA,
+                    dest=nodeB,
+                    idx=idx,
+                    key=key,
+                    branch=branch,
+                    rev=rev,
+                    value=value
+                )
+                for (graph, nodeA, nodeB, idx, key, branch, rev, value) in rows
+            ]
+        )
+
+    def edge_val_upsert(self, graph, nodeA, nodeB, idx, key, branch, rev, value):
+        """Insert this record, or update it if it\'s there already"""
+        return self.conn.execute(
+            self.sql['edge_val_upsert'],
+            graph=graph,
+            orig=nodeA,
+            dest=nodeB,
+            idx=idx,
+            key=key,
+            branch=branch,
+            rev=rev,
+            value=value
+        )
+
+    def edge_val_upsert_many(self, rows):
+        """Run ``edge_val_upsert`` on many records at once"""
+        return self.conn.execute(
+            self.sql['edge_val_upsert'],
+            [
+                dict(
+                    graph=graph,
+                    orig=nodeA,
+                    dest=nodeB,
+                    idx=idx,
+                    key=key,
+                    branch=branch,
+                    rev=rev,
+                    value=value
+                )
+                for (graph, nodeA, nodeB, idx, key, branch, rev, value) in rows
+            ]
+        )
+
     def edge_val_upd(self, value, graph, nodeA, nodeB, idx, key, branch, rev):
         """Update a record previously inserted by ``edge_val_ins``"""
         return self.conn.execute(
             self.sql['edge_val_upd'],
+            value=value,
             graph=graph,
             orig=nodeA,
             dest=nodeB,
@@ -1220,6 +2113,404 @@ class Alchemist(object):
             rev=rev
         )
 
+    def graph_val_dump(self):
+        """Iterate over every record in the graph_val table."""
+        return self.conn.execute(
+            self.sql['graph_val_dump']
+        )
+
+    def graph_val_dump_graph(self, graph):
+        """Iterate over the graph_val records for ``graph``."""
+        return self.conn.execute(
+            self.sql['graph_val_dump_graph'],
+            graph=graph
+        )
+
+    def nodes_dump(self):
+        """Iterate over every record in the nodes table."""
+        return self.conn.execute(
+            self.sql['nodes_dump']
+        )
+
+    def nodes_dump_graph(self, graph):
+        """Iterate over the nodes records for ``graph``."""
+        return self.conn.execute(
+            self.sql['nodes_dump_graph'],
+            graph=graph
+        )
+
+    def node_val_dump(self):
+        """Iterate over every record in the node_val table."""
+        return self.conn.execute(
+            self.sql['node_val_dump']
+        )
+
+    def node_val_dump_graph(self, graph):
+        """Iterate over the node_val records for ``graph``."""
+        return self.conn.execute(
+            self.sql['node_val_dump_graph'],
+            graph=graph
+        )
+
+    def edges_dump(self):
+        """Iterate over every record in the edges table."""
+        return self.conn.execute(
+            self.sql['edges_dump']
+        )
+
+    def edges_dump_graph(self, graph):
+        """Iterate over the edges records for ``graph``."""
+        return self.conn.execute(
+            self.sql['edges_dump_graph'],
+            graph=graph
+        )
+
+    def edge_val_dump(self):
+        """Iterate over every record in the edge_val table."""
+        return self.conn.execute(
+            self.sql['edge_val_dump']
+        )
+
+    def edge_val_dump_graph(self, graph):
+        """Iterate over the edge_val records for ``graph``."""
+        return self.conn.execute(
+            self.sql['edge_val_dump_graph'],
+            graph=graph
+        )
+
+    def keyframes_dump(self):
+        """Iterate over the ``(graph, branch, rev)`` of every keyframe."""
+        return self.conn.execute(
+            self.sql['keyframes_dump']
+        )
+
+    def keyframe_ins(self, graph, branch, rev):
+        """Declare that there's a keyframe of ``graph`` at ``(branch,
+        rev)``.
+
+        """
+        return self.conn.execute(
+            self.sql['keyframe_ins'],
+            graph=graph,
+            branch=branch,
+            rev=rev
+        )
+
+    def del_keyframe(self, graph, branch, rev):
+        """Forget the keyframe of ``graph`` at ``(branch, rev)``. Its
+        contents need deleting first.
+
+        """
+        return self.conn.execute(
+            self.sql['del_keyframe'],
+            graph=graph,
+            branch=branch,
+            rev=rev
+        )
+
+    def graph_val_keyframe(self, graph, branch, rev):
+        """Get the keys and values of ``graph`` stored in its keyframe at
+        ``(branch, rev)``.
+
+        """
+        return self.conn.execute(
+            self.sql['graph_val_keyframe'],
+            graph=graph,
+            branch=branch,
+            rev=rev
+        )
+
+    def graph_val_keyframe_ins_many(self, rows):
+        """Store ``(graph, branch, rev, key, value)`` rows in a keyframe."""
+        return self.conn.execute(
+            self.sql['graph_val_keyframe_ins'],
+            [
+                dict(graph=graph, branch=branch, rev=rev, key=key, value=value)
+                for (graph, branch, rev, key, value) in rows
+            ]
+        )
+
+    def del_graph_val_keyframe(self, graph, branch, rev):
+        """Delete the graph attributes stored in a keyframe."""
+        return self.conn.execute(
+            self.sql['del_graph_val_keyframe'],
+            graph=graph,
+            branch=branch,
+            rev=rev
+        )
+
+    def graph_val_delta(self, graph, branch, since, rev):
+        """Get the most recent value for every key of ``graph`` that changed
+        after ``since`` and no later than ``rev`` in ``branch``.
+
+        """
+        return self.conn.execute(
+            self.sql['graph_val_delta'],
+            graph=graph,
+            branch=branch,
+            since=since,
+            rev=rev
+        )
+
+    def nodes_keyframe(self, graph, branch, rev):
+        """Get the nodes that exist in the keyframe of ``graph`` at
+        ``(branch, rev)``.
+
+        """
+        return self.conn.execute(
+            self.sql['nodes_keyframe'],
+            graph=graph,
+            branch=branch,
+            rev=rev
+        )
+
+    def nodes_keyframe_ins_many(self, rows):
+        """Store ``(graph, branch, rev, node)`` rows in a keyframe."""
+        return self.conn.execute(
+            self.sql['nodes_keyframe_ins'],
+            [
+                dict(graph=graph, branch=branch, rev=rev, node=node)
+                for (graph, branch, rev, node) in rows
+            ]
+        )
+
+    def del_nodes_keyframe(self, graph, branch, rev):
+        """Delete the nodes stored in a keyframe."""
+        return self.conn.execute(
+            self.sql['del_nodes_keyframe'],
+            graph=graph,
+            branch=branch,
+            rev=rev
+        )
+
+    def nodes_delta(self, graph, branch, since, rev):
+        """Get the most recent existence of every node in ``graph`` that was
+        created or deleted after ``since`` and no later than ``rev``
+        in ``branch``.
+
+        """
+        return self.conn.execute(
+            self.sql['nodes_delta'],
+            graph=graph,
+            branch=branch,
+            since=since,
+            rev=rev
+        )
+
+    def node_val_keyframe(self, graph, branch, rev):
+        """Get the nodes, keys and values in the keyframe of ``graph`` at
+        ``(branch, rev)``.
+
+        """
+        return self.conn.execute(
+            self.sql['node_val_keyframe'],
+            graph=graph,
+            branch=branch,
+            rev=rev
+        )
+
+    def node_val_keyframe_node(self, graph, branch, rev, node):
+        """Get the keys and values of ``node`` in the keyframe of ``graph``
+        at ``(branch, rev)``.
+
+        """
+        return self.conn.execute(
+            self.sql['node_val_keyframe_node'],
+            graph=graph,
+            branch=branch,
+            rev=rev,
+            node=node
+        )
+
+    def node_val_keyframe_ins_many(self, rows):
+        """Store ``(graph, branch, rev, node, key, value)`` rows in a
+        keyframe.
+
+        """
+        return self.conn.execute(
+            self.sql['node_val_keyframe_ins'],
+            [
+                dict(
+                    graph=graph, branch=branch, rev=rev,
+                    node=node, key=key, value=value
+                )
+                for (graph, branch, rev, node, key, value) in rows
+            ]
+        )
+
+    def del_node_val_keyframe(self, graph, branch, rev):
+        """Delete the node attributes stored in a keyframe."""
+        return self.conn.execute(
+            self.sql['del_node_val_keyframe'],
+            graph=graph,
+            branch=branch,
+            rev=rev
+        )
+
+    def node_val_delta(self, graph, branch, since, rev):
+        """Get the most recent value for every node attribute in ``graph``
+        that changed after ``since`` and no later than ``rev`` in
+        ``branch``.
+
+        """
+        return self.conn.execute(
+            self.sql['node_val_delta'],
+            graph=graph,
+            branch=branch,
+            since=since,
+            rev=rev
+        )
+
+    def node_val_delta_node(self, graph, branch, since, rev, node):
+        """Get the most recent value for every key of ``node`` that changed
+        after ``since`` and no later than ``rev`` in ``branch``.
+
+        """
+        return self.conn.execute(
+            self.sql['node_val_delta_node'],
+            graph=graph,
+            branch=branch,
+            since=since,
+            rev=rev,
+            node=node
+        )
+
+    def edges_keyframe(self, graph, branch, rev):
+        """Get the edges that exist in the keyframe of ``graph`` at
+        ``(branch, rev)``.
+
+        """
+        return self.conn.execute(
+            self.sql['edges_keyframe'],
+            graph=graph,
+            branch=branch,
+            rev=rev
+        )
+
+    def edges_keyframe_ins_many(self, rows):
+        """Store ``(graph, branch, rev, nodeA, nodeB, idx)`` rows in a
+        keyframe.
+
+        """
+        return self.conn.execute(
+            self.sql['edges_keyframe_ins'],
+            [
+                dict(
+                    graph=graph, branch=branch, rev=rev,
+                    orig=nodeA, dest=nodeB, idx=idx
+                )
+                for (graph, branch, rev, nodeA, nodeB, idx) in rows
+            ]
+        )
+
+    def del_edges_keyframe(self, graph, branch, rev):
+        """Delete the edges stored in a keyframe."""
+        return self.conn.execute(
+            self.sql['del_edges_keyframe'],
+            graph=graph,
+            branch=branch,
+            rev=rev
+        )
+
+    def edges_delta(self, graph, branch, since, rev):
+        """Get the most recent existence of every edge in ``graph`` that was
+        created or deleted after ``since`` and no later than ``rev``
+        in ``branch``.
+
+        """
+        return self.conn.execute(
+            self.sql['edges_delta'],
+            graph=graph,
+            branch=branch,
+            since=since,
+            rev=rev
+        )
+
+    def edge_val_keyframe(self, graph, branch, rev):
+        """Get the edges, keys and values in the keyframe of ``graph`` at
+        ``(branch, rev)``.
+
+        """
+        return self.conn.execute(
+            self.sql['edge_val_keyframe'],
+            graph=graph,
+            branch=branch,
+            rev=rev
+        )
+
+    def edge_val_keyframe_edge(self, graph, branch, rev, nodeA, nodeB, idx):
+        """Get the keys and values of an edge in the keyframe of ``graph``
+        at ``(branch, rev)``.
+
+        """
+        return self.conn.execute(
+            self.sql['edge_val_keyframe_edge'],
+            graph=graph,
+            branch=branch,
+            rev=rev,
+            orig=nodeA,
+            dest=nodeB,
+            idx=idx
+        )
+
+    def edge_val_keyframe_ins_many(self, rows):
+        """Store ``(graph, branch, rev, nodeA, nodeB, idx, key, value)``
+        rows in a keyframe.
+
+        """
+        return self.conn.execute(
+            self.sql['edge_val_keyframe_ins'],
+            [
+                dict(
+                    graph=graph, branch=branch, rev=rev,
+                    orig=nodeA, dest=nodeB, idx=idx, key=key, value=value
+                )
+                for (
+                    graph, branch, rev, nodeA, nodeB, idx, key, value
+                ) in rows
+            ]
+        )
+
+    def del_edge_val_keyframe(self, graph, branch, rev):
+        """Delete the edge attributes stored in a keyframe."""
+        return self.conn.execute(
+            self.sql['del_edge_val_keyframe'],
+            graph=graph,
+            branch=branch,
+            rev=rev
+        )
+
+    def edge_val_delta(self, graph, branch, since, rev):
+        """Get the most recent value for every edge attribute in ``graph``
+        that changed after ``since`` and no later than ``rev`` in
+        ``branch``.
+
+        """
+        return self.conn.execute(
+            self.sql['edge_val_delta'],
+            graph=graph,
+            branch=branch,
+            since=since,
+            rev=rev
+        )
+
+    def edge_val_delta_edge(
+            self, graph, branch, since, rev, nodeA, nodeB, idx
+    ):
+        """Get the most recent value for every key of an edge that changed
+        after ``since`` and no later than ``rev`` in ``branch``.
+
+        """
+        return self.conn.execute(
+            self.sql['edge_val_delta_edge'],
+            graph=graph,
+            branch=branch,
+            since=since,
+            rev=rev,
+            orig=nodeA,
+            dest=nodeB,
+            idx=idx
+        )
 
 if __name__ == '__main__':
     e = create_engine('sqlite:///:memory:')
@@ -0,0 +1,236 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""A front end to :class:`gorm.ORM` for asyncio, in which looking
+things up and changing them are coroutines, so that the event loop
+needn't wait on the database.
+
+The ORM lives on an executor with one worker thread, and everything
+that touches it runs there, in the order it was asked for. Whatever
+gets asked for in the same pass of the event loop, as when you
+``gather`` lookups, goes to the worker as one batch, so it costs one
+trip between threads rather than one each.
+
+This module needs Python 3.5 or later. Nothing else in gorm imports
+it.
+
+"""
+import asyncio
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from functools import partial
+from . import ORM
+from .xjson import JSONWrapper, JSONReWrapper, JSONListReWrapper
+
+
+def _plain(v):
+    """Return ``v`` as plain dicts and lists, copied, so that it's safe
+    to use in another thread, and to change.
+
+    """
+    if isinstance(v, (JSONReWrapper, JSONListReWrapper)):
+        return deepcopy(v._v)
+    if isinstance(v, JSONWrapper):
+        return deepcopy(v._get())
+    if isinstance(v, Mapping):
+        return dict((k, _plain(x)) for (k, x) in v.items())
+    return v
+
+
+class AsyncORM(object):
+    """Takes the same arguments as :class:`gorm.ORM`, which I make on
+    my executor, and keep in ``self.orm``. Don't touch it from the
+    event loop's thread.
+
+    You may pass your own ``executor``. If it has more than one
+    worker thread, pass ``threadsafe=True`` too.
+
+    """
+    def __init__(self, *args, **kwargs):
+        executor = kwargs.pop('executor', None)
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.orm = self.executor.submit(ORM, *args, **kwargs).result()
+        self._batch = []
+
+    def _call(self, fn, *args, **kwargs):
+        """Return a future of the result of calling ``fn`` with these
+        arguments on my executor, along with whatever else gets called
+        in this pass of the event loop.
+
+        """
+        loop = asyncio.get_event_loop()
+        fut = loop.create_future()
+        if not self._batch:
+            loop.call_soon(self._run_batch, loop)
+        self._batch.append((partial(fn, *args, **kwargs), fut))
+        return fut
+
+    def _run_batch(self, loop):
+        batch = self._batch
+        self._batch = []
+
+        def run():
+            results = []
+            for (call, fut) in batch:
+                try:
+                    results.append((True, call()))
+                except Exception as ex:
+                    results.append((False, ex))
+            return results
+
+        def done(job):
+            for ((call, fut), (ok, r)) in zip(batch, job.result()):
+                if fut.cancelled():
+                    continue
+                if ok:
+                    fut.set_result(r)
+                else:
+                    fut.set_exception(r)
+        loop.run_in_executor(self.executor, run).add_done_callback(done)
+
+    async def seek(self, branch=None, rev=None):
+        """Move the cursor to ``branch`` and/or ``rev``, if given, and
+        return where it is now, as ``(branch, rev)``.
+
+        """
+        orm = self.orm
+
+        def seek():
+            if branch is not None:
+                orm.branch = branch
+            if rev is not None:
+                orm.rev = rev
+            return (orm.branch, orm.rev)
+        return await self._call(seek)
+
+    async def get_graph(self, name):
+        """Return an :class:`AsyncGraph` for the graph thus named"""
+        return AsyncGraph(self, await self._call(self.orm.get_graph, name))
+
+    async def new_graph(self, name, data=None, **attr):
+        """Make a new Graph, and return an :class:`AsyncGraph` for it"""
+        return AsyncGraph(self, await self._call(
+            self.orm.new_graph, name, data, **attr
+        ))
+
+    async def new_digraph(self, name, data=None, **attr):
+        """Make a new DiGraph, and return an :class:`AsyncGraph` for it"""
+        return AsyncGraph(self, await self._call(
+            self.orm.new_digraph, name, data, **attr
+        ))
+
+    async def new_multigraph(self, name, data=None, **attr):
+        """Make a new MultiGraph, and return an :class:`AsyncGraph` for
+        it
+
+        """
+        return AsyncGraph(self, await self._call(
+            self.orm.new_multigraph, name, data, **attr
+        ))
+
+    async def new_multidigraph(self, name, data=None, **attr):
+        """Make a new MultiDiGraph, and return an :class:`AsyncGraph` for
+        it
+
+        """
+        return AsyncGraph(self, await self._call(
+            self.orm.new_multidigraph, name, data, **attr
+        ))
+
+    async def commit(self):
+        """Commit the transaction"""
+        await self._call(self.orm.commit)
+
+    async def close(self):
+        """Close the ORM, and shut down my executor if I made it"""
+        await self._call(self.orm.close)
+        if self._own_executor:
+            self.executor.shutdown()
+
+
+class AsyncMapping(object):
+    """Stands for one of the mappings of a gorm graph, such as its node
+    attributes, or the successors of a node.
+
+    Subscripting me gets you another of me, for the mapping inside,
+    without looking anything up. The methods that do look things
+    up, or change them, are coroutines. Mappings come back from them
+    as plain dicts, and values as copies.
+
+    """
+    def __init__(self, aorm, resolve):
+        """``resolve`` is a function that returns the real mapping. I'll
+        only call it on the executor.
+
+        """
+        self._aorm = aorm
+        self._resolve = resolve
+
+    def __getitem__(self, key):
+        resolve = self._resolve
+        return AsyncMapping(self._aorm, lambda: resolve()[key])
+
+    async def get(self, key, default=None):
+        """Return the value for ``key``, or ``default`` if I haven't
+        got it
+
+        """
+        resolve = self._resolve
+
+        def get():
+            try:
+                return _plain(resolve()[key])
+            except KeyError:
+                return default
+        return await self._aorm._call(get)
+
+    async def set(self, key, value):
+        """Set ``key`` to ``value`` at the present branch and revision"""
+        resolve = self._resolve
+
+        def set():
+            resolve()[key] = value
+        await self._aorm._call(set)
+
+    async def delete(self, key):
+        """Delete ``key`` at the present branch and revision"""
+        resolve = self._resolve
+
+        def delete():
+            del resolve()[key]
+        await self._aorm._call(delete)
+
+    async def contains(self, key):
+        """Return whether I have ``key`` now"""
+        resolve = self._resolve
+        return await self._aorm._call(lambda: key in resolve())
+
+    async def iterate(self):
+        """Return a list of my keys"""
+        resolve = self._resolve
+        return await self._aorm._call(lambda: list(resolve()))
+
+    async def items(self):
+        """Return a list of my keys and values"""
+        resolve = self._resolve
+        return await self._aorm._call(
+            lambda: [(k, _plain(v)) for (k, v) in resolve().items()]
+        )
+
+
+class AsyncGraph(object):
+    """Stands for a gorm graph, with an :class:`AsyncMapping` for each
+    of its mappings: ``graph``, ``node``, ``adj``, and ``edge``, and
+    ``succ`` and ``pred`` if it's directed.
+
+    """
+    def __init__(self, aorm, graph):
+        self.aorm = aorm
+        self.name = graph.name
+        self._graph = graph
+        for attr in ('graph', 'node', 'adj', 'edge', 'succ', 'pred'):
+            if hasattr(type(graph), attr):
+                setattr(self, attr, AsyncMapping(
+                    aorm, partial(getattr, graph, attr)
+                ))
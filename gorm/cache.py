@@ -0,0 +1,295 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Compact storage for the ORM's caches of graph data.
+
+The caches used to be defaultdicts nested as deep as the key: for edge
+attributes, graph, nodeA, nodeB, idx, key, branch, and finally a
+:class:`WindowDict` of revisions. Every edge paid for a dict and a
+lambda at every level. Here, every key tuple maps straight to its
+window in one flat dict, and looking up part of a key gets you a
+throwaway view that behaves like the nested dict used to.
+
+"""
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+from array import array
+from bisect import bisect_right
+from .window import WindowDict
+
+
+class CacheView(Mapping):
+    """What you get when you look up part of a key in a
+    :class:`FlatCache`.
+
+    Until the key is complete except for the branch, looking up
+    another part of it gets you another view. After that, looking up
+    a branch gets you the :class:`WindowDict` for it, made empty if
+    need be.
+
+    """
+    __slots__ = ['_cache', '_prefix']
+
+    def __init__(self, cache, prefix):
+        self._cache = cache
+        self._prefix = prefix
+
+    def __getitem__(self, k):
+        cache = self._cache
+        key = self._prefix + (k,)
+        if len(key) > cache.depth:
+            return cache.window(key)
+        return CacheView(cache, key)
+
+    def __contains__(self, k):
+        cache = self._cache
+        key = self._prefix + (k,)
+        if len(key) > cache.depth:
+            return key in cache._data
+        if len(key) == cache.depth:
+            return cache._has_branches(key)
+        return key in cache._children
+
+    def __iter__(self):
+        cache = self._cache
+        if len(self._prefix) == cache.depth:
+            return iter([
+                b for b in cache._branches if self._prefix + (b,) in cache._data
+            ])
+        return iter(list(cache._children.get(self._prefix, ())))
+
+    def __len__(self):
+        n = 0
+        for k in iter(self):
+            n += 1
+        return n
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, dict(self))
+
+
+class FlatCache(CacheView):
+    """A cache of values by key, branch, and revision, for one graph.
+
+    ``depth`` is how many parts the key has, not counting the branch.
+    I keep each :class:`WindowDict` in a single dictionary keyed by
+    the whole tuple, and remember the parts of keys that are in use,
+    one list per partial key, so that you can iterate over them.
+    Branches are few, so I don't index those per key; I just try each
+    branch I've seen.
+
+    The parts of the keys are interned in ``interned``, a dictionary
+    you can share between caches, so that a node name loaded a
+    thousand times from the database is only stored once.
+
+    New windows are made by calling ``window_factory``, which should
+    return something like an empty :class:`WindowDict`. Looking things
+    up never makes one; only :meth:`window`, and looking up a whole key
+    one part at a time, do.
+
+    """
+    def __init__(self, depth, interned=None, window_factory=WindowDict):
+        self._cache = self
+        self._prefix = ()
+        self.depth = depth
+        self._data = {}
+        self._children = {}
+        self._branches = []
+        self._interned = {} if interned is None else interned
+        self._window_factory = window_factory
+
+    def window(self, key):
+        """Return the :class:`WindowDict` for the whole key, branch
+        included, making it if needed.
+
+        This is quicker than looking up one part of the key at a time.
+
+        """
+        try:
+            return self._data[key]
+        except KeyError:
+            pass
+        interned = self._interned
+        key = tuple(map(interned.setdefault, key, key))
+        branch = key[-1]
+        prefix = key[:-1]
+        new = not self._has_branches(prefix)
+        r = self._data[key] = self._window_factory()
+        if branch not in self._branches:
+            self._branches.append(branch)
+        if not new:
+            return r
+        children = self._children
+        i = len(prefix) - 1
+        while i >= 0:
+            parent = prefix[:i]
+            if parent in children:
+                children[parent].append(prefix[i])
+                break
+            children[parent] = [prefix[i]]
+            i -= 1
+        return r
+
+    def resolve(self, key, lineage):
+        """Return the value for ``key``, not including the branch, as of
+        the first ``(branch, rev)`` pair in ``lineage`` that has one.
+
+        ``lineage`` is what :meth:`gorm.ORM._active_branches` returns.
+        Raise ``KeyError`` if no branch in it has a value.
+
+        """
+        data = self._data
+        for (branch, rev) in lineage:
+            window = data.get(key + (branch,))
+            if window is None:
+                continue
+            try:
+                return window[rev]
+            except KeyError:
+                continue
+        raise KeyError("{} not set as of {}".format(key, lineage[0]))
+
+    def _has_branches(self, prefix):
+        """Is there a window for any branch under this key?"""
+        data = self._data
+        for branch in self._branches:
+            if prefix + (branch,) in data:
+                return True
+        return False
+
+
+class AdjacencyIndex(object):
+    """Which edges exist in one graph as of one branch and revision.
+
+    ``succ`` maps each node to a dict of the nodes it has edges to,
+    and ``pred`` maps each node to a dict of the nodes that have edges
+    to it. Either way the values are tuples of the indices of the
+    edges that exist. Nodes with no edges are left out.
+
+    I'm built from the graph's edges cache, a :class:`FlatCache` of
+    depth 3. I also keep a log of the revisions at which each edge
+    changed, per branch. When you :meth:`seek` another branch or
+    revision, I look up which edges changed in between and resolve
+    only those again, so moving the cursor costs about as much as
+    what changed, and reading neighbors costs about as much as there
+    are neighbors.
+
+    """
+    def __init__(self, edges):
+        self._edges = edges
+        self.succ = {}
+        self.pred = {}
+        self._branch = None
+        self._rev = None
+        self._lineage = []
+        self._log = {}
+        log = {}
+        for (key, window) in edges._data.items():
+            branch = key[-1]
+            edge = key[:-1]
+            if branch not in log:
+                log[branch] = []
+            for rev in window:
+                log[branch].append((rev, edge))
+        for (branch, changes) in log.items():
+            changes.sort(key=lambda change: change[0])
+            self._log[branch] = (
+                array('q', [rev for (rev, edge) in changes]),
+                [edge for (rev, edge) in changes]
+            )
+
+    def seek(self, branch, rev, active_branches):
+        """Bring me up to date with ``(branch, rev)``.
+
+        ``active_branches`` is a function that takes a branch and
+        revision and returns the ``(branch, rev)`` pairs of its
+        lineage, nearest first, like
+        :meth:`gorm.ORM._active_branches`.
+
+        """
+        if branch == self._branch and rev == self._rev:
+            return
+        lineage = list(active_branches(branch, rev))
+        if self._branch is None:
+            todo = set(key[:-1] for key in self._edges._data)
+        else:
+            todo = set()
+            old = dict(self._lineage)
+            new = dict(lineage)
+            for b in set(old) | set(new):
+                if b in old and b in new:
+                    if old[b] == new[b]:
+                        continue
+                    (lo, hi) = sorted((old[b], new[b]))
+                else:
+                    (lo, hi) = (None, old.get(b, new.get(b)))
+                todo.update(self._changes(b, lo, hi))
+        self._branch = branch
+        self._rev = rev
+        self._lineage = lineage
+        for edge in todo:
+            self._update(edge)
+
+    def changed(self, nodeA, nodeB, idx, branch, rev):
+        """Note that the edge's existence was set at ``(branch, rev)``.
+
+        Call this after it's in the edges cache.
+
+        """
+        edge = (nodeA, nodeB, idx)
+        if branch not in self._log:
+            self._log[branch] = (array('q'), [])
+        (revs, edges) = self._log[branch]
+        i = len(revs) if not revs or revs[-1] <= rev \
+            else bisect_right(revs, rev)
+        revs.insert(i, rev)
+        edges.insert(i, edge)
+        if self._branch is not None:
+            self._update(edge)
+
+    def _changes(self, branch, lo, hi):
+        """Return the edges that changed in ``branch`` after revision
+        ``lo``, or ever if ``lo`` is ``None``, up to and including
+        ``hi``.
+
+        """
+        if branch not in self._log:
+            return []
+        (revs, edges) = self._log[branch]
+        start = 0 if lo is None else bisect_right(revs, lo)
+        return edges[start:bisect_right(revs, hi)]
+
+    def _update(self, edge):
+        """Look up whether the edge exists now, and index it accordingly."""
+        try:
+            extant = self._edges.resolve(edge, self._lineage)
+        except KeyError:
+            extant = False
+        (nodeA, nodeB, idx) = edge
+        if extant:
+            _add(self.succ, nodeA, nodeB, idx)
+            _add(self.pred, nodeB, nodeA, idx)
+        else:
+            _discard(self.succ, nodeA, nodeB, idx)
+            _discard(self.pred, nodeB, nodeA, idx)
+
+
+def _add(adj, u, v, idx):
+    if u not in adj:
+        adj[u] = {}
+    idxs = adj[u].get(v, ())
+    if idx not in idxs:
+        adj[u][v] = tuple(sorted(idxs + (idx,)))
+
+
+def _discard(adj, u, v, idx):
+    if u not in adj or v not in adj[u] or idx not in adj[u][v]:
+        return
+    idxs = tuple(i for i in adj[u][v] if i != idx)
+    if idxs:
+        adj[u][v] = idxs
+        return
+    del adj[u][v]
+    if not adj[u]:
+        del adj[u]
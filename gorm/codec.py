@@ -0,0 +1,225 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Ways to encode the names and values that gorm stores, and a
+registry of them by name, for :class:`gorm.ORM` to choose from.
+
+JSON text is the default. The binary encoding here is smaller, and
+quicker to decode, especially for tuples of numbers, but you can only
+read it back with gorm.
+
+"""
+from struct import Struct, pack, unpack_from
+from .xjson import JSONCodec, DEFAULT_CAPACITY
+
+try:
+    _ints = (int, long)
+    _texts = (str, unicode)
+except NameError:
+    _ints = (int,)
+    _texts = (str,)
+
+_int8 = Struct('<b')
+_int64 = Struct('<q')
+_float64 = Struct('<d')
+_min64 = -2 ** 63
+_max64 = 2 ** 63
+
+
+def _varint(n):
+    """Return the non-negative integer ``n`` as a little-endian base-128
+    varint
+
+    """
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _read_varint(buf, pos):
+    n = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return (n, pos)
+        shift += 7
+
+
+def _is_int64(o):
+    return type(o) in _ints and _min64 <= o < _max64
+
+
+def _encode(o, out):
+    """Append the encoding of ``o`` to the bytearray ``out``.
+
+    Every value starts with a one-byte tag. Tuples and lists of only
+    floats, or of only 64-bit ints, are packed in one go.
+
+    """
+    t = type(o)
+    if o is None:
+        out += b'N'
+    elif t is bool:
+        out += b'T' if o else b'F'
+    elif t in _ints:
+        if -128 <= o < 128:
+            out += b'b'
+            out += _int8.pack(o)
+        elif _min64 <= o < _max64:
+            out += b'q'
+            out += _int64.pack(o)
+        else:
+            s = str(o).encode('ascii')
+            out += b'I'
+            out += _varint(len(s))
+            out += s
+    elif t is float:
+        out += b'd'
+        out += _float64.pack(o)
+    elif t in _texts:
+        s = o if isinstance(o, bytes) else o.encode('utf-8')
+        out += b's'
+        out += _varint(len(s))
+        out += s
+    elif t is bytes:
+        out += b'y'
+        out += _varint(len(o))
+        out += o
+    elif t is tuple or t is list:
+        n = len(o)
+        if n and all(type(x) is float for x in o):
+            out += b'e' if t is tuple else b'E'
+            out += _varint(n)
+            out += pack('<{}d'.format(n), *o)
+        elif n and all(_is_int64(x) for x in o):
+            out += b'j' if t is tuple else b'J'
+            out += _varint(n)
+            out += pack('<{}q'.format(n), *o)
+        else:
+            out += b't' if t is tuple else b'l'
+            out += _varint(n)
+            for x in o:
+                _encode(x, out)
+    elif t is dict:
+        out += b'm'
+        out += _varint(len(o))
+        for (k, v) in o.items():
+            _encode(k, out)
+            _encode(v, out)
+    else:
+        raise TypeError("Can't encode {}".format(t))
+
+
+(
+    _NONE, _TRUE, _FALSE, _INT8, _INT64, _BIGINT, _FLOAT, _TEXT, _BYTES,
+    _TUPLE, _LIST, _FLOATS, _FLOATLIST, _INTS, _INTLIST, _DICT
+) = bytearray(b'NTFbqIdsytleEjJm')
+
+
+def _decode(buf, pos):
+    """Return the value encoded at ``pos`` in the bytearray ``buf``, and
+    the position after it.
+
+    """
+    tag = buf[pos]
+    pos += 1
+    if tag == _INT8:
+        return (_int8.unpack_from(buf, pos)[0], pos + 1)
+    if tag == _INT64:
+        return (_int64.unpack_from(buf, pos)[0], pos + 8)
+    if tag == _FLOAT:
+        return (_float64.unpack_from(buf, pos)[0], pos + 8)
+    if tag == _TEXT:
+        (n, pos) = _read_varint(buf, pos)
+        return (buf[pos:pos+n].decode('utf-8'), pos + n)
+    if tag in (_FLOATS, _FLOATLIST, _INTS, _INTLIST):
+        (n, pos) = _read_varint(buf, pos)
+        code = 'd' if tag in (_FLOATS, _FLOATLIST) else 'q'
+        r = unpack_from('<{}{}'.format(n, code), buf, pos)
+        pos += 8 * n
+        return (list(r) if tag in (_FLOATLIST, _INTLIST) else r, pos)
+    if tag in (_TUPLE, _LIST):
+        (n, pos) = _read_varint(buf, pos)
+        r = []
+        for i in range(n):
+            (v, pos) = _decode(buf, pos)
+            r.append(v)
+        return (tuple(r) if tag == _TUPLE else r, pos)
+    if tag == _DICT:
+        (n, pos) = _read_varint(buf, pos)
+        r = {}
+        for i in range(n):
+            (k, pos) = _decode(buf, pos)
+            (v, pos) = _decode(buf, pos)
+            r[k] = v
+        return (r, pos)
+    if tag == _NONE:
+        return (None, pos)
+    if tag == _TRUE:
+        return (True, pos)
+    if tag == _FALSE:
+        return (False, pos)
+    if tag == _BIGINT:
+        (n, pos) = _read_varint(buf, pos)
+        return (int(buf[pos:pos+n].decode('ascii')), pos + n)
+    if tag == _BYTES:
+        (n, pos) = _read_varint(buf, pos)
+        return (bytes(buf[pos:pos+n]), pos + n)
+    raise ValueError("Unknown tag {!r} at {}".format(chr(tag), pos - 1))
+
+
+class BinaryCodec(JSONCodec):
+    """Encodes None, bools, ints, floats, strings, bytes, tuples, lists,
+    and dicts as tagged ``bytes``, keeping tuples and lists apart, as
+    :class:`JSONCodec` does.
+
+    """
+    binary = True
+
+    def encode(self, obj):
+        """Return the bytes for ``obj``, without memoizing"""
+        out = bytearray()
+        _encode(obj, out)
+        return bytes(out)
+
+    def decode(self, s):
+        """Return the object that the bytes ``s`` encode, without
+        memoizing
+
+        """
+        return _decode(bytearray(s), 0)[0]
+
+
+codecs = {
+    'json': JSONCodec,
+    'binary': BinaryCodec
+}
+
+
+def register_codec(name, cls):
+    """Make the codec class ``cls`` available to :class:`gorm.ORM` by
+    ``name``.
+
+    ``cls`` should take a memo capacity and provide ``dump``,
+    ``load``, and ``binary``, like :class:`JSONCodec`.
+
+    """
+    codecs[name] = cls
+
+
+def get_codec(codec, capacity=DEFAULT_CAPACITY):
+    """Return an instance of the codec registered as ``codec``, or
+    ``codec`` itself if it's already an instance.
+
+    """
+    if hasattr(codec, 'dump'):
+        return codec
+    try:
+        cls = codecs[codec]
+    except KeyError:
+        raise ValueError("No codec registered as {}".format(codec))
+    return cls(capacity)
@@ -0,0 +1,91 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Structural patches between two versions of a value, so that a big
+dict or list that changes a little at a time needn't be stored whole
+at every revision.
+
+A patch is a tuple whose first item says what kind it is:
+
+``('=', value)``
+    Replace the old value with ``value``.
+``('d', ((key, patch), ...), (key, ...))``
+    Patch the values of some keys of a dict, or add them, and delete
+    others.
+``('s', start, stop, items)``
+    Replace the items from ``start`` to ``stop`` of a list or tuple
+    with ``items``.
+
+"""
+
+
+def same(a, b):
+    """Return whether ``a`` and ``b`` are equal and of the same types,
+    all the way down, so that ``1`` and ``1.0`` count as different.
+
+    """
+    if type(a) is not type(b):
+        return False
+    if type(a) is dict:
+        if len(a) != len(b):
+            return False
+        for (k, v) in a.items():
+            if k not in b or not same(v, b[k]):
+                return False
+        return True
+    if type(a) in (list, tuple):
+        if len(a) != len(b):
+            return False
+        for (x, y) in zip(a, b):
+            if not same(x, y):
+                return False
+        return True
+    return a == b
+
+
+def diff(old, new):
+    """Return a patch that turns ``old`` into ``new``."""
+    if type(old) is not type(new):
+        return ('=', new)
+    if type(new) is dict:
+        changed = []
+        for (k, v) in new.items():
+            if k not in old:
+                changed.append((k, ('=', v)))
+            elif not same(old[k], v):
+                changed.append((k, diff(old[k], v)))
+        deleted = tuple(k for k in old if k not in new)
+        return ('d', tuple(changed), deleted)
+    if type(new) in (list, tuple):
+        n = min(len(old), len(new))
+        start = 0
+        while start < n and same(old[start], new[start]):
+            start += 1
+        end = 0
+        while end < n - start and same(old[-end-1], new[-end-1]):
+            end += 1
+        return ('s', start, len(old) - end, list(new[start:len(new)-end]))
+    return ('=', new)
+
+
+def patch(old, delta):
+    """Return the value that ``delta``, from :func:`diff`, makes of
+    ``old``. I don't change ``old``.
+
+    """
+    kind = delta[0]
+    if kind == '=':
+        return delta[1]
+    if kind == 'd':
+        r = dict(old)
+        for k in delta[2]:
+            del r[k]
+        for (k, v) in delta[1]:
+            r[k] = patch(old.get(k), v)
+        return r
+    if kind == 's':
+        (start, stop, items) = delta[1:]
+        r = list(old[:start])
+        r.extend(items)
+        r.extend(old[stop:])
+        return tuple(r) if type(old) is tuple else r
+    raise ValueError("Unknown kind of patch: {!r}".format(kind))
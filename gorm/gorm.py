@@ -9,6 +9,7 @@ from .graph import (
 )
 from .query import QueryEngine
 from .reify import reify
+from .window import WindowDict
 
 
 class GraphNameError(KeyError):
@@ -27,7 +28,7 @@ class ORM(object):
         r = defaultdict(  # graph:
             lambda: defaultdict(  # key:
                 lambda: defaultdict(  # branch:
-                    dict  # rev: value
+                    WindowDict  # rev: value
                 )
             )
         )
@@ -42,7 +43,7 @@ class ORM(object):
             lambda: defaultdict(  # node:
                 lambda: defaultdict(  # key:
                     lambda: defaultdict(  # branch:
-                        dict  # rev: value
+                        WindowDict  # rev: value
                     )
                 )
             )
@@ -57,7 +58,7 @@ class ORM(object):
         r = defaultdict(  # graph:
             lambda: defaultdict(  # node:
                 lambda: defaultdict(  # branch:
-                    dict  # rev: extant
+                    WindowDict  # rev: extant
                 )
             )
         )
@@ -74,7 +75,7 @@ class ORM(object):
                     lambda: defaultdict(  # idx:
                         lambda: defaultdict(  # key:
                             lambda: defaultdict(  # branch:
-                                dict  # rev: value
+                                WindowDict  # rev: value
                             )
                         )
                     )
@@ -95,7 +96,7 @@ class ORM(object):
                 lambda: defaultdict(  # nodeB:
                     lambda: defaultdict(  # idx:
                         lambda: defaultdict(  # branch:
-                            dict  # rev: extant
+                            WindowDict  # rev: extant
                         )
                     )
                 )
@@ -2,16 +2,30 @@
 # Copyright (C) 2014 Zachary Spector.
 import networkx
 from networkx.exception import NetworkXError
-from collections import MutableMapping, MutableSequence
+from collections import MutableMapping, MutableSequence, namedtuple
 from .xjson import (
     JSONWrapper,
     JSONListWrapper,
     JSONReWrapper,
-    JSONListReWrapper
+    JSONListReWrapper,
+    MutationSession
 )
 from .reify import reify
 
 
+def ordered_nodes(nodeA, nodeB):
+    """Return the endpoints of an undirected edge in the order it's stored
+    in: least first, or, if they can't be compared, least ``repr``
+    first.
+
+    """
+    try:
+        swap = nodeB < nodeA
+    except TypeError:
+        swap = repr(nodeB) < repr(nodeA)
+    return (nodeB, nodeA) if swap else (nodeA, nodeB)
+
+
 class GraphMapping(MutableMapping):
     """Mapping for graph attributes"""
     def __init__(self, graph):
@@ -35,35 +49,20 @@ class GraphMapping(MutableMapping):
                     except KeyError:
                         continue
             return
-        seen = set()
-        for (branch, rev) in self.gorm._active_branches():
-            for k in self.gorm.db.graph_val_keys(
-                    self.graph.name,
-                    branch,
-                    rev
-            ):
-                if k not in seen:
-                    yield k
-                seen.add(k)
+        for k in self.gorm.db.graph_val_keys(
+                self.graph.name,
+                self.gorm.branch,
+                self.gorm.rev
+        ):
+            yield k
 
     def __contains__(self, k):
         """Do I have a value for this key right now?"""
-        if self.gorm.caching:
-            cache = self.gorm._graph_val_cache[self.graph.name][k]
-            for (branch, rev) in self.gorm._active_branches():
-                if branch not in cache:
-                    continue
-                try:
-                    return cache[branch][rev]
-                except KeyError:
-                    continue
+        try:
+            self._get(k)
+            return True
+        except KeyError:
             return False
-        return self.gorm.db.graph_val_get(
-            self.graph.name,
-            k,
-            self.gorm.branch,
-            self.gorm.rev
-        )
 
     def __len__(self):
         """Number of set keys"""
@@ -75,30 +74,19 @@ class GraphMapping(MutableMapping):
     def _get(self, key):
         """Just load value from database and return"""
         if self.gorm.caching:
-            cache = self.gorm._graph_val_cache[self.graph.name][key]
-            for (branch, rev) in self.gorm._active_branches():
-                if branch not in cache:
-                    continue
-                try:
-                    result = cache[branch][rev]
-                    if result is None:
-                        raise KeyError("Key {} is not set now".format(key))
-                    return result
-                except KeyError:
-                    continue
-            raise KeyError("Key {} is not set, ever".format(key))
-        for (branch, rev) in self.gorm._active_branches():
+            result = self.gorm._graph_val_cache[self.graph.name].resolve(
+                (key,), self.gorm._active_branches()
+            )
+        else:
             result = self.gorm.db.graph_val_get(
                 self.graph.name,
                 key,
-                branch,
-                rev
+                self.gorm.branch,
+                self.gorm.rev
             )
-            if not result:
-                continue
-            return result
-
-        raise KeyError("Key is not set, ever")
+        if result is None:
+            raise KeyError("Key {} is not set now".format(key))
+        return result
 
     def __getitem__(self, key):
         """If key is 'graph', return myself as a dict, else get the present
@@ -119,52 +107,36 @@ class GraphMapping(MutableMapping):
 
         if key == 'graph':
             return dict(self)
-        if self.gorm.caching:
-            cache = self.gorm._graph_val_cache[self.graph.name][key]
-            for (branch, rev) in self.gorm._active_branches():
-                if branch not in cache:
-                    continue
-                try:
-                    r = cache[branch][rev]
-                    if r is None:
-                        raise KeyError("key {} is not set now".format(key))
-                    return wrapval(r)
-                except KeyError:
-                    continue
-            raise KeyError("key {} is not set, ever".format(key))
-        return wrapval(self.gorm.db.graph_val_get(
-            self.graph.name,
-            key,
-            self.gorm.branch,
-            self.gorm.rev
-        ))
+        return wrapval(self._get(key))
 
     def __setitem__(self, key, value):
         """Set key=value at the present branch and revision"""
         branch = self.gorm.branch
         rev = self.gorm.rev
-        self.gorm.db.graph_val_set(
-            self.graph.name,
-            key,
-            branch,
-            rev,
-            value
-        )
-        if self.gorm.caching:
-            self.gorm._graph_val_cache[self.graph.name][key][branch][rev] = value
+        with self.gorm.lock:
+            self.gorm.db.graph_val_set(
+                self.graph.name,
+                key,
+                branch,
+                rev,
+                value
+            )
+            if self.gorm.caching:
+                self.gorm._graph_val_cache[self.graph.name][key][branch][rev] = value
 
     def __delitem__(self, key):
         """Indicate that the key has no value at this time"""
         branch = self.gorm.branch
         rev = self.gorm.rev
-        self.gorm.db.graph_val_del(
-            self.graph.name,
-            key,
-            branch,
-            rev
-        )
-        if self.gorm.caching:
-            self.gorm._graph_val_cache[self.graph.name][key][branch][rev] = None
+        with self.gorm.lock:
+            self.gorm.db.graph_val_del(
+                self.graph.name,
+                key,
+                branch,
+                rev
+            )
+            if self.gorm.caching:
+                self.gorm._graph_val_cache[self.graph.name][key][branch][rev] = None
 
     def clear(self):
         """Delete everything"""
@@ -175,6 +147,19 @@ class GraphMapping(MutableMapping):
         """Looks like a dictionary."""
         return repr(dict(self))
 
+    def session(self):
+        """Return a :class:`MutationSession` on me, to make many changes
+        to my values with only one write each.
+
+        Use it in a ``with`` block::
+
+            with node.session() as attrs:
+                for i in range(1000):
+                    attrs['log'].append(i)
+
+        """
+        return MutationSession(self)
+
     def update(self, other):
         """Version of ``update`` that doesn't clobber the database so much"""
         iteratr = (
@@ -228,19 +213,12 @@ class Node(GraphMapping):
 
     def _get(self, key):
         if self.gorm.caching:
-            cache = self.gorm._node_val_cache[self.graph.name][self.node][key]
-            for (branch, rev) in self.gorm._active_branches():
-                if branch not in cache:
-                    continue
-                try:
-                    r = cache[branch][rev]
-                except KeyError:
-                    continue
-                if r is None:
-                    raise KeyError("Key {} is not set now".format(key))
-                else:
-                    return r
-            raise KeyError("Key {} is never set".format(key))
+            r = self.gorm._node_val_cache[self.graph.name].resolve(
+                (self.node, key), self.gorm._active_branches()
+            )
+            if r is None:
+                raise KeyError("Key {} is not set now".format(key))
+            return r
         return self.gorm.db.node_val_get(
             self.graph.name,
             self.node,
@@ -263,6 +241,16 @@ class Node(GraphMapping):
         else:
             return r
 
+    def _window(self, key, branch):
+        """Return the cache's window of revisions for ``key`` in
+        ``branch``.
+
+        Before a value is rewritten, I decode the later values in the
+        window, which may be patches against it.
+
+        """
+        return self.gorm._node_val_cache[self.graph.name][self.node][key][branch]
+
     def __setitem__(self, key, value):
         """Set key=value at the present branch and rev. Overwrite if
         necessary.
@@ -270,16 +258,20 @@ class Node(GraphMapping):
         """
         branch = self.gorm.branch
         rev = self.gorm.rev
-        self.gorm.db.node_val_set(
-            self.graph.name,
-            self.node,
-            key,
-            branch,
-            rev,
-            value
-        )
-        if self.gorm.caching:
-            self.gorm._node_val_cache[self.graph.name][self.node][key][branch][rev] = value
+        with self.gorm.lock:
+            if self.gorm.caching:
+                window = self._window(key, branch)
+                window.load_after(rev)
+            self.gorm.db.node_val_set(
+                self.graph.name,
+                self.node,
+                key,
+                branch,
+                rev,
+                value
+            )
+            if self.gorm.caching:
+                window[rev] = value
 
     def __delitem__(self, key):
         """Set the key's value to NULL, indicating it should be ignored
@@ -288,15 +280,19 @@ class Node(GraphMapping):
         """
         branch = self.gorm.branch
         rev = self.gorm.rev
-        self.gorm.db.node_val_del(
-            self.graph.name,
-            self.node,
-            key,
-            branch,
-            rev
-        )
-        if self.gorm.caching:
-            self.gorm._node_val_cache[self.graph.name][self.node][key][branch][rev] = None
+        with self.gorm.lock:
+            if self.gorm.caching:
+                window = self._window(key, branch)
+                window.load_after(rev)
+            self.gorm.db.node_val_del(
+                self.graph.name,
+                self.node,
+                key,
+                branch,
+                rev
+            )
+            if self.gorm.caching:
+                window[rev] = None
 
     def clear(self):
         """Delete everything"""
@@ -346,15 +342,13 @@ class Edge(GraphMapping):
 
     def _get(self, key):
         if self.gorm.caching:
-            cache = self.gorm._edge_val_cache[self.graph.name][self.nodeA][self.nodeB][self.idx]
-            for (branch, rev) in self.gorm._active_branches():
-                if branch not in cache:
-                    continue
-                result = cache[branch][rev]
-                if result is None:
-                    raise KeyError("Key {} is not set now".format(key))
-                return result
-            raise KeyError("Key is not set, ever")
+            result = self.gorm._edge_val_cache[self.graph.name].resolve(
+                (self.nodeA, self.nodeB, self.idx, key),
+                self.gorm._active_branches()
+            )
+            if result is None:
+                raise KeyError("Key {} is not set now".format(key))
+            return result
         return self.gorm.db.edge_val_get(
             self.graph.name,
             self.nodeA,
@@ -382,40 +376,62 @@ class Edge(GraphMapping):
         else:
             return r
 
+    def _window(self, key, branch):
+        """Return the cache's window of revisions for ``key`` in
+        ``branch``.
+
+        Before a value is rewritten, I decode the later values in the
+        window, which may be patches against it.
+
+        """
+        return self.gorm._edge_val_cache[self.graph.name][self.nodeA][self.nodeB][self.idx][key][branch]
+
     def __setitem__(self, key, value):
         """Set a database record to say that key=value at the present branch
         and revision
 
         """
-        self.gorm.db.edge_val_set(
-            self.graph.name,
-            self.nodeA,
-            self.nodeB,
-            self.idx,
-            key,
-            self.gorm.branch,
-            self.gorm.rev,
-            value
-        )
-        if self.gorm.caching:
-            self.gorm._edge_val_cache[self.graph.name][self.nodeA][self.nodeB][self.idx][self.gorm.branch][self.gorm.rev] = value
+        branch = self.gorm.branch
+        rev = self.gorm.rev
+        with self.gorm.lock:
+            if self.gorm.caching:
+                window = self._window(key, branch)
+                window.load_after(rev)
+            self.gorm.db.edge_val_set(
+                self.graph.name,
+                self.nodeA,
+                self.nodeB,
+                self.idx,
+                key,
+                branch,
+                rev,
+                value
+            )
+            if self.gorm.caching:
+                window[rev] = value
 
     def __delitem__(self, key):
         """Set the key's value to NULL, such that it is not yielded by
         ``__iter__``
 
         """
-        self.gorm.db.edge_val_del(
-            self.graph.name,
-            self.nodeA,
-            self.nodeB,
-            self.idx,
-            key,
-            self.gorm.branch,
-            self.gorm.rev
-        )
-        if self.gorm.caching:
-            self.gorm._edge_val_cache[self.graph.name][self.nodeA][self.nodeB][self.idx][self.gorm.branch][self.gorm.rev] = None
+        branch = self.gorm.branch
+        rev = self.gorm.rev
+        with self.gorm.lock:
+            if self.gorm.caching:
+                window = self._window(key, branch)
+                window.load_after(rev)
+            self.gorm.db.edge_val_del(
+                self.graph.name,
+                self.nodeA,
+                self.nodeB,
+                self.idx,
+                key,
+                branch,
+                rev
+            )
+            if self.gorm.caching:
+                window[rev] = None
 
     def clear(self):
         """Delete everything"""
@@ -438,17 +454,11 @@ class GraphNodeMapping(GraphMapping):
         """Return whether the node exists presently"""
         if self.gorm.caching:
             try:
-                cache = self.gorm._nodes_cache[self.graph.name][node]
+                return self.gorm._nodes_cache[self.graph.name].resolve(
+                    (node,), self.gorm._active_branches()
+                )
             except KeyError:
                 return False
-            for (branch, rev) in self.gorm._active_branches():
-                if branch not in cache:
-                    continue
-                try:
-                    return cache[branch][rev]
-                except KeyError:
-                    continue
-            return False
         return self.gorm.db.node_exists(
             self.graph.name,
             node,
@@ -475,32 +485,38 @@ class GraphNodeMapping(GraphMapping):
         is made with them, perhaps clearing out the one already there.
 
         """
-        self.gorm.db.exist_node(
-            self.graph.name,
-            node,
-            self.gorm.branch,
-            self.gorm.rev,
-            True
-        )
-        n = Node(self.graph, node)
-        n.clear()
-        n.update(dikt)
-        if self.gorm.caching:
-            self.gorm._nodes_cache[self.graph.name][node][self.gorm.branch][self.gorm.rev] = True
+        branch = self.gorm.branch
+        rev = self.gorm.rev
+        with self.gorm.lock:
+            self.gorm.db.exist_node(
+                self.graph.name,
+                node,
+                branch,
+                rev,
+                True
+            )
+            n = Node(self.graph, node)
+            n.clear()
+            n.update(dikt)
+            if self.gorm.caching:
+                self.gorm._nodes_cache[self.graph.name][node][branch][rev] = True
 
     def __delitem__(self, node):
         """Indicate that the given node no longer exists"""
         if node not in self:
             raise KeyError("No such node")
-        self.gorm.db.exist_node(
-            self.graph.name,
-            node,
-            self.gorm.branch,
-            self.gorm.rev,
-            False
-        )
-        if self.gorm.caching:
-            self.gorm._nodes_cache[self.graph.name][node][self.gorm.branch][self.gorm.rev] = False
+        branch = self.gorm.branch
+        rev = self.gorm.rev
+        with self.gorm.lock:
+            self.gorm.db.exist_node(
+                self.graph.name,
+                node,
+                branch,
+                rev,
+                False
+            )
+            if self.gorm.caching:
+                self.gorm._nodes_cache[self.graph.name][node][branch][rev] = False
 
     def __eq__(self, other):
         """Compare values cast into dicts.
@@ -555,27 +571,12 @@ class GraphEdgeMapping(GraphMapping):
 
     def __iter__(self):
         if self.gorm.caching:
-            cache = self.gorm._edges_cache[self.graph.name]
-            seen = set()
-            for nodeA in cache:
-                if nodeA in seen:
-                    continue
-                for nodeB in cache[nodeA]:
-                    if nodeB in seen:
-                        continue
-                    for idx in cache[nodeA][nodeB]:
-                        for (branch, rev) in self.gorm._active_branches():
-                            if branch not in cache[nodeA][nodeB][idx]:
-                                continue
-                            try:
-                                if cache[nodeA][nodeB][idx][branch][rev]:
-                                    yield nodeA
-                                    yield nodeB
-                                seen.add(nodeA)
-                                seen.add(nodeB)
-                                break
-                            except KeyError:
-                                continue
+            index = self.gorm._adjacency(self.graph.name)
+            for nodeA in list(index.succ):
+                yield nodeA
+            for nodeB in list(index.pred):
+                if nodeB not in index.succ:
+                    yield nodeB
             return
         for nodeA in self.gorm.db.edges_extant(
             self.graph.name,
@@ -596,23 +597,9 @@ class AbstractSuccessors(GraphEdgeMapping):
     def __iter__(self):
         """Iterate over node IDs that have an edge with my nodeA"""
         if self.gorm.caching:
-            cache = self.gorm._edges_cache[self.graph.name][self.nodeA]
-            seen = False
-            for nodeB in cache:
-                for idx in cache[nodeB]:
-                    if seen:
-                        seen = False
-                        break
-                    for (branch, rev) in self.gorm._active_branches():
-                        if branch in cache[nodeB][idx]:
-                            try:
-                                if cache[nodeB][idx][branch][rev]:
-                                    yield nodeB
-                                seen = True
-                                break
-                            except KeyError:
-                                continue
-            return
+            return iter(list(
+                self.gorm._adjacency(self.graph.name).succ.get(self.nodeA, ())
+            ))
         return self.gorm.db.nodeBs(
             self.graph.name,
             self.nodeA,
@@ -623,17 +610,8 @@ class AbstractSuccessors(GraphEdgeMapping):
     def __contains__(self, nodeB):
         """Is there an edge leading to ``nodeB`` at the moment?"""
         if self.gorm.caching:
-            cache = self.gorm._edges_cache[self.graph.name][self.nodeA][nodeB]
-            for idx in cache:
-                for (branch, rev) in self.gorm._active_branches():
-                    if branch not in cache[idx]:
-                        continue
-                    try:
-                        if cache[idx][branch][rev]:
-                            return True
-                    except KeyError:
-                        continue
-            return False
+            succ = self.gorm._adjacency(self.graph.name).succ
+            return self.nodeA in succ and nodeB in succ[self.nodeA]
         for i in self.gorm.db.multi_edges(
                 self.graph.name,
                 self.nodeA,
@@ -646,6 +624,10 @@ class AbstractSuccessors(GraphEdgeMapping):
 
     def __len__(self):
         """How many nodes touch an edge shared with my nodeA?"""
+        if self.gorm.caching:
+            return len(
+                self.gorm._adjacency(self.graph.name).succ.get(self.nodeA, ())
+            )
         n = 0
         for nodeB in iter(self):
             n += 1
@@ -662,34 +644,14 @@ class AbstractSuccessors(GraphEdgeMapping):
         value, a mapping.
 
         """
-        self.gorm.db.exist_edge(
-            self.graph.name,
-            self.nodeA,
-            nodeB,
-            0,
-            self.gorm.branch,
-            self.gorm.rev,
-            True
-        )
-        if self.gorm.caching:
-            self.gorm._edges_cache[self.graph.name][self.nodeA][nodeB][0][self.gorm.branch][self.gorm.rev] = True
+        self.gorm._exist_edge(self.graph.name, self.nodeA, nodeB, 0, True)
         e = self[nodeB]
         e.clear()
         e.update(value)
 
     def __delitem__(self, nodeB):
         """Remove the edge between my nodeA and the given nodeB"""
-        self.gorm.db.exist_edge(
-            self.graph.name,
-            self.nodeA,
-            nodeB,
-            0,
-            self.gorm.branch,
-            self.gorm.rev,
-            False
-        )
-        if self.gorm.caching:
-            self.gorm._edges_cache[self.graph.name][self.nodeA][nodeB][0] = False
+        self.gorm._exist_edge(self.graph.name, self.nodeA, nodeB, 0, False)
 
     def clear(self):
         """Delete every edge with origin at my nodeA"""
@@ -701,10 +663,7 @@ class GraphSuccessorsMapping(GraphEdgeMapping):
     """Mapping for Successors (itself a MutableMapping)"""
     class Successors(AbstractSuccessors):
         def _order_nodes(self, nodeB):
-            if nodeB < self.nodeA:
-                return (nodeB, self.nodeA)
-            else:
-                return (self.nodeA, nodeB)
+            return ordered_nodes(self.nodeA, nodeB)
 
     def __getitem__(self, nodeA):
         """If the node exists, return a Successors instance for it"""
@@ -728,25 +687,8 @@ class GraphSuccessorsMapping(GraphEdgeMapping):
     def __iter__(self):
         """Iterate over nodes that have at least one outgoing edge"""
         if self.gorm.caching:
-            cache = self.gorm._edges_cache[self.graph.name]
-            seen = False
-            for nodeA in cache:
-                for nodeB in cache[nodeA]:
-                    for idx in cache[nodeA][nodeB]:
-                        if seen:
-                            seen = False
-                            break
-                        for (branch, rev) in self.gorm._active_branches():
-                            if branch not in cache[nodeA][nodeB][idx]:
-                                continue
-                            try:
-                                cache2 = cache[nodeA][nodeB][idx][branch]
-                                if cache2[rev]:
-                                    yield nodeA
-                                seen = True
-                                break
-                            except KeyError:
-                                continue
+            for nodeA in list(self.gorm._adjacency(self.graph.name).succ):
+                yield nodeA
             return
         for nodeB in self.gorm.db.edges_extant(
             self.graph.name,
@@ -761,18 +703,7 @@ class GraphSuccessorsMapping(GraphEdgeMapping):
 
         """
         if self.gorm.caching:
-            cache = self.gorm._edges_cache[self.graph.name][nodeA]
-            for nodeB in cache:
-                for idx in cache[nodeB]:
-                    for (branch, rev) in self.gorm._active_branches():
-                        if branch not in cache[nodeB][idx]:
-                            continue
-                        try:
-                            if cache[nodeB][idx][branch][rev]:
-                                return True
-                        except KeyError:
-                            continue
-            return False
+            return nodeA in self.gorm._adjacency(self.graph.name).succ
         for b in self.gorm.db.nodeBs(
                 self.graph.name,
                 nodeA,
@@ -796,20 +727,7 @@ class DiGraphPredecessorsMapping(GraphEdgeMapping):
     """
     def __contains__(self, nodeB):
         if self.gorm.caching:
-            cache = self.gorm._edges_cache[self.graph.name]
-            for nodeA in cache:
-                if nodeB not in cache[nodeA]:
-                    continue
-                for idx in cache[nodeA][nodeB]:
-                    for (branch, rev) in self.gorm._active_branches():
-                        if branch not in cache[nodeA][nodeB][idx]:
-                            continue
-                        try:
-                            if cache[nodeA][nodeB][idx][branch][rev]:
-                                return True
-                        except KeyError:
-                            continue
-            return False
+            return nodeB in self.gorm._adjacency(self.graph.name).pred
         for a in self.gorm.db.nodeAs(
                 self.graph.name,
                 nodeB,
@@ -841,31 +759,16 @@ class DiGraphPredecessorsMapping(GraphEdgeMapping):
     def __iter__(self):
         """Iterate over nodes with at least one edge leading to them"""
         if self.gorm.caching:
-            cache = self.gorm._edges_cache[self.graph.name]
-            seen = False
-            for nodeA in cache:
-                for nodeB in cache[nodeA]:
-                    for idx in cache[nodeA][nodeB]:
-                        if seen:
-                            seen = False
-                            break
-                        for (branch, rev) in self.gorm._active_branches():
-                            if branch not in cache[nodeA][nodeB]:
-                                continue
-                            try:
-                                if cache[nodeA][nodeB][idx][branch][rev]:
-                                    yield nodeB
-                                seen = True
-                                break
-                            except KeyError:
-                                continue
+            for nodeB in list(self.gorm._adjacency(self.graph.name).pred):
+                yield nodeB
             return
-        return self.gorm.db.nodeBs(
-            self.graph.name,
-            self.nodeA,
-            self.gorm.branch,
-            self.gorm.rev
-        )
+        for nodeB in list(self.gorm.db.nodes_extant(
+                self.graph.name,
+                self.gorm.branch,
+                self.gorm.rev
+        )):
+            if nodeB in self:
+                yield nodeB
 
     class Predecessors(GraphEdgeMapping):
         """Mapping of Edges that end at a particular node"""
@@ -881,26 +784,11 @@ class DiGraphPredecessorsMapping(GraphEdgeMapping):
 
             """
             if self.gorm.caching:
-                cache = self.gorm._edges_cache[self.graph.name]
-                seen = False
-                for nodeA in cache:
-                    if self.nodeB not in cache[nodeA]:
-                        continue
-                    for idx in cache[nodeA][self.nodeB]:
-                        if seen:
-                            seen = False
-                            break
-                        for (branch, rev) in self.gorm._active_branches():
-                            if branch not in cache[nodeA][self.nodeB][idx]:
-                                continue
-                            try:
-                                if cache[nodeA][self.nodeB][idx][branch][rev]:
-                                    yield nodeA
-                                seen = True
-                                break
-                            except KeyError:
-                                continue
-                return
+                return iter(list(
+                    self.gorm._adjacency(self.graph.name).pred.get(
+                        self.nodeB, ()
+                    )
+                ))
             return self.gorm.db.nodeAs(
                 self.graph.name,
                 self.nodeB,
@@ -911,20 +799,11 @@ class DiGraphPredecessorsMapping(GraphEdgeMapping):
         def __contains__(self, nodeA):
             """Is there an edge from ``nodeA`` at the moment?"""
             if self.gorm.caching:
-                cache = self.gorm._edges_cache[self.graph.name][nodeA][self.nodeB]
-                for idx in cache:
-                    for (branch, rev) in self.gorm._active_branches():
-                        if branch not in cache:
-                            continue
-                        try:
-                            if cache[branch][rev]:
-                                return True
-                        except KeyError:
-                            continue
-                return False
+                pred = self.gorm._adjacency(self.graph.name).pred
+                return self.nodeB in pred and nodeA in pred[self.nodeB]
             for i in self.gorm.db.multi_edges(
                     self.graph.name,
-                    self.nodeA,
+                    nodeA,
                     self.nodeB,
                     self.gorm.branch,
                     self.gorm.rev
@@ -934,6 +813,12 @@ class DiGraphPredecessorsMapping(GraphEdgeMapping):
 
         def __len__(self):
             """How many edges exist at this rev of this branch?"""
+            if self.gorm.caching:
+                return len(
+                    self.gorm._adjacency(self.graph.name).pred.get(
+                        self.nodeB, ()
+                    )
+                )
             n = 0
             for nodeA in iter(self):
                 n += 1
@@ -948,34 +833,14 @@ class DiGraphPredecessorsMapping(GraphEdgeMapping):
             given node to mine.
 
             """
-            self.gorm.db.exist_edge(
-                self.graph.name,
-                nodeA,
-                self.nodeB,
-                0,
-                self.gorm.branch,
-                self.gorm.rev,
-                True
-            )
-            e = self._getsub(nodeA)
+            self.gorm._exist_edge(self.graph.name, nodeA, self.nodeB, 0, True)
+            e = self[nodeA]
             e.clear()
             e.update(value)
-            if self.gorm.caching:
-                self.gorm._edges_cache[nodeA][self.nodeB][0][self.gorm.branch][self.gorm.rev] = True
 
         def __delitem__(self, nodeA):
             """Unset the existence of the edge from the given node to mine"""
-            self.gorm.db.exist_edge(
-                self.graph.name,
-                nodeA,
-                self.nodeB,
-                0,
-                self.gorm.branch,
-                self.gorm.rev,
-                False
-            )
-            if self.gorm.caching:
-                self.gorm._edges_cache[nodeA][self.nodeB][0][self.gorm.branch][self.gorm.rev] = False
+            self.gorm._exist_edge(self.graph.name, nodeA, self.nodeB, 0, False)
 
 
 class MultiEdges(GraphEdgeMapping):
@@ -989,18 +854,8 @@ class MultiEdges(GraphEdgeMapping):
 
     def __iter__(self):
         if self.gorm.caching:
-            cache = self.gorm._edges_cache[self.graph.name][self.nodeA][self.nodeB]
-            for idx in cache:
-                for (branch, rev) in self.gorm._active_branches():
-                    if branch not in cache[idx]:
-                        continue
-                    try:
-                        if cache[idx][branch][rev]:
-                            yield idx
-                        break
-                    except KeyError:
-                        continue
-            return
+            succ = self.gorm._adjacency(self.graph.name).succ
+            return iter(succ.get(self.nodeA, {}).get(self.nodeB, ()))
         return self.gorm.db.multi_edges(
             self.graph.name,
             self.nodeA,
@@ -1011,6 +866,9 @@ class MultiEdges(GraphEdgeMapping):
 
     def __len__(self):
         """How many edges currently connect my two nodes?"""
+        if self.gorm.caching:
+            succ = self.gorm._adjacency(self.graph.name).succ
+            return len(succ.get(self.nodeA, {}).get(self.nodeB, ()))
         n = 0
         for idx in iter(self):
             n += 1
@@ -1018,15 +876,8 @@ class MultiEdges(GraphEdgeMapping):
 
     def __contains__(self, i):
         if self.gorm.caching:
-            cache = self.gorm._edges_cache[self.graph.name][self.nodeA][self.nodeB][i]
-            for (branch, rev) in self.gorm._active_branches():
-                if branch not in cache:
-                    continue
-                try:
-                    return cache[branch][rev]
-                except KeyError:
-                    continue
-            return False
+            succ = self.gorm._adjacency(self.graph.name).succ
+            return i in succ.get(self.nodeA, {}).get(self.nodeB, ())
         return self.gorm.db.edge_exists(
             self.graph.name,
             self.nodeA,
@@ -1050,28 +901,21 @@ class MultiEdges(GraphEdgeMapping):
         Edge first, if necessary.
 
         """
-        self.gorm.db.exist_edge(
-            self.graph.name,
-            self.nodeA,
-            self.nodeB,
-            idx,
-            self.gorm.branch,
-            self.gorm.rev
+        self.gorm._exist_edge(
+            self.graph.name, self.nodeA, self.nodeB, idx, True
         )
         e = Edge(self.graph, self.nodeA, self.nodeB, idx)
         e.clear()
         e.update(val)
-        if self.gorm.caching:
-            self.gorm._edges_cache[self.graph.name][self.nodeA][self.nodeB][idx][self.gorm.branch][self.gorm.rev] = True
 
     def __delitem__(self, idx):
         """Delete the edge at a particular index"""
-        e = Edge(self.graph, self.nodeA, self.nodeB, idx)
-        if not e.exists:
+        if idx not in self:
             raise KeyError("No edge at that index")
-        e.clear()
-        if self.gorm.caching:
-            self.gorm._edges_cache[self.graph.name][self.nodeA][self.nodeB][idx][self.gorm.branch][self.gorm.rev] = False
+        Edge(self.graph, self.nodeA, self.nodeB, idx).clear()
+        self.gorm._exist_edge(
+            self.graph.name, self.nodeA, self.nodeB, idx, False
+        )
 
     def clear(self):
         """Delete all edges between these nodes"""
@@ -1083,7 +927,7 @@ class MultiGraphSuccessorsMapping(GraphSuccessorsMapping):
     """Mapping of Successors that map to MultiEdges"""
     def __getitem__(self, nodeA):
         """If the node exists, return its Successors"""
-        if not self.gorm._node_exists(self.graph.name, nodeA):
+        if nodeA not in self.graph.node:
             raise KeyError("No such node")
         return self.Successors(self, nodeA)
 
@@ -1103,10 +947,7 @@ class MultiGraphSuccessorsMapping(GraphSuccessorsMapping):
     class Successors(AbstractSuccessors):
         """Edges succeeding a given node in a multigraph"""
         def _order_nodes(self, nodeB):
-            if nodeB < self.nodeA:
-                return(nodeB, self.nodeA)
-            else:
-                return (self.nodeA, nodeB)
+            return ordered_nodes(self.nodeA, nodeB)
 
         def __getitem__(self, nodeB):
             """Return MultiEdges to ``nodeB`` if it exists"""
@@ -1126,6 +967,13 @@ class MultiGraphSuccessorsMapping(GraphSuccessorsMapping):
             self[nodeB].clear()
 
 
+class MultiDiGraphSuccessorsMapping(MultiGraphSuccessorsMapping):
+    """Version of MultiGraphSuccessorsMapping for directed multigraphs"""
+    class Successors(MultiGraphSuccessorsMapping.Successors):
+        def _order_nodes(self, nodeB):
+            return (self.nodeA, nodeB)
+
+
 class MultiDiGraphPredecessorsMapping(DiGraphPredecessorsMapping):
     """Version of DiGraphPredecessorsMapping for multigraphs"""
     class Predecessors(DiGraphPredecessorsMapping.Predecessors):
@@ -1141,6 +989,29 @@ class MultiDiGraphPredecessorsMapping(DiGraphPredecessorsMapping):
             self[nodeA].clear()
 
 
+GraphArrays = namedtuple(
+    'GraphArrays',
+    ['nodes', 'indptr', 'indices', 'idx', 'node_attrs', 'edge_attrs']
+)
+
+
+def _column(numpy, values):
+    """Return an array of ``values``, of objects unless they're all
+    numbers or all strings.
+
+    """
+    types = set(map(type, values))
+    if types and (
+            types <= set([bool, int, float]) or
+            len(types) == 1 and types <= set([str, type(u'')])
+    ):
+        return numpy.array(values)
+    r = numpy.empty(len(values), dtype=object)
+    for (i, v) in enumerate(values):
+        r[i] = v
+    return r
+
+
 class GormGraph(object):
     """Class giving the gorm graphs those methods they share in
     common.
@@ -1182,6 +1053,83 @@ class GormGraph(object):
     def name(self, v):
         raise TypeError("gorm graphs can't be renamed")
 
+    def to_arrays(self):
+        """Return my nodes and edges, and their attributes, as of the
+        present branch and revision, as NumPy arrays in a
+        :class:`GraphArrays`.
+
+        ``nodes`` holds the nodes, in the order they were first
+        named, and the other arrays refer to nodes by their position
+        in it. ``indptr`` and ``indices`` are my ``adj`` in compressed
+        sparse row form: the edges from ``nodes[i]`` go to the nodes
+        at ``indices[indptr[i]:indptr[i+1]]``. If I'm undirected, each
+        edge is there under both its nodes. ``idx`` holds the index
+        of each of those edges, which is always 0 unless I'm a
+        multigraph. For a SciPy matrix::
+
+            a = g.to_arrays()
+            scipy.sparse.csr_matrix(
+                (numpy.ones(len(a.indices)), a.indices, a.indptr),
+                shape=(len(a.nodes), len(a.nodes))
+            )
+
+        ``node_attrs`` maps each node attribute key to an array of
+        its values, one per node. ``edge_attrs`` does the same for
+        edges, lined up with ``indices``. Where a node or edge has no
+        value for the key, it gets ``None``, and the array holds
+        objects.
+
+        Everything is read from the database in one go; see
+        :meth:`gorm.query.QueryEngine.graph_state`.
+
+        """
+        import numpy
+        (nodes, node_val, edges, edge_val) = self.gorm.db.graph_state(
+            self._name, self.gorm.branch, self.gorm.rev
+        )
+        pos = dict((node, i) for (i, node) in enumerate(nodes))
+        edges = sorted(
+            (pos[nodeA], pos[nodeB], idx, nodeA, nodeB)
+            for (nodeA, nodeB, idx) in edges
+            if nodeA in pos and nodeB in pos
+        )
+        if not self.is_directed():
+            # an undirected graph lists each edge under both its nodes
+            there = set(edge[:3] for edge in edges)
+            edges += [
+                (b, a, idx, nodeA, nodeB)
+                for (a, b, idx, nodeA, nodeB) in edges
+                if a != b and (b, a, idx) not in there
+            ]
+            edges.sort()
+        indptr = numpy.zeros(len(nodes) + 1, dtype=numpy.int64)
+        for edge in edges:
+            indptr[edge[0] + 1] += 1
+        numpy.cumsum(indptr, out=indptr)
+        node_keys = set(key for (node, key) in node_val)
+        edge_keys = set(key for (nodeA, nodeB, idx, key) in edge_val)
+        return GraphArrays(
+            nodes=_column(numpy, nodes),
+            indptr=indptr,
+            indices=numpy.array(
+                [edge[1] for edge in edges], dtype=numpy.int64
+            ),
+            idx=numpy.array([edge[2] for edge in edges], dtype=numpy.int64),
+            node_attrs=dict(
+                (key, _column(numpy, [
+                    node_val.get((node, key)) for node in nodes
+                ]))
+                for key in node_keys
+            ),
+            edge_attrs=dict(
+                (key, _column(numpy, [
+                    edge_val.get((nodeA, nodeB, idx, key))
+                    for (a, b, idx, nodeA, nodeB) in edges
+                ]))
+                for key in edge_keys
+            )
+        )
+
     def _and_previous(self):
         """Return a 4-tuple that will usually be (current branch, current
         revision - 1, current branch, current revision), unless
@@ -1192,7 +1140,7 @@ class GormGraph(object):
         """
         branch = self.gorm.branch
         rev = self.gorm.rev
-        (parent, parent_rev) = self.gorm.sql('parparrev', branch).fetchone()
+        (parent, parent_rev) = self.gorm.db.sqlone('parparrev', branch)
         before_branch = parent if parent_rev == rev else branch
         return (before_branch, rev-1, branch, rev)
 
@@ -1354,7 +1302,7 @@ class MultiGraph(GormGraph, networkx.MultiGraph):
 
     @reify
     def adj(self):
-        return MultiGraphSuccessorsMapping(self.gorm, self._name)
+        return MultiGraphSuccessorsMapping(self)
 
     @property
     def edge(self):
@@ -1379,7 +1327,7 @@ class MultiDiGraph(GormGraph, networkx.MultiDiGraph):
 
     @reify
     def adj(self):
-        return MultiGraphSuccessorsMapping(self.gorm, self._name)
+        return MultiDiGraphSuccessorsMapping(self)
 
     @property
     def succ(self):
@@ -1387,7 +1335,7 @@ class MultiDiGraph(GormGraph, networkx.MultiDiGraph):
 
     @reify
     def pred(self):
-        return MultiDiGraphPredecessorsMapping(self.gorm, self._name)
+        return MultiDiGraphPredecessorsMapping(self)
 
     def remove_edge(self, u, v, key=None):
         """Version of remove_edge that's much like normal networkx but only
@@ -0,0 +1,114 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Bring a database made by an older version of gorm up to date.
+
+That means converting the tables of graph data from when they stored
+graph names, node names, and keys as text, to refer to them by ID in
+the ``names`` table, if need be; then replacing the old indices with
+the ones :func:`gorm.alchemy.indices_for_table_dict` describes. Run it
+as::
+
+    python -m gorm.migrate sqlite:///path/to/world.db
+
+or, to use sqlite3 rather than SQLAlchemy, with the path alone::
+
+    python -m gorm.migrate /path/to/world.db
+
+"""
+import sys
+from .query import QueryEngine, keyframe_kinds, name_columns, \
+    write_statements
+
+
+# the columns of the old tables of graph data, in the order the
+# ``_ins`` queries for the new ones take them
+old_columns = {
+    'graph_val': ('graph', '"key"', 'branch', 'rev', 'value'),
+    'nodes': ('graph', 'node', 'branch', 'rev', 'extant'),
+    'node_val': ('graph', 'node', '"key"', 'branch', 'rev', 'value'),
+    'edges': (
+        'graph', '"nodeA"', '"nodeB"', 'idx', 'branch', 'rev', 'extant'
+    ),
+    'edge_val': (
+        'graph', '"nodeA"', '"nodeB"', 'idx', '"key"', 'branch', 'rev',
+        'value'
+    )
+}
+
+
+def convert_names(qe):
+    """Convert the tables of graph data in the database of the
+    :class:`gorm.query.QueryEngine` ``qe``, which store names as text,
+    to refer to them by ID, and commit.
+
+    I rename the old tables, make the new ones, copy the records over,
+    giving each name an ID as I come to it, then drop the old tables.
+    Values are copied as they are, so ``qe`` should encode names the
+    way the database was written, which, before names had IDs, was
+    always JSON.
+
+    """
+    conn = qe.alchemist.conn if hasattr(qe, 'alchemist') \
+        else qe.connection
+    tables = ('graphs',) + keyframe_kinds
+    for table in tables:
+        conn.execute('ALTER TABLE {0} RENAME TO {0}_old'.format(table))
+    qe.commit()
+    qe._begin()
+    qe.initdb()
+    load = qe.json_load
+    intern = qe._intern_name
+    for (graph, typ) in conn.execute(
+            'SELECT graph, type FROM graphs_old'
+    ).fetchall():
+        qe.new_graph(load(graph), typ)
+    for table in keyframe_kinds:
+        names = name_columns[table]
+        cursor = conn.execute('SELECT {} FROM {}_old'.format(
+            ', '.join(old_columns[table]), table
+        ))
+        while True:
+            rows = cursor.fetchmany(qe.fetch_rows)
+            if not rows:
+                break
+            todo = []
+            for row in rows:
+                row = list(row)
+                for i in names:
+                    row[i] = intern(load(row[i]))
+                todo.append(tuple(row))
+            qe.sqlmany(write_statements[table][0], todo)
+    for table in reversed(tables):
+        conn.execute('DROP TABLE {}_old'.format(table))
+    qe.commit()
+    qe._begin()
+
+
+def migrate(dbstring, alchemy=None, connect_args={}):
+    """Update the database at ``dbstring``, a URI or anything else
+    :class:`gorm.query.QueryEngine` takes, and commit.
+
+    Unless told otherwise with ``alchemy``, I use SQLAlchemy if
+    ``dbstring`` is a URI, and sqlite3 if it's a path.
+
+    """
+    if alchemy is None:
+        alchemy = '://' in dbstring
+    qe = QueryEngine(dbstring, connect_args, alchemy)
+    if qe.old_schema():
+        convert_names(qe)
+    qe.update_indices()
+    qe.close()
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    if len(args) != 1:
+        sys.stderr.write("usage: python -m gorm.migrate DBSTRING\n")
+        return 2
+    migrate(args[0])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Connections for reading the database from threads other than the
+one that writes to it.
+
+"""
+from contextlib import contextmanager
+from threading import local
+try:
+    from queue import Queue
+except ImportError:
+    # python 2
+    from Queue import Queue
+
+
+class Rows(list):
+    """The rows that a query returned, all fetched at once, so that its
+    connection can go back to the pool, but readable like a cursor.
+
+    """
+    _pos = 0
+
+    def fetchone(self):
+        """Return the next row, or None if there are no more."""
+        if self._pos >= len(self):
+            return None
+        self._pos += 1
+        return self[self._pos - 1]
+
+    def fetchmany(self, size=1):
+        """Return up to ``size`` of the rows I haven't returned yet."""
+        r = self[self._pos:self._pos + size]
+        self._pos += len(r)
+        return r
+
+    def fetchall(self):
+        """Return the rows I haven't returned yet."""
+        r = self[self._pos:]
+        self._pos = len(self)
+        return r
+
+
+class ReaderPool(object):
+    """Some number of connections for reading, each used by one thread
+    at a time.
+
+    I don't know what kind of connections they are. Whoever uses me
+    passes in functions to do things with them.
+
+    """
+    def __init__(self, connect, size):
+        """Make ``size`` connections by calling ``connect``."""
+        if size < 1:
+            raise ValueError("ReaderPool needs at least one connection")
+        self.size = size
+        self._idle = Queue()
+        self._local = local()
+        for i in range(size):
+            self._idle.put(connect())
+
+    @contextmanager
+    def reader(self):
+        """Lend out a connection until the block ends, waiting for one
+        if they're all in use.
+
+        If the current thread has a connection pinned with
+        :meth:`pinned`, lend that.
+
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    @contextmanager
+    def pinned(self, begin, end):
+        """Pin a connection to the current thread until the block ends,
+        calling ``begin`` on it first and ``end`` on it after.
+
+        If ``begin`` starts a transaction, every query in the block
+        sees the database as it was at the same commit.
+
+        """
+        if getattr(self._local, 'conn', None) is not None:
+            yield
+            return
+        conn = self._idle.get()
+        try:
+            begin(conn)
+            self._local.conn = conn
+            try:
+                yield
+            finally:
+                self._local.conn = None
+                end(conn)
+        finally:
+            self._idle.put(conn)
+
+    def close(self, close):
+        """Call ``close`` on each connection, waiting for those in use to
+        come back.
+
+        """
+        for i in range(self.size):
+            close(self._idle.get())
@@ -5,9 +5,19 @@ code that's more to do with the queries than with the data per se
 doesn't pollute the other files so much.
 
 """
-from collections import MutableMapping
+from collections import MutableMapping, defaultdict
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right, insort
+from functools import partial
+from itertools import chain
+from threading import current_thread, RLock
 from sqlite3 import IntegrityError as sqliteIntegError
+from sqlite3 import sqlite_version_info
 from .reify import reify
+from .window import Deferred
+from .delta import diff, patch
+from .pool import ReaderPool, Rows
+from .stats import Counted, perf_counter
 try:
     # python 2
     import xjson
@@ -28,6 +38,44 @@ IntegrityError = (
 ) if alchemyIntegError is not None else sqliteIntegError
 
 
+class OldSchemaError(ValueError):
+    """The database was made by a version of gorm that stored names as
+    text. :mod:`gorm.migrate` can convert it.
+
+    """
+
+# the tables of graph data, parents before children
+keyframe_kinds = ('graph_val', 'nodes', 'node_val', 'edges', 'edge_val')
+# queries to insert, update, and upsert records in each of those tables
+write_statements = {
+    'graph_val': ('graph_val_ins', 'graph_val_upd', 'graph_val_upsert'),
+    'nodes': ('exist_node_ins', 'exist_node_upd', 'exist_node_upsert'),
+    'node_val': ('node_val_ins', 'node_val_upd', 'node_val_upsert'),
+    'edges': ('edge_exist_ins', 'edge_exist_upd', 'edge_exist_upsert'),
+    'edge_val': ('edge_val_ins', 'edge_val_upd', 'edge_val_upsert')
+}
+# indices that older versions made, which the primary keys cover
+old_indices = (
+    'graph_val_idx', 'nodes_idx', 'node_val_idx', 'edges_idx', 'edge_val_idx'
+)
+# which columns of each of those tables hold the IDs of names
+name_columns = {
+    'graph_val': (0, 1),
+    'nodes': (0, 1),
+    'node_val': (0, 1, 2),
+    'edges': (0, 1, 2),
+    'edge_val': (0, 1, 2, 4)
+}
+# which hold encoded values
+value_columns = {
+    'graph_val': (4,),
+    'nodes': (),
+    'node_val': (5,),
+    'edges': (),
+    'edge_val': (7,)
+}
+
+
 class GlobalKeyValueStore(MutableMapping):
     """A dict-like object that keeps its contents in a table.
 
@@ -66,8 +114,14 @@ class QueryEngine(object):
 
     """
     json_path = xjpath
-
-    def __init__(self, dbstring, connect_args, alchemy, json_dump=None, json_load=None):
+    # how many rows to fetch at once when streaming a dump
+    fetch_rows = 1000
+
+    def __init__(
+            self, dbstring, connect_args, alchemy,
+            json_dump=None, json_load=None, binary=False,
+            delta_interval=None, readers=None, threadsafe=False
+    ):
         """If ``alchemy`` is True and ``dbstring`` is a legit database URI,
         instantiate an Alchemist and start a transaction with
         it. Otherwise use sqlite3.
@@ -76,6 +130,40 @@ class QueryEngine(object):
         object in place of ``dbstring`` if you wish. I'll still create
         my own transaction though.
 
+        ``json_dump`` and ``json_load`` encode and decode everything
+        but branch names. Graph names, node names, and keys are
+        encoded once each, in the ``names`` table, and referred to by
+        integer ID everywhere else; I keep the IDs in memory. If they
+        work with ``bytes`` rather than text, set ``binary``, and the
+        Alchemist will make BLOB columns. SQLite will store ``bytes``
+        in any column, so the precompiled schema serves either way.
+
+        If ``delta_interval`` is an integer, I'll store a dict, list,
+        or tuple set on a node or edge as a patch against its previous
+        value in the same branch, where that's smaller, but store it
+        whole at least once every ``delta_interval`` revisions it's
+        set, so that reading it never takes more than that many
+        queries. This costs a query or two before each write of a
+        node or edge attribute, which flushes the write buffer. Leave
+        it on for any database that has patches in it, so that if you
+        rewrite a value that a later patch is against, I can store
+        the later value whole.
+
+        If ``readers`` is an integer, I'll open that many more
+        connections, and use them for the read queries that threads
+        other than this one run, each on whichever connection is
+        free. They see the database as of the last commit, not the
+        writes this thread hasn't committed yet, nor its write
+        buffer. SQLite databases get put in WAL mode, so that they
+        can be read while they're written; they can't be in memory.
+
+        If ``threadsafe``, any thread may use me. Queries and writes
+        take turns holding ``self.lock``, and queries return all their
+        rows at once, so that no cursor is left for threads to fight
+        over. A write that makes several queries should hold ``lock``
+        throughout; :class:`gorm.ORM` does. If you pass in your own
+        sqlite3 connection, it must allow other threads to use it.
+
         """
         def alchem_init(dbstring, connect_args):
             from sqlalchemy import create_engine
@@ -84,11 +172,14 @@ class QueryEngine(object):
             if isinstance(dbstring, Engine):
                 self.engine = dbstring
             else:
+                if threadsafe and dbstring.startswith('sqlite'):
+                    connect_args = dict(connect_args)
+                    connect_args['check_same_thread'] = False
                 self.engine = create_engine(
                     dbstring,
                     connect_args=connect_args
                 )
-            self.alchemist = Alchemist(self.engine)
+            self.alchemist = Alchemist(self.engine, binary)
             self.transaction = self.alchemist.conn.begin()
 
         def lite_init(dbstring, connect_args):
@@ -103,7 +194,10 @@ class QueryEngine(object):
                 if dbstring.startswith('sqlite:'):
                     slashidx = dbstring.rindex('/')
                     dbstring = dbstring[slashidx+1:]
-                self.connection = connect(dbstring)
+                self.connection = connect(
+                    dbstring, check_same_thread=not threadsafe,
+                    cached_statements=self._cached_statements()
+                )
 
         if alchemy:
             try:
@@ -113,14 +207,213 @@ class QueryEngine(object):
         else:
             lite_init(dbstring, connect_args)
 
+        self.threadsafe = threadsafe
+        self.lock = RLock()
+        self._cursors = {}
+        self._recorders = []
+        self._readers = None
+        if readers:
+            self._open_readers(dbstring, connect_args, binary, readers)
+
+        if hasattr(self, 'alchemist'):
+            self.upsert = self.alchemist.supports_upsert
+        else:
+            # ON CONFLICT DO UPDATE is new in SQLite 3.24
+            self.upsert = sqlite_version_info >= (3, 24)
+
         self._branches = {}
+        self._keyframe_pending = {}
+        self._write_buffer = None
+        self._write_buffer_size = 0
+        self._write_buffer_limit = None
+        self._name_ids = None
+        self._names = None
+        self._next_name_id = 0
         self.json_dump = json_dump if json_dump else xjson.json_dump
         self.json_load = json_load if json_load else xjson.json_load
+        self.delta_interval = delta_interval
+        self._patch_marker = b'@' if binary else '@'
+
+    def _open_readers(self, dbstring, connect_args, binary, size):
+        """Open ``size`` connections for other threads to read with, and
+        remember that this thread is the one that writes.
+
+        """
+        self._writer = current_thread()
+        if hasattr(self, 'alchemist'):
+            from sqlalchemy import create_engine
+            from gorm.alchemy import Alchemist
+            conn = self.alchemist.conn
+            sqlite = self.engine.dialect.name == 'sqlite'
+            engine = self.engine
+            if sqlite and not hasattr(dbstring, 'connect'):
+                # sqlite3 connections refuse to be used by other threads
+                # than the one that made them, unless told otherwise
+                args = dict(connect_args)
+                args['check_same_thread'] = False
+                engine = create_engine(dbstring, connect_args=args)
+            strings = dict(
+                (k, str(v)) for (k, v) in self.alchemist.sql.items()
+            )
+
+            def connect():
+                return Alchemist(engine, binary)
+
+            def begin(alchemist):
+                alchemist.transaction = alchemist.conn.begin()
+                if sqlite:
+                    # pysqlite doesn't begin transactions for SELECT
+                    alchemist.conn.execute('BEGIN')
+
+            def end(alchemist):
+                alchemist.transaction.rollback()
+
+            def close(alchemist):
+                alchemist.conn.close()
+        else:
+            from sqlite3 import connect as lite_connect
+            conn = self.connection
+            sqlite = True
+            strings = self.strings
+            path = None
+
+            def connect():
+                return lite_connect(
+                    path, check_same_thread=False, isolation_level=None,
+                    cached_statements=self._cached_statements()
+                )
+
+            def begin(connection):
+                connection.execute('BEGIN')
+
+            def end(connection):
+                connection.execute('ROLLBACK')
+
+            def close(connection):
+                connection.close()
+        if sqlite:
+            path = conn.execute('PRAGMA database_list').fetchone()[2]
+            if not path:
+                raise ValueError(
+                    "Other connections can't read a database in memory"
+                )
+            conn.execute('PRAGMA journal_mode=WAL')
+        self._read_queries = frozenset(
+            k for (k, s) in strings.items()
+            if s.lstrip().upper().startswith(('SELECT', 'WITH'))
+        )
+        self._reader_begin = begin
+        self._reader_end = end
+        self._reader_close = close
+        self._readers = ReaderPool(connect, size)
+
+    def _cached_statements(self):
+        """Return how many prepared statements a sqlite3 connection should
+        keep, so that none of my queries get pushed out by the others.
+
+        """
+        # 128 is the default
+        return max(128, len(self.strings))
+
+    def _read(self, stringname, args, kwargs):
+        """Run the read query thus named on a connection from the pool,
+        and return all its rows.
+
+        """
+        with self._readers.reader() as conn:
+            if hasattr(self, 'alchemist'):
+                return Rows(
+                    getattr(conn, stringname)(*args, **kwargs).fetchall()
+                )
+            s = self.strings[stringname]
+            return Rows(
+                conn.execute(s.format(**kwargs) if kwargs else s, args)
+            )
+
+    def consistent_reads(self):
+        """Return a context manager, in which the read queries that this
+        thread runs all see the database as of the same commit.
+
+        This is for threads that read with the connections I opened
+        for ``readers``. The thread that writes sees its own writes
+        anyway.
+
+        """
+        if self._readers is None:
+            raise ValueError("I have no connections for readers")
+        return self._readers.pinned(self._reader_begin, self._reader_end)
 
     @reify
     def globl(self):
         return GlobalKeyValueStore(self)
 
+    def _load_names(self):
+        """Read every name and its ID from the ``names`` table"""
+        with self.lock:
+            if self._name_ids is None:
+                self._names = {}
+                self._name_ids = {}
+            for (i, name) in self.sql('names_dump'):
+                if i in self._names:
+                    continue
+                self._names[i] = self.json_load(name)
+                self._name_ids[name] = i
+                if i >= self._next_name_id:
+                    self._next_name_id = i + 1
+
+    def _name_id(self, name):
+        """Return the integer ID of ``name``, or ``None`` if it hasn't got
+        one, which matches nothing in a query.
+
+        """
+        if self._name_ids is None:
+            self._load_names()
+        return self._name_ids.get(self.json_dump(name))
+
+    def _intern_name(self, name):
+        """Return the integer ID of ``name``, giving it one if need be."""
+        if self._name_ids is None:
+            self._load_names()
+        s = self.json_dump(name)
+        try:
+            return self._name_ids[s]
+        except KeyError:
+            pass
+        with self.lock:
+            if s in self._name_ids:
+                return self._name_ids[s]
+            i = self._next_name_id
+            self._next_name_id += 1
+            # name first, so whoever finds the ID finds the name
+            self._names[i] = name
+            self._name_ids[s] = i
+            if self._write_buffer is None:
+                self.sql('name_ins', i, s)
+            else:
+                self._write_buffer.setdefault('names', {})[i] = s
+                self._write_buffer_size += 1
+            return i
+
+    def _name(self, i):
+        """Return the name whose ID is ``i``."""
+        try:
+            return self._names[i]
+        except KeyError:
+            # someone else may have made it
+            self._load_names()
+            return self._names[i]
+
+    @reify
+    def _keyframes(self):
+        """Sorted lists of the revisions at which each graph has keyframes,
+        keyed by graph, then branch.
+
+        """
+        r = defaultdict(lambda: defaultdict(list))
+        for (graph, branch, rev) in self.sql('keyframes_dump'):
+            insort(r[graph][branch], rev)
+        return r
+
     def sql(self, stringname, *args, **kwargs):
         """Wrapper for the various prewritten or compiled SQL calls.
 
@@ -129,7 +422,32 @@ class QueryEngine(object):
         ``gorm.alchemy.Alchemist``. The rest of the arguments are
         parameters to the query.
 
+        If any writes are waiting in the write buffer, I flush them
+        first. But if I have connections for readers, and this is a
+        read query, and another thread than the writer is running it,
+        I run it on one of those, and return all its rows in a list.
+        If I'm ``threadsafe``, I return the rows in a list anyway.
+
         """
+        if self._readers is not None and \
+                stringname in self._read_queries and \
+                current_thread() is not self._writer:
+            return self._read(stringname, args, kwargs)
+        if not self.threadsafe:
+            return self._execute(stringname, args, kwargs)
+        with self.lock:
+            r = self._execute(stringname, args, kwargs)
+            if hasattr(r, 'returns_rows') and not r.returns_rows:
+                return r
+            return Rows(r.fetchall())
+
+    def _execute(self, stringname, args, kwargs):
+        """Flush the write buffer, then run the query thus named, and
+        return the cursor.
+
+        """
+        if self._write_buffer_size:
+            self.flush()
         if hasattr(self, 'alchemist'):
             return getattr(self.alchemist, stringname)(*args, **kwargs)
         else:
@@ -138,6 +456,271 @@ class QueryEngine(object):
                 s.format(**kwargs) if kwargs else s, args
             )
 
+    def sqlone(self, stringname, *args):
+        """Run the query thus named and return its first row, or ``None``
+        if it has none.
+
+        This is for lookups that want only the one row. On sqlite3,
+        I keep a cursor for each of the queries run this way, rather
+        than making a new one every time.
+
+        """
+        if self._readers is not None and \
+                stringname in self._read_queries and \
+                current_thread() is not self._writer:
+            return self._read(stringname, args, {}).fetchone()
+        if not self.threadsafe:
+            return self._fetchone(stringname, args)
+        with self.lock:
+            return self._fetchone(stringname, args)
+
+    def _fetchone(self, stringname, args):
+        if self._write_buffer_size:
+            self.flush()
+        if hasattr(self, 'alchemist'):
+            return getattr(self.alchemist, stringname)(*args).fetchone()
+        try:
+            cursor = self._cursors[stringname]
+        except KeyError:
+            cursor = self._cursors[stringname] = self.connection.cursor()
+        return cursor.execute(self.strings[stringname], args).fetchone()
+
+    def sqlstream(self, stringname, *args):
+        """Run the query thus named and return an iterator over its rows,
+        fetched ``fetch_rows`` at a time, so that they needn't all be
+        in memory at once.
+
+        If I'm ``threadsafe``, I hold ``lock`` while fetching each
+        batch, but not in between, so rows that other threads write
+        meanwhile may or may not turn up. On connections for readers,
+        I fetch all the rows at once, like :meth:`sql`.
+
+        """
+        if self._readers is not None and \
+                stringname in self._read_queries and \
+                current_thread() is not self._writer:
+            rows = self._read(stringname, args, {})
+        elif not self.threadsafe:
+            rows = self._execute(stringname, args, {})
+        else:
+            with self.lock:
+                rows = self._execute(stringname, args, {})
+
+            def fetch():
+                with self.lock:
+                    return rows.fetchmany(self.fetch_rows)
+            return chain.from_iterable(iter(fetch, []))
+        return chain.from_iterable(
+            iter(partial(rows.fetchmany, self.fetch_rows), [])
+        )
+
+    def sqlmany(self, stringname, args):
+        """Run the query thus named once for each tuple of parameters in
+        ``args``.
+
+        With the Alchemist, this calls the method whose name is
+        ``stringname`` followed by ``_many``.
+
+        """
+        args = list(args)
+        if not args:
+            return
+        with self.lock:
+            return self._executemany(stringname, args)
+
+    def _executemany(self, stringname, args):
+        if self._write_buffer_size:
+            self.flush()
+        if hasattr(self, 'alchemist'):
+            return getattr(self.alchemist, stringname + '_many')(args)
+        return self.connection.cursor().executemany(
+            self.strings[stringname], args
+        )
+
+    def record_stats(self, stats):
+        """Start counting the queries I run in ``stats``, a
+        :class:`gorm.stats.QueryStats`, whichever thread runs them.
+
+        While nothing's counting, the methods that run queries don't
+        look at the clock at all.
+
+        """
+        if stats not in self._recorders:
+            self._recorders.append(stats)
+        self._instrument()
+
+    def stop_recording(self, stats):
+        """Stop counting queries in ``stats``."""
+        if stats in self._recorders:
+            self._recorders.remove(stats)
+        self._instrument()
+
+    def _instrument(self):
+        """Put timed versions of the methods that run queries in front
+        of mine, if anything's counting, or take them away if not.
+
+        """
+        for method in ('_execute', '_executemany', '_fetchone', '_read'):
+            self.__dict__.pop(method, None)
+        if not self._recorders:
+            return
+        recorders = self._recorders
+        (execute, executemany, fetchone, read) = (
+            self._execute, self._executemany, self._fetchone, self._read
+        )
+
+        def record(stringname, start, rows=0):
+            seconds = perf_counter() - start
+            for stats in recorders:
+                stats.record(stringname, seconds, rows)
+
+        # flush before starting the clock, so that the writes get
+        # counted as themselves, not as part of the query
+
+        def timed_execute(stringname, args, kwargs):
+            if self._write_buffer_size:
+                self.flush()
+            start = perf_counter()
+            r = execute(stringname, args, kwargs)
+            record(stringname, start)
+            return Counted(r, stringname, recorders)
+
+        def timed_executemany(stringname, args):
+            if self._write_buffer_size:
+                self.flush()
+            start = perf_counter()
+            r = executemany(stringname, args)
+            record(stringname, start)
+            return r
+
+        def timed_fetchone(stringname, args):
+            if self._write_buffer_size:
+                self.flush()
+            start = perf_counter()
+            r = fetchone(stringname, args)
+            record(stringname, start, 0 if r is None else 1)
+            return r
+
+        def timed_read(stringname, args, kwargs):
+            start = perf_counter()
+            r = read(stringname, args, kwargs)
+            record(stringname, start, len(r))
+            return r
+        self._execute = timed_execute
+        self._executemany = timed_executemany
+        self._fetchone = timed_fetchone
+        self._read = timed_read
+
+    def buffer_writes(self, limit=10000):
+        """Start keeping writes in memory, to be run together with
+        ``executemany`` later.
+
+        The buffer is flushed when it holds ``limit`` records, and
+        before any other query is run, which includes setting the
+        branch or revision, and committing. Writing the same record
+        twice before a flush only keeps the latter.
+
+        """
+        self._write_buffer_limit = limit
+        if self._write_buffer is None:
+            self._write_buffer = {}
+
+    def unbuffer_writes(self):
+        """Flush the write buffer and go back to writing immediately."""
+        self.flush()
+        self._write_buffer = None
+
+    def flush(self):
+        """Write everything in the write buffer to the database.
+
+        I upsert all the records of a table at once. If the database
+        can't do that, I try to insert them all at once, and if some
+        were there already, I go back over them one at a time.
+
+        """
+        with self.lock:
+            if not self._write_buffer_size:
+                return
+            buf = self._write_buffer
+            self._write_buffer = {}
+            self._write_buffer_size = 0
+            self._flush(buf)
+
+    def _flush(self, buf):
+        """Write the records in ``buf``, which was the write buffer."""
+        if 'names' in buf:
+            self.sqlmany('name_ins', buf['names'].items())
+        for table in keyframe_kinds:
+            if table not in buf:
+                continue
+            (ins, upd, upsert) = write_statements[table]
+            rows = [key + (value,) for (key, value) in buf[table].items()]
+            if self.upsert:
+                self.sqlmany(upsert, rows)
+                continue
+            try:
+                self.sqlmany(ins, rows)
+            except IntegrityError:
+                for row in rows:
+                    try:
+                        self.sql(ins, *row)
+                    except IntegrityError:
+                        self.sql(upd, row[-1], *row[:-1])
+
+    def bulk_insert(self, table, rows, batch=10000):
+        """Insert new records into one of the tables of graph data, with
+        ``executemany``, ``batch`` at a time.
+
+        ``rows`` is an iterable of tuples of the table's columns, in
+        the order its ``_ins`` query takes them, not yet encoded.
+        None of them may be in the table already.
+
+        """
+        ins = write_statements[table][0]
+        names = name_columns[table]
+        values = value_columns[table]
+        intern = self._intern_name
+        dump = self.json_dump
+        changed = set()
+        todo = []
+        for row in rows:
+            row = list(row)
+            for i in names:
+                row[i] = intern(row[i])
+            for i in values:
+                row[i] = dump(row[i])
+            changed.add((row[0], row[-3], row[-2]))
+            todo.append(tuple(row))
+            if len(todo) >= batch:
+                self.sqlmany(ins, todo)
+                todo = []
+        self.sqlmany(ins, todo)
+        for (graph, branch, rev) in changed:
+            self._changed(graph, branch, rev)
+
+    def _write(self, table, key, value):
+        """Insert or update the record with this primary key so it has
+        ``value``, or put it in the write buffer if I have one.
+
+        """
+        with self.lock:
+            if self._write_buffer is None:
+                (ins, upd, upsert) = write_statements[table]
+                if self.upsert:
+                    self.sql(upsert, *(key + (value,)))
+                    return
+                try:
+                    self.sql(ins, *(key + (value,)))
+                except IntegrityError:
+                    self.sql(upd, value, *key)
+                return
+            buf = self._write_buffer.setdefault(table, {})
+            if key not in buf:
+                self._write_buffer_size += 1
+            buf[key] = value
+            if self._write_buffer_size >= self._write_buffer_limit:
+                self.flush()
+
     def timestream_data(self):
         for row in self.sql('allbranch'):
             yield tuple(row)
@@ -157,38 +740,42 @@ class QueryEngine(object):
         yield (branch, rev)
         while branch != 'master':
             if branch not in self._branches:
-                (b, r) = self.parparrev(branch)
-                self._branches[branch] = (b, self.json_load(r))
+                self._branches[branch] = tuple(self.parparrev(branch))
             (branch, rev) = self._branches[branch]
             yield (branch, rev)
 
     def have_graph(self, graph):
         """Return whether I have a graph by this name."""
-        graph = self.json_dump(graph)
-        return bool(self.sql('ctgraph', graph).fetchone()[0])
+        graph = self._name_id(graph)
+        return bool(self.sqlone('ctgraph', graph)[0])
 
     def new_graph(self, graph, typ):
         """Declare a new graph by this name of this type."""
-        graph = self.json_dump(graph)
+        graph = self._intern_name(graph)
         return self.sql('new_graph', graph, typ)
 
     def del_graph(self, graph):
         """Delete all records to do with the graph"""
-        g = self.json_dump(graph)
+        g = self._name_id(graph)
+        for (branch, revs) in list(self._keyframes.get(g, {}).items()):
+            for rev in list(revs):
+                self._del_keyframe(g, branch, rev)
+        self._keyframes.pop(g, None)
         self.sql('del_edge_val_graph', g)
         self.sql('del_edge_graph', g)
         self.sql('del_node_val_graph', g)
-        self.sql('del_edge_val_graph', g)
+        self.sql('del_node_graph', g)
+        self.sql('del_graph_val_graph', g)
         self.sql('del_graph', g)
 
     def graph_type(self, graph):
         """What type of graph is this?"""
-        graph = self.json_dump(graph)
-        return self.sql('graph_type', graph).fetchone()[0]
+        graph = self._name_id(graph)
+        return self.sqlone('graph_type', graph)[0]
 
     def have_branch(self, branch):
         """Return whether the branch thus named exists in the database."""
-        return bool(self.sql('ctbranch', branch).fetchone()[0])
+        return bool(self.sqlone('ctbranch', branch)[0])
 
     def all_branches(self):
         """Return all the branch data in tuples of (branch, parent,
@@ -200,7 +787,7 @@ class QueryEngine(object):
     def global_get(self, key):
         """Return the value for the given key in the ``globals`` table."""
         key = self.json_dump(key)
-        r = self.sql('global_get', key).fetchone()
+        r = self.sqlone('global_get', key)
         if r is None:
             raise KeyError("Not set")
         return self.json_load(r[0])
@@ -216,6 +803,8 @@ class QueryEngine(object):
 
         """
         (key, value) = map(self.json_dump, (key, value))
+        if self.upsert:
+            return self.sql('global_upsert', key, value)
         try:
             return self.sql('global_ins', key, value)
         except IntegrityError:
@@ -228,11 +817,11 @@ class QueryEngine(object):
 
     def parrev(self, branch):
         """Return the parent of the branch."""
-        return self.sql('parrev', branch).fetchone()[0]
+        return self.sqlone('parrev', branch)[0]
 
     def parparrev(self, branch):
         """Return the parent and start revision of the branch."""
-        return self.sql('parparrev', branch)
+        return self.sqlone('parparrev', branch)
 
     def new_branch(self, branch, parent, parent_rev):
         """Declare that the ``branch`` is descended from ``parent`` at
@@ -241,15 +830,302 @@ class QueryEngine(object):
         """
         return self.sql('new_branch', branch, parent, parent_rev)
 
-    def graph_val_dump(self):
-        """Yield the entire contents of the graph_val table."""
-        for (graph, key, branch, rev, value) in self.sql('graph_val_dump'):
+    def _keyframe_before(self, graph, branch, rev):
+        """Return the revision of the latest keyframe of ``graph`` in
+        ``branch`` no later than ``rev``, or ``None`` if there isn't
+        one.
+
+        ``graph`` is the ID of its name.
+
+        """
+        revs = self._keyframes.get(graph, {}).get(branch)
+        if not revs:
+            return None
+        i = bisect_right(revs, rev)
+        if i == 0:
+            return None
+        return revs[i - 1]
+
+    def _resolve(self, kind, graph, branch, rev, *node):
+        """Return a dictionary describing one kind of data about ``graph``
+        as of ``(branch, rev)``.
+
+        ``kind`` is the name of a table: graph_val, nodes, node_val,
+        edges, or edge_val. Keys are tuples of the key columns of the
+        table, names as their IDs; values are encoded values, or ``True``
+        for the nodes and edges that exist. If you pass a ``node``, or
+        the ``nodeA, nodeB, idx`` of an edge, only its attributes get
+        looked up.
+
+        I start from the nearest keyframe and apply only those changes
+        made since, so the cost depends on how much has changed lately
+        rather than how long the history is.
+
+        """
+        suffix = '_' + kind.split('_')[0] if node else ''
+        valued = kind.endswith('_val')
+        lineage = []
+        for (b, r) in self.active_branches(branch, rev):
+            since = self._keyframe_before(graph, b, r)
+            lineage.append((b, since, r))
+            if since is not None:
+                break
+        r = {}
+        (b, since, rev) = lineage[-1]
+        if since is not None:
+            for row in self.sql(
+                    kind + '_keyframe' + suffix, graph, b, since, *node
+            ):
+                if valued:
+                    r[tuple(row[:-1])] = row[-1]
+                else:
+                    r[tuple(row)] = True
+        for (b, since, rev) in reversed(lineage):
+            for row in self.sql(
+                    kind + '_delta' + suffix,
+                    graph,
+                    b,
+                    -1 if since is None else since,
+                    rev,
+                    *node
+            ):
+                (k, v) = (tuple(row[:-1]), row[-1])
+                if v is None or not (valued or v):
+                    r.pop(k, None)
+                else:
+                    r[k] = v if valued else True
+        return r
+
+    def graph_state(self, graph, branch, rev):
+        """Return all the nodes and edges of ``graph`` as of ``(branch,
+        rev)``, and their attributes, in a tuple.
+
+        The tuple holds: a list of the nodes that exist, in the order
+        they were first named; a dictionary of node attribute values
+        keyed by ``(node, key)``; a list of the ``(nodeA, nodeB, idx)``
+        of the edges that exist; and a dictionary of edge attribute
+        values keyed by ``(nodeA, nodeB, idx, key)``.
+
+        This takes one query per table for each branch back to the
+        nearest keyframe, and one more for the keyframe, rather than
+        one per node or edge.
+
+        """
+        g = self._name_id(graph)
+        name = self._name
+        load_node_val = self._loader('node_val', False)
+        load_edge_val = self._loader('edge_val', False)
+        nodes = [
+            name(n) for (n,) in sorted(self._resolve('nodes', g, branch, rev))
+        ]
+        node_val = dict(
+            ((name(n), name(k)), load_node_val((g, n, k), v))
+            for ((n, k), v) in
+            self._resolve('node_val', g, branch, rev).items()
+        )
+        edges = [
+            (name(a), name(b), idx) for (a, b, idx) in
+            sorted(self._resolve('edges', g, branch, rev))
+        ]
+        edge_val = dict(
+            (
+                (name(a), name(b), idx, name(k)),
+                load_edge_val((g, a, b, idx, k), v)
+            ) for ((a, b, idx, k), v) in
+            self._resolve('edge_val', g, branch, rev).items()
+        )
+        return (nodes, node_val, edges, edge_val)
+
+    def keyframe(self, graph, branch, rev):
+        """Store the whole state of ``graph`` as of ``(branch, rev)`` in the
+        keyframe tables, replacing any keyframe already there.
+
+        """
+        self._keyframe(self._intern_name(graph), branch, rev)
+
+    def _keyframe(self, graph, branch, rev):
+        if rev in self._keyframes.get(graph, {}).get(branch, ()):
+            self._del_keyframe(graph, branch, rev)
+        states = dict(
+            (kind, self._resolve(kind, graph, branch, rev))
+            for kind in keyframe_kinds
+        )
+        self.sql('keyframe_ins', graph, branch, rev)
+        for kind in keyframe_kinds:
+            if kind.endswith('_val'):
+                rows = (
+                    (graph, branch, rev) + k + (v,)
+                    for (k, v) in states[kind].items()
+                )
+            else:
+                rows = ((graph, branch, rev) + k for k in states[kind])
+            self.sqlmany(kind + '_keyframe_ins', rows)
+        insort(self._keyframes[graph][branch], rev)
+        self._keyframe_pending.pop((graph, branch), None)
+
+    def _del_keyframe(self, graph, branch, rev):
+        for kind in keyframe_kinds:
+            self.sql('del_' + kind + '_keyframe', graph, branch, rev)
+        self.sql('del_keyframe', graph, branch, rev)
+        self._keyframes[graph][branch].remove(rev)
+
+    def keyframe_due(self, branch, rev, interval):
+        """Make keyframes at ``(branch, rev)`` of those graphs that were
+        changed in ``branch`` at least ``interval`` revisions ago, and
+        haven't had a keyframe since.
+
+        """
+        for (graph, b) in list(self._keyframe_pending.keys()):
+            if b == branch and (
+                    rev - self._keyframe_pending[(graph, b)] >= interval
+            ):
+                self._keyframe(graph, branch, rev)
+
+    def _changed(self, graph, branch, rev):
+        """Note that ``graph`` changed at ``(branch, rev)``, and delete any
+        keyframes that this makes obsolete.
+
+        ``graph`` is the ID of its name. This assumes that revisions in
+        the parents of ``branch`` won't change any more, the same way
+        that making a branch does.
+
+        """
+        revs = self._keyframes.get(graph, {}).get(branch)
+        if revs and revs[-1] >= rev:
+            for r in revs[bisect_left(revs, rev):]:
+                self._del_keyframe(graph, branch, r)
+        pending = self._keyframe_pending.get((graph, branch))
+        if pending is None or rev < pending:
+            self._keyframe_pending[(graph, branch)] = rev
+
+    def _dump(self, stringname, graph=None):
+        """Stream the dump query thus named, for only the one ``graph`` if
+        provided.
+
+        """
+        if graph is None:
+            return self.sqlstream(stringname)
+        return self.sqlstream(stringname + '_graph', self._name_id(graph))
+
+    def _defer(self, value):
+        """Wrap an encoded value to be decoded when it's first read from a
+        cache.
+
+        """
+        return Deferred(value, self.json_load)
+
+    def _is_patch(self, raw):
+        """Return whether an encoded value from node_val or edge_val is a
+        patch, rather than the whole value.
+
+        """
+        return raw is not None and raw[:1] == self._patch_marker
+
+    def _load_val(self, table, key_ids, raw):
+        """Decode a value from ``table``, node_val or edge_val, for the key
+        whose name IDs are ``key_ids``, applying it to the value it
+        patches if it's a patch.
+
+        """
+        if not self._is_patch(raw):
+            return self.json_load(raw)
+        (branch, rev, depth, delta) = self.json_load(raw[1:])
+        (base,) = self.sqlone(
+            table + '_at', *(key_ids + (branch, rev))
+        )
+        return patch(self._load_val(table, key_ids, base), delta)
+
+    def _loader(self, table, defer):
+        """Return a function of name IDs and an encoded value from
+        ``table`` that decodes the value, or defers decoding it.
+
+        """
+        marker = self._patch_marker
+        json_load = self.json_load
+
+        def load(key_ids, raw):
+            if raw is not None and raw[:1] == marker:
+                if defer:
+                    return Deferred(
+                        raw, partial(self._load_val, table, key_ids)
+                    )
+                return self._load_val(table, key_ids, raw)
+            if defer:
+                return Deferred(raw, json_load)
+            return json_load(raw)
+        return load
+
+    def _dump_val(self, table, key_ids, branch, rev, value):
+        """Encode a value to be set in ``table``, node_val or edge_val, for
+        the key whose name IDs are ``key_ids``, at ``(branch, rev)``.
+
+        If I'm storing patches, and this is a container, and the key
+        had a value at the previous revision of the same branch, and
+        it's not been patched too many times since it was stored
+        whole, and a patch against it is smaller than the new value,
+        return that patch.
+
+        """
+        whole = self.json_dump(value)
+        if self.delta_interval is None or \
+                type(value) not in (dict, list, tuple):
+            return whole
+        row = self.sqlone(
+            table + '_get', branch, rev - 1, *key_ids
+        )
+        if row is None or row[0] is None or row[1] != branch:
+            return whole
+        depth = 1
+        if self._is_patch(row[0]):
+            depth += self.json_load(row[0][1:])[2]
+        if depth >= self.delta_interval:
+            return whole
+        delta = diff(
+            self._load_val(table, key_ids, row[0]), self.json_load(whole)
+        )
+        r = self._patch_marker + self.json_dump(
+            (branch, row[2], depth, delta)
+        )
+        return r if len(r) < len(whole) else whole
+
+    def _unpatch_later(self, table, key_ids, branch, rev):
+        """Store whole any values set for this key in ``branch`` after
+        ``rev`` that are patches against the value at ``rev``, which is
+        about to change.
+
+        """
+        if self.delta_interval is None:
+            return
+        for (later, raw) in list(self.sql(
+                table + '_later', *(key_ids + (branch, rev))
+        )):
+            if not self._is_patch(raw) or \
+                    tuple(self.json_load(raw[1:])[:2]) != (branch, rev):
+                continue
+            value = self._load_val(table, key_ids, raw)
+            self._write(
+                table, key_ids + (branch, later), self.json_dump(value)
+            )
+
+    def graph_val_dump(self, graph=None, defer=False):
+        """Yield the entire contents of the graph_val table, or just the part
+        of it about ``graph``.
+
+        With ``defer``, leave the values encoded, in :class:`Deferred`
+        wrappers.
+
+        """
+        load = self._defer if defer else self.json_load
+        name = self._name
+        for (graph, key, branch, rev, value) in self._dump(
+                'graph_val_dump', graph
+        ):
             yield (
-                self.json_load(graph),
-                self.json_load(key),
+                name(graph),
+                name(key),
                 branch,
                 rev,
-                self.json_load(value)
+                load(value)
             )
 
     def graph_val_keys(self, graph, branch, rev):
@@ -257,83 +1133,55 @@ class QueryEngine(object):
         revision.
 
         """
-        graph = self.json_dump(graph)
-        seen = set()
-        for (b, r) in self.active_branches(branch, rev):
-            data = self.sql(
-                'graph_val_items', graph, b, r
-            )
-            for (k, v) in data:
-                if k not in seen:
-                    yield self.json_load(k)
-                seen.add(k)
+        graph = self._name_id(graph)
+        for (k,) in self._resolve('graph_val', graph, branch, rev):
+            yield self._name(k)
 
     def graph_val_get(self, graph, key, branch, rev):
         """Return the value of a key that a graph has, as of the given
         revision.
 
         """
-        (graph, key) = map(self.json_dump, (graph, key))
-        for (b, r) in self.active_branches(branch, rev):
-            for row in self.sql(
-                'graph_val_get',
-                graph,
-                key,
-                branch,
-                rev
-            ):
-                if row is None:
-                    raise KeyError("Key not set")
-                return self.json_load(row[0])
-        raise KeyError("Key never set")
+        (graph, key) = map(self._name_id, (graph, key))
+        row = self.sqlone(
+            'graph_val_get', branch, rev, graph, key
+        )
+        if row is None:
+            raise KeyError("Key never set")
+        if row[0] is None:
+            raise KeyError("Key not set")
+        return self.json_load(row[0])
 
     def graph_val_set(self, graph, key, branch, rev, value):
         """Set a key to a value on a graph at a particular revision."""
-        (graph, key, value) = map(self.json_dump, (graph, key, value))
-        try:
-            self.sql('graph_val_ins', graph, key, branch, rev, value)
-        except IntegrityError:
-            self.sql('graph_val_upd', value, graph, key, branch, rev)
+        (graph, key) = map(self._intern_name, (graph, key))
+        value = self.json_dump(value)
+        self._changed(graph, branch, rev)
+        self._write('graph_val', (graph, key, branch, rev), value)
 
     def graph_val_del(self, graph, key, branch, rev):
         """Indicate that the key is unset."""
-        (graph, key) = map(self.json_dump, (graph, key))
-        try:
-            self.sql('graph_val_ins', graph, key, branch, rev, None)
-        except IntegrityError:
-            self.sql('graph_val_upd', None, graph, key, branch, rev)
+        (graph, key) = map(self._intern_name, (graph, key))
+        self._changed(graph, branch, rev)
+        self._write('graph_val', (graph, key, branch, rev), None)
 
     def nodes_extant(self, graph, branch, rev):
         """Return an iterable of nodes that exist in this graph at this
         revision.
 
         """
-        graph = self.json_dump(graph)
-        seen = set()
-        for (b, r) in self.active_branches(branch, rev):
-            data = self.sql(
-                'nodes_extant',
-                graph,
-                branch,
-                rev
-            )
-            for (n,) in data:
-                if n is not None and n not in seen:
-                    yield self.json_load(n)
-                seen.add(n)
+        graph = self._name_id(graph)
+        for (n,) in self._resolve('nodes', graph, branch, rev):
+            yield self._name(n)
 
     def node_exists(self, graph, node, branch, rev):
         """Return whether there's a node by this name in this graph at this
         revision.
 
         """
-        (graph, node) = map(self.json_dump, (graph, node))
-        for (b, r) in self.active_branches(branch, rev):
-            for x in self.sql(
-                'node_exists', graph, node, b, r
-            ):
-                return bool(x[0])
-        return False
+        (graph, node) = map(self._name_id, (graph, node))
+        row = self.sqlone('node_exists', branch, rev, graph, node)
+        return row is not None and bool(row[0])
 
     def exist_node(self, graph, node, branch, rev, extant):
         """Declare that the node exists or doesn't.
@@ -341,33 +1189,47 @@ class QueryEngine(object):
         Inserts a new record or updates an old one, as needed.
 
         """
-        (graph, node) = map(self.json_dump, (graph, node))
-        try:
-            self.sql('exist_node_ins', graph, node, branch, rev, extant)
-        except IntegrityError:
-            self.sql('exist_node_upd', extant, graph, node, branch, rev)
+        (graph, node) = map(self._intern_name, (graph, node))
+        self._changed(graph, branch, rev)
+        self._write('nodes', (graph, node, branch, rev), extant)
 
-    def nodes_dump(self):
-        """Dump the entire contents of the nodes table."""
-        for (graph, node, branch, tick, extant) in self.sql('nodes_dump'):
+    def nodes_dump(self, graph=None):
+        """Dump the entire contents of the nodes table, or just the part of
+        it about ``graph``.
+
+        """
+        name = self._name
+        for (graph, node, branch, tick, extant) in self._dump(
+                'nodes_dump', graph
+        ):
             yield (
-                self.json_load(graph),
-                self.json_load(node),
+                name(graph),
+                name(node),
                 branch,
                 tick,
                 bool(extant)
             )
 
-    def node_val_dump(self):
-        """Yield the entire contents of the node_val table."""
-        for (graph, node, key, branch, rev, value) in self.sql('node_val_dump'):
+    def node_val_dump(self, graph=None, defer=False):
+        """Yield the entire contents of the node_val table, or just the part
+        of it about ``graph``.
+
+        With ``defer``, leave the values encoded, in :class:`Deferred`
+        wrappers.
+
+        """
+        load = self._loader('node_val', defer)
+        name = self._name
+        for (graph, node, key, branch, rev, value) in self._dump(
+                'node_val_dump', graph
+        ):
             yield (
-                self.json_load(graph),
-                self.json_load(node),
-                self.json_load(key),
+                name(graph),
+                name(node),
+                name(key),
                 branch,
                 rev,
-                self.json_load(value)
+                load((graph, node, key), value)
             )
 
     def node_val_keys(self, graph, node, branch, rev):
@@ -375,79 +1237,52 @@ class QueryEngine(object):
         revision.
 
         """
-        (graph, node) = map(self.json_dump, (graph, node))
-        seen = set()
-        for (b, r) in self.active_branches(branch, rev):
-            for (k, v) in self.sql(
-                    'node_val_items',
-                    graph,
-                    node,
-                    branch,
-                    rev
-            ):
-                if k not in seen and v is not None:
-                    yield self.json_load(k)
-                seen.add(k)
-
-    def node_vals_ever(self, graph, node):
-        """Iterate over all values set on a node through time."""
-        (graph, node) = map(self.json_dump, (graph, node))
-        for (key, branch, tick, value) in self.sql(
-                'node_vals_ever', graph, node
-        ):
-            yield (self.json_load(key), branch, tick, self.json_load(value))
+        (graph, node) = map(self._name_id, (graph, node))
+        for (k,) in self._resolve('node_val', graph, branch, rev, node):
+            yield self._name(k)
 
     def node_val_get(self, graph, node, key, branch, rev):
         """Get the value of the node's key as it was at the given revision."""
-        (graph, node, key) = map(self.json_dump, (graph, node, key))
-        for (b, r) in self.active_branches(branch, rev):
-            for row in self.sql(
-                'node_val_get',
-                graph,
-                node,
-                key,
-                branch,
-                rev
-            ):
-                if row[0] is None:
-                    raise KeyError("Key not set")
-                return self.json_load(row[0])
-        raise KeyError("Key {} never set".format(key))
+        (graph, node, key) = map(self._name_id, (graph, node, key))
+        row = self.sqlone(
+            'node_val_get', branch, rev, graph, node, key
+        )
+        if row is None:
+            raise KeyError("Key {} never set".format(key))
+        if row[0] is None:
+            raise KeyError("Key not set")
+        return self._load_val('node_val', (graph, node, key), row[0])
 
     def node_val_set(self, graph, node, key, branch, rev, value):
         """Set the value of a key on a node at a particular revision."""
-        (graph, node, key, value) = map(
-            self.json_dump,
-            (graph, node, key, value)
+        (graph, node, key) = map(self._intern_name, (graph, node, key))
+        self._unpatch_later('node_val', (graph, node, key), branch, rev)
+        value = self._dump_val(
+            'node_val', (graph, node, key), branch, rev, value
         )
-        try:
-            return self.sql(
-                'node_val_ins', graph, node, key, branch, rev, value
-            )
-        except IntegrityError:
-            return self.sql(
-                'node_val_upd', value, graph, node, key, branch, rev
-            )
+        self._changed(graph, branch, rev)
+        self._write('node_val', (graph, node, key, branch, rev), value)
 
     def node_val_del(self, graph, node, key, branch, rev):
         """Indicate that the key has no value for the node at the revision."""
-        (graph, node, key) = map(self.json_dump, (graph, node, key))
-        try:
-            return self.sql(
-                'node_val_ins', graph, node, key, branch, rev, None
-            )
-        except IntegrityError:
-            return self.sql(
-                'node_val_upd', None, graph, node, key, branch, rev
-            )
+        (graph, node, key) = map(self._intern_name, (graph, node, key))
+        self._unpatch_later('node_val', (graph, node, key), branch, rev)
+        self._changed(graph, branch, rev)
+        self._write('node_val', (graph, node, key, branch, rev), None)
 
-    def edges_dump(self):
-        """Dump the entire contents of the edges table."""
-        for (graph, nodeA, nodeB, idx, branch, rev, extant) in self.sql('edges_dump'):
+    def edges_dump(self, graph=None):
+        """Dump the entire contents of the edges table, or just the part of
+        it about ``graph``.
+
+        """
+        name = self._name
+        for (graph, nodeA, nodeB, idx, branch, rev, extant) in self._dump(
+                'edges_dump', graph
+        ):
             yield (
-                self.json_load(graph),
-                self.json_load(nodeA),
-                self.json_load(nodeB),
+                name(graph),
+                name(nodeA),
+                name(nodeB),
                 idx,
                 branch,
                 rev,
@@ -459,161 +1294,140 @@ class QueryEngine(object):
         graph, at this revision.
 
         """
-        graph = self.json_dump(graph)
+        graph = self._name_id(graph)
         seen = set()
-        for (b, r) in self.active_branches(branch, rev):
-            for row in self.sql(
-                'edges_extant', graph, branch, rev
-            ):
-                if row[0] not in seen and row[1]:
-                    yield self.json_load(row[0])
-                seen.add(row[0])
+        for (nodeA, nodeB, idx) in self._resolve('edges', graph, branch, rev):
+            if nodeA not in seen:
+                yield self._name(nodeA)
+            seen.add(nodeA)
 
     def edge_exists(self, graph, nodeA, nodeB, idx, branch, rev):
-        """Return whether the edge exists now, or None if there's no data
-        about it in this branch.
+        """Return whether the edge exists at this revision."""
+        (graph, nodeA, nodeB) = map(self._name_id, (graph, nodeA, nodeB))
+        row = self.sqlone(
+            'edge_exists', branch, rev, graph, nodeA, nodeB, idx
+        )
+        return row is not None and bool(row[0])
+
+    @staticmethod
+    def _nearest_extant(rows):
+        """Yield the nodes in ``rows`` that have an edge to or from them.
+
+        Rows are the node, the edge index, and whether it exists, and
+        come nearest branch first, so the first row for an edge is
+        the one that counts.
 
         """
-        (graph, nodeA, nodeB) = map(self.json_dump, (graph, nodeA, nodeB))
-        for (b, r) in self.active_branches(branch, rev):
-            for row in self.sql(
-                'edge_exists',
-                graph,
-                nodeA,
-                nodeB,
-                idx,
-                b,
-                r
-            ):
-                return bool(row[1])
-        return False
+        seen = set()
+        yielded = set()
+        for (node, idx, extant) in rows:
+            if (node, idx) in seen:
+                continue
+            seen.add((node, idx))
+            if extant and node not in yielded:
+                yielded.add(node)
+                yield node
 
     def nodeAs(self, graph, nodeB, branch, rev):
         """Return an iterable of nodes that have an edge leading to the given
         node.
 
         """
-        (graph, nodeB) = map(self.json_dump, (graph, nodeB))
-        seen = set()
-        for (b, r) in self.active_branches(branch, rev):
-            for row in self.sql(
-                'nodeAs',
-                graph,
-                nodeB,
-                b,
-                r
-            ):
-                if row[0] not in seen and row[1]:
-                    yield self.json_load(row[0])
-                seen.add(row[0])
+        (graph, nodeB) = map(self._name_id, (graph, nodeB))
+        for nodeA in self._nearest_extant(
+                self.sql('nodeAs', branch, rev, graph, nodeB)
+        ):
+            yield self._name(nodeA)
 
     def nodeBs(self, graph, nodeA, branch, rev):
         """Return an iterable of nodes you can get to from the given one."""
-        (graph, nodeA) = map(self.json_dump, (graph, nodeA))
-        seen = set()
-        for (b, r) in self.active_branches(branch, rev):
-            for row in self.sql(
-                'nodeBs', graph, nodeA, b, r
-            ):
-                if row[0] not in seen and row[1]:
-                    yield self.json_load(row[0])
-                seen.add(row[0])
+        (graph, nodeA) = map(self._name_id, (graph, nodeA))
+        for nodeB in self._nearest_extant(
+                self.sql('nodeBs', branch, rev, graph, nodeA)
+        ):
+            yield self._name(nodeB)
 
     def multi_edges(self, graph, nodeA, nodeB, branch, rev):
         """Return an iterable of edge indices for all edges between these two
         nodes.
 
         """
-        (graph, nodeA, nodeB) = map(self.json_dump, (graph, nodeA, nodeB))
+        (graph, nodeA, nodeB) = map(self._name_id, (graph, nodeA, nodeB))
         seen = set()
-        for (b, r) in self.active_branches(branch, rev):
-            for row in self.sql(
-                'multi_edges', graph, nodeA, nodeB, branch, rev
-            ):
-                if row[0] not in seen and row[1]:
-                    yield row[0]
-                seen.add(row[0])
+        for (idx, extant) in self.sql(
+                'multi_edges', branch, rev, graph, nodeA, nodeB
+        ):
+            if idx not in seen and extant:
+                yield idx
+            seen.add(idx)
 
     def exist_edge(self, graph, nodeA, nodeB, idx, branch, rev, extant):
         """Declare whether or not this edge exists."""
-        (graph, nodeA, nodeB) = map(self.json_dump, (graph, nodeA, nodeB))
-        try:
-            self.sql(
-                'edge_exist_ins', graph, nodeA, nodeB, idx, branch, rev, extant
-            )
-        except IntegrityError:
-            self.sql(
-                'edge_exist_upd', extant, graph, nodeA, nodeB, idx, branch, rev
-            )
+        (graph, nodeA, nodeB) = map(
+            self._intern_name, (graph, nodeA, nodeB)
+        )
+        self._changed(graph, branch, rev)
+        self._write('edges', (graph, nodeA, nodeB, idx, branch, rev), extant)
+
+    def edge_val_dump(self, graph=None, defer=False):
+        """Yield the entire contents of the edge_val table, or just the part
+        of it about ``graph``.
+
+        With ``defer``, leave the values encoded, in :class:`Deferred`
+        wrappers.
 
-    def edge_val_dump(self):
-        """Yield the entire contents of the edge_val table."""
-        for (graph, nodeA, nodeB, idx, key, branch, rev, value) in self.sql('edge_val_dump'):
+        """
+        load = self._loader('edge_val', defer)
+        name = self._name
+        for (graph, nodeA, nodeB, idx, key, branch, rev, value) in self._dump(
+                'edge_val_dump', graph
+        ):
             yield (
-                self.json_load(graph),
-                self.json_load(nodeA),
-                self.json_load(nodeB),
+                name(graph),
+                name(nodeA),
+                name(nodeB),
                 idx,
-                self.json_load(key),
+                name(key),
                 branch,
                 rev,
-                self.json_load(value)
+                load((graph, nodeA, nodeB, idx, key), value)
             )
 
     def edge_val_keys(self, graph, nodeA, nodeB, idx, branch, rev):
         """Return an iterable of keys this edge has."""
-        (graph, nodeA, nodeB) = map(self.json_dump, (graph, nodeA, nodeB))
-        seen = set()
-        for (b, r) in self.active_branches(branch, rev):
-            for row in self.sql(
-                'edge_val_items', graph, nodeA, nodeB, idx, b, r
-            ):
-                if row[0] not in seen:
-                    yield self.json_load(row[0])
-                seen.add(row[0])
+        (graph, nodeA, nodeB) = map(self._name_id, (graph, nodeA, nodeB))
+        for (k,) in self._resolve(
+                'edge_val', graph, branch, rev, nodeA, nodeB, idx
+        ):
+            yield self._name(k)
 
     def edge_val_get(self, graph, nodeA, nodeB, idx, key, branch, rev):
         """Return the value of this key of this edge."""
-        (graph, nodeA, nodeB, key) = map(self.json_dump, (graph, nodeA, nodeB, key))
-        for (b, r) in self.active_branches(branch, rev):
-            for row in self.sql(
-                'edge_val_get', graph, nodeA, nodeB, idx, key, b, r
-            ):
-                if row[0] is None:
-                    raise KeyError("Key not set")
-                return self.json_load(row[0])
-        raise KeyError("Key never set")
+        (graph, nodeA, nodeB, key) = map(self._name_id, (graph, nodeA, nodeB, key))
+        row = self.sqlone(
+            'edge_val_get', branch, rev, graph, nodeA, nodeB, idx, key
+        )
+        if row is None:
+            raise KeyError("Key never set")
+        if row[0] is None:
+            raise KeyError("Key not set")
+        return self._load_val(
+            'edge_val', (graph, nodeA, nodeB, idx, key), row[0]
+        )
 
     def edge_val_set(self, graph, nodeA, nodeB, idx, key, branch, rev, value):
         """Set this key of this edge to this value."""
-        (graph, nodeA, nodeB, key, value) = map(
-            self.json_dump,
-            (graph, nodeA, nodeB, key, value)
+        (graph, nodeA, nodeB, key) = map(
+            self._intern_name,
+            (graph, nodeA, nodeB, key)
+        )
+        key_ids = (graph, nodeA, nodeB, idx, key)
+        self._unpatch_later('edge_val', key_ids, branch, rev)
+        value = self._dump_val('edge_val', key_ids, branch, rev, value)
+        self._changed(graph, branch, rev)
+        self._write(
+            'edge_val', (graph, nodeA, nodeB, idx, key, branch, rev), value
         )
-        try:
-            self.sql(
-                'edge_val_ins',
-                graph,
-                nodeA,
-                nodeB,
-                idx,
-                key,
-                branch,
-                rev,
-                value
-            )
-        except IntegrityError:
-            self.sql(
-                'edge_val_upd',
-                value,
-                graph,
-                nodeA,
-                nodeB,
-                idx,
-                key,
-                branch,
-                rev
-            )
 
     def edge_val_del(self, graph, nodeA, nodeB, idx, key, branch, rev):
         """Declare that the key no longer applies to this edge, as of this
@@ -621,36 +1435,47 @@ class QueryEngine(object):
 
         """
         (graph, nodeA, nodeB, key) = map(
-            self.json_dump,
+            self._intern_name,
             (graph, nodeA, nodeB, key)
         )
-        try:
-            self.sql(
-                'edge_val_ins',
-                graph,
-                nodeA,
-                nodeB,
-                idx,
-                key,
-                branch,
-                rev,
-                None
-            )
-        except IntegrityError:
-            self.sql(
-                'edge_val_upd',
-                None,
-                graph,
-                nodeA,
-                nodeB,
-                idx,
-                key,
-                branch,
-                rev
-            )
+        self._unpatch_later(
+            'edge_val', (graph, nodeA, nodeB, idx, key), branch, rev
+        )
+        self._changed(graph, branch, rev)
+        self._write(
+            'edge_val', (graph, nodeA, nodeB, idx, key, branch, rev), None
+        )
+
+    def _table_names(self):
+        """Return the names of the tables in the database."""
+        if hasattr(self, 'alchemist'):
+            return self.alchemist.table_names()
+        return [name for (name,) in self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'"
+        )]
+
+    def old_schema(self):
+        """Return whether the database was made by a version of gorm that
+        stored graph names, node names, and keys as text, rather than
+        by ID in the ``names`` table.
+
+        """
+        tables = set(self._table_names())
+        return 'graphs' in tables and 'names' not in tables
 
     def initdb(self):
-        """Create tables and indices."""
+        """Create tables and indices.
+
+        If the database was made by a version of gorm from before names
+        had IDs, raise :class:`OldSchemaError` instead.
+
+        """
+        if self.old_schema():
+            raise OldSchemaError(
+                "This database stores names as text, as gorm did before "
+                "they had IDs. Convert it with: python -m gorm.migrate "
+                "DBSTRING"
+            )
         if hasattr(self, 'alchemist'):
             self.alchemist.meta.create_all(self.engine)
             if 'branch' not in self.globl:
@@ -660,6 +1485,10 @@ class QueryEngine(object):
             return
         from sqlite3 import OperationalError
         cursor = self.connection.cursor()
+        try:
+            cursor.execute('SELECT * FROM names;')
+        except OperationalError:
+            cursor.execute(self.strings['create_names'])
         try:
             cursor.execute('SELECT * FROM global;')
         except OperationalError:
@@ -701,21 +1530,166 @@ class QueryEngine(object):
         except OperationalError:
             cursor.execute(self.strings['create_edges'])
             cursor.execute(self.strings['index_edges'])
+            cursor.execute(self.strings['index_edges_reverse'])
         try:
             cursor.execute('SELECT * FROM edge_val;')
         except OperationalError:
             cursor.execute(self.strings['create_edge_val'])
             cursor.execute(self.strings['index_edge_val'])
+        try:
+            cursor.execute('SELECT * FROM keyframes;')
+        except OperationalError:
+            cursor.execute(self.strings['create_keyframes'])
+            for kind in keyframe_kinds:
+                cursor.execute(self.strings['create_' + kind + '_keyframes'])
+
+    def update_indices(self):
+        """Create whichever of my indices the database lacks, and drop
+        those that older versions of gorm made instead.
+
+        Databases made by :meth:`initdb` have the right ones already.
+        This is for those made before.
+
+        """
+        self.flush()
+        # statements in progress would keep the tables locked
+        self._cursors.clear()
+        if hasattr(self, 'alchemist'):
+            self.alchemist.update_indices(old_indices)
+            return
+        from sqlite3 import OperationalError
+        cursor = self.connection.cursor()
+        for name in old_indices:
+            cursor.execute('DROP INDEX IF EXISTS ' + name)
+        for (k, s) in self.strings.items():
+            if not k.startswith('index_'):
+                continue
+            try:
+                cursor.execute(s)
+            except OperationalError as ex:
+                if 'already exists' not in str(ex):
+                    raise
+
+    def _drop_indices(self):
+        """Drop the indices that :meth:`update_indices` would make."""
+        self._cursors.clear()
+        if hasattr(self, 'alchemist'):
+            self.alchemist.drop_indices()
+            return
+        cursor = self.connection.cursor()
+        for (k, s) in self.strings.items():
+            if k.startswith('index_'):
+                # CREATE INDEX name ON ...
+                cursor.execute('DROP INDEX IF EXISTS ' + s.split()[2])
+
+    def _sqlite(self):
+        """Return whether my database is SQLite."""
+        return not hasattr(self, 'alchemist') or \
+            self.engine.dialect.name == 'sqlite'
+
+    def _pragma(self, pragma):
+        """Run ``PRAGMA pragma`` and return the first column of its
+        first row, if any.
+
+        """
+        conn = self.alchemist.conn if hasattr(self, 'alchemist') \
+            else self.connection
+        rows = conn.execute('PRAGMA ' + pragma)
+        # setting a pragma, SQLAlchemy has no rows to give
+        if getattr(rows, 'returns_rows', True):
+            row = rows.fetchone()
+            if row is not None:
+                return row[0]
+
+    def _begin(self):
+        """Begin a new transaction, if I'm the kind that needs to be
+        told.
+
+        """
+        if hasattr(self, 'transaction'):
+            self.transaction = self.alchemist.conn.begin()
+
+    @contextmanager
+    def bulk_ingest(self, check=True):
+        """Return a context manager in which writing lots of records is
+        cheaper.
+
+        I commit, then drop my indices, and buffer writes if I wasn't
+        already. With SQLite, I also turn off ``synchronous`` and
+        ``foreign_keys``, and keep the journal in memory, unless the
+        database is in WAL mode for readers. If the computer loses
+        power meanwhile, the database may be corrupted.
+
+        When the block ends, I flush, make the indices again, commit,
+        and put things back how they were. This happens even if the
+        block raises, so everything written in it gets committed. Then,
+        with ``check``, I run SQLite's ``integrity_check``, and raise
+        ``sqlite3.IntegrityError`` if it finds anything wrong.
+
+        """
+        with self.lock:
+            buffered = self._write_buffer is not None
+            # SQLite ignores some pragmas in a transaction
+            self.commit()
+            pragmas = {}
+            if self._sqlite():
+                for pragma in ('synchronous', 'foreign_keys', 'journal_mode'):
+                    pragmas[pragma] = self._pragma(pragma)
+                self._pragma('synchronous=OFF')
+                self._pragma('foreign_keys=OFF')
+                if pragmas['journal_mode'] != 'wal':
+                    self._pragma('journal_mode=MEMORY')
+            self._begin()
+            self._drop_indices()
+            if not buffered:
+                self.buffer_writes()
+        try:
+            yield
+        finally:
+            with self.lock:
+                if not buffered:
+                    self.unbuffer_writes()
+                self.update_indices()
+                self.commit()
+                for (pragma, value) in pragmas.items():
+                    self._pragma('{}={}'.format(pragma, value))
+                self._begin()
+        if check and self._sqlite():
+            self.check_integrity()
+
+    def check_integrity(self):
+        """Run SQLite's ``integrity_check``, and raise
+        ``sqlite3.IntegrityError`` with what it says if that's not
+        "ok".
+
+        """
+        self.flush()
+        conn = self.alchemist.conn if hasattr(self, 'alchemist') \
+            else self.connection
+        rows = conn.execute('PRAGMA integrity_check')
+        problems = [row[0] for row in rows if row[0] != 'ok']
+        if problems:
+            raise sqliteIntegError(
+                "Integrity check failed: " + "; ".join(problems)
+            )
 
     def commit(self):
-        """Commit the transaction"""
+        """Flush the write buffer and commit the transaction"""
+        self.flush()
+        # let go of the statements the cursors kept open
+        self._cursors.clear()
         if hasattr(self, 'transaction'):
             self.transaction.commit()
         else:
             self.connection.commit()
 
     def close(self):
-        """Commit the transaction, then close the connection"""
+        """Commit the transaction, then close the connection, and those
+        for readers
+
+        """
         self.commit()
+        if self._readers is not None:
+            self._readers.close(self._reader_close)
         if hasattr(self, 'connection'):
             self.connection.close()
@@ -0,0 +1,453 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Read-only snapshots of a graph at one branch and revision, in files
+meant to be memory-mapped.
+
+:func:`write_snapshot` saves a gorm graph's state as of some branch and
+revision. :func:`open_snapshot` maps the file and gives you a
+read-only graph that networkx algorithms accept, without a database
+connection or any cache to build. Node names and attributes are only
+decoded when you look them up, straight out of the mapped file, so
+opening is quick no matter the size, and processes that open the
+same file share its pages.
+
+The file starts with a header giving the number of nodes and edges
+and where each section starts. The sections are arrays of 64-bit
+little-endian integers: the offsets of the encoded node names, the
+adjacency in compressed sparse row form, forward and reverse, the
+multigraph index of each edge, and the offsets of the encoded node
+and edge attributes. Names and attributes are encoded with
+:mod:`gorm.codec`'s binary encoding.
+
+"""
+import sys
+import mmap
+from array import array
+from bisect import bisect_left, bisect_right
+from struct import Struct
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+import networkx
+from .codec import _encode, _decode
+from .reify import reify
+
+MAGIC = b'GORMSNP1'
+DIRECTED = 1
+MULTIGRAPH = 2
+
+# arrays of ints, in the order they're stored
+_sections = (
+    'names', 'indptr', 'indices', 'eids',
+    'rindptr', 'rindices', 'reids', 'idx', 'node_blobs', 'edge_blobs'
+)
+# magic, flags, nodes, edges, entries in the forward adjacency,
+# offsets of the graph's name and attributes, then the offset of
+# each section
+_header = Struct('<8sIqqqqq' + 'q' * len(_sections))
+_swap = sys.byteorder != 'little'
+
+
+def _ints(out, values):
+    """Append ``values`` to the bytearray ``out`` as 64-bit ints, aligned
+    to 8 bytes, and return where they start.
+
+    """
+    out += b'\x00' * (-len(out) % 8)
+    start = len(out)
+    a = array('q', values)
+    if _swap:
+        a.byteswap()
+    out += a.tostring() if not hasattr(a, 'tobytes') else a.tobytes()
+    return start
+
+
+def _blobs(out, values):
+    """Append the encoding of each of ``values`` to ``out``, and return
+    the offset of each, followed by the end offset.
+
+    """
+    r = []
+    for v in values:
+        r.append(len(out))
+        _encode(v, out)
+    r.append(len(out))
+    return r
+
+
+def write_snapshot(graph, path, branch=None, rev=None):
+    """Save ``graph`` as of ``(branch, rev)`` to a snapshot file at
+    ``path``.
+
+    By default, save it as of the ORM's present branch and revision.
+
+    """
+    gorm = graph.gorm
+    db = gorm.db
+    branch = gorm.branch if branch is None else branch
+    rev = gorm.rev if rev is None else rev
+    name = graph.name
+    (nodes, node_val, edges, edge_val) = db.graph_state(name, branch, rev)
+    graph_val = dict(
+        (key, db.graph_val_get(name, key, branch, rev))
+        for key in db.graph_val_keys(name, branch, rev)
+    )
+    directed = graph.is_directed()
+    pos = dict((node, i) for (i, node) in enumerate(nodes))
+    edges = sorted(
+        (pos[nodeA], pos[nodeB], idx, nodeA, nodeB)
+        for (nodeA, nodeB, idx) in edges
+        if nodeA in pos and nodeB in pos
+    )
+    node_attrs = [{} for node in nodes]
+    for ((node, key), v) in node_val.items():
+        if node in pos:
+            node_attrs[pos[node]][key] = v
+    edge_attrs = []
+    eid = {}
+    for (a, b, idx, nodeA, nodeB) in edges:
+        eid[(a, b, idx)] = len(edge_attrs)
+        edge_attrs.append({})
+    for ((nodeA, nodeB, idx, key), v) in edge_val.items():
+        k = (pos.get(nodeA), pos.get(nodeB), idx)
+        if k in eid:
+            edge_attrs[eid[k]][key] = v
+    # an undirected graph lists each edge under both its nodes
+    forward = [(a, b, idx, eid[(a, b, idx)]) for (a, b, idx) in eid]
+    if directed:
+        reverse = [(b, a, idx, e) for (a, b, idx, e) in forward]
+    else:
+        reverse = []
+        forward += [
+            (b, a, idx, e) for (a, b, idx, e) in list(forward)
+            if a != b and (b, a, idx) not in eid
+        ]
+    forward.sort()
+    reverse.sort()
+
+    def csr(rows):
+        indptr = [0] * (len(nodes) + 1)
+        for row in rows:
+            indptr[row[0] + 1] += 1
+        for i in range(len(nodes)):
+            indptr[i + 1] += indptr[i]
+        return (indptr, [row[1] for row in rows], [row[3] for row in rows])
+
+    out = bytearray(_header.size)
+    sections = {}
+    name_off = len(out)
+    _encode(name, out)
+    graph_off = len(out)
+    _encode(graph_val, out)
+    names = _blobs(out, nodes)
+    node_blobs = _blobs(out, node_attrs)
+    edge_blobs = _blobs(out, edge_attrs)
+    sections['names'] = _ints(out, names)
+    (indptr, indices, eids) = csr(forward)
+    sections['indptr'] = _ints(out, indptr)
+    sections['indices'] = _ints(out, indices)
+    sections['eids'] = _ints(out, eids)
+    (indptr, indices, eids) = csr(reverse)
+    sections['rindptr'] = _ints(out, indptr)
+    sections['rindices'] = _ints(out, indices)
+    sections['reids'] = _ints(out, eids)
+    sections['idx'] = _ints(out, [edge[2] for edge in edges])
+    sections['node_blobs'] = _ints(out, node_blobs)
+    sections['edge_blobs'] = _ints(out, edge_blobs)
+    flags = (DIRECTED if directed else 0) | (
+        MULTIGRAPH if graph.is_multigraph() else 0
+    )
+    out[:_header.size] = _header.pack(
+        MAGIC, flags, len(nodes), len(edges), len(forward),
+        name_off, graph_off,
+        *[sections[s] for s in _sections]
+    )
+    with open(path, 'wb') as f:
+        f.write(out)
+
+
+class SnapshotData(object):
+    """A memory-mapped snapshot file.
+
+    The arrays are views on the mapped file where Python allows it,
+    copies where it doesn't: in Python 2, or on big-endian machines.
+    Python 2 copies the whole file.
+
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Python 2 gets a one-character string when indexing a mmap
+        self._buf = self._mmap if bytes is not str else bytearray(
+            self._mmap[:]
+        )
+        header = _header.unpack_from(self._mmap, 0)
+        (magic, flags, n, m, k, self._name_off, self._graph_off) = \
+            header[:7]
+        if magic != MAGIC:
+            raise ValueError("{} is not a gorm snapshot".format(path))
+        self.directed = bool(flags & DIRECTED)
+        self.multigraph = bool(flags & MULTIGRAPH)
+        self.n = n
+        self.m = m
+        # undirected graphs have each edge twice in the forward
+        # adjacency, and nothing in the reverse
+        r = m if self.directed else 0
+        lengths = (n + 1, n + 1, k, k, n + 1, r, r, m, n + 1, m + 1)
+        for (section, offset, length) in zip(_sections, header[7:], lengths):
+            setattr(self, section, self._array(offset, length))
+
+    def _array(self, offset, length):
+        if not _swap and hasattr(memoryview, 'cast'):
+            return memoryview(self._mmap)[
+                offset:offset + 8 * length
+            ].cast('q')
+        a = array('q')
+        raw = self._mmap[offset:offset + 8 * length]
+        if hasattr(a, 'frombytes'):
+            a.frombytes(raw)
+        else:
+            a.fromstring(raw)
+        if _swap:
+            a.byteswap()
+        return a
+
+    def _decode(self, offset):
+        return _decode(self._buf, offset)[0]
+
+    @reify
+    def graph_name(self):
+        return self._decode(self._name_off)
+
+    def graph_attrs(self):
+        return self._decode(self._graph_off)
+
+    def node_name(self, i):
+        return self._decode(self.names[i])
+
+    def node_attrs(self, i):
+        return self._decode(self.node_blobs[i])
+
+    def edge_attrs(self, e):
+        return self._decode(self.edge_blobs[e])
+
+    @reify
+    def positions(self):
+        """Dictionary of the position of each node, by name.
+
+        This decodes all the names, the first time you look up a
+        node.
+
+        """
+        return dict(
+            (self.node_name(i), i) for i in range(self.n)
+        )
+
+    def close(self):
+        """Let go of the mapped file."""
+        for section in _sections:
+            a = getattr(self, section)
+            if isinstance(a, memoryview):
+                a.release()
+        self._mmap.close()
+
+
+class SnapshotNodes(Mapping):
+    """Read-only mapping of node names to their attributes."""
+    def __init__(self, data):
+        self._data = data
+
+    def __iter__(self):
+        for i in range(self._data.n):
+            yield self._data.node_name(i)
+
+    def __len__(self):
+        return self._data.n
+
+    def __contains__(self, node):
+        try:
+            return node in self._data.positions
+        except TypeError:
+            return False
+
+    def __getitem__(self, node):
+        return self._data.node_attrs(self._data.positions[node])
+
+
+class SnapshotAdjacency(Mapping):
+    """Read-only mapping of node names to their neighbors, going forward
+    along edges, or in reverse.
+
+    """
+    def __init__(self, data, reverse=False):
+        self._data = data
+        if reverse:
+            (self._indptr, self._indices, self._eids) = (
+                data.rindptr, data.rindices, data.reids
+            )
+        else:
+            (self._indptr, self._indices, self._eids) = (
+                data.indptr, data.indices, data.eids
+            )
+
+    def __iter__(self):
+        return iter(SnapshotNodes(self._data))
+
+    def __len__(self):
+        return self._data.n
+
+    def __contains__(self, node):
+        return node in SnapshotNodes(self._data)
+
+    def __getitem__(self, node):
+        i = self._data.positions[node]
+        return SnapshotNeighbors(
+            self, self._indptr[i], self._indptr[i + 1]
+        )
+
+
+class SnapshotNeighbors(Mapping):
+    """Read-only mapping of one node's neighbors to the attributes of the
+    edges to them, or in a multigraph, to dictionaries of those keyed
+    by edge index.
+
+    """
+    def __init__(self, adjacency, lo, hi):
+        self._adj = adjacency
+        self._data = adjacency._data
+        self._lo = lo
+        self._hi = hi
+
+    def _positions(self):
+        indices = self._adj._indices
+        prev = None
+        for j in range(self._lo, self._hi):
+            if indices[j] != prev:
+                prev = indices[j]
+                yield prev
+
+    def __iter__(self):
+        for i in self._positions():
+            yield self._data.node_name(i)
+
+    def __len__(self):
+        if not self._data.multigraph:
+            return self._hi - self._lo
+        n = 0
+        for i in self._positions():
+            n += 1
+        return n
+
+    def _range(self, node):
+        try:
+            i = self._data.positions[node]
+        except (KeyError, TypeError):
+            return (0, 0)
+        indices = self._adj._indices
+        lo = bisect_left(indices, i, self._lo, self._hi)
+        return (lo, bisect_right(indices, i, lo, self._hi))
+
+    def __contains__(self, node):
+        (lo, hi) = self._range(node)
+        return lo < hi
+
+    def __getitem__(self, node):
+        (lo, hi) = self._range(node)
+        if lo == hi:
+            raise KeyError("No edge to {}".format(node))
+        data = self._data
+        eids = self._adj._eids
+        if not data.multigraph:
+            return data.edge_attrs(eids[lo])
+        return dict(
+            (data.idx[eids[j]], data.edge_attrs(eids[j]))
+            for j in range(lo, hi)
+        )
+
+
+class SnapshotGraphMixin(object):
+    """What the read-only snapshot graphs have in common.
+
+    They're networkx graphs whose node and adjacency dictionaries are
+    read-only mappings onto a :class:`SnapshotData`. Anything that
+    would change them raises ``TypeError``. To get a graph you can
+    change, copy one into a regular networkx graph.
+
+    """
+    def __init__(self, data):
+        self._data = data
+        self.graph = data.graph_attrs()
+        self.__networkx_cache__ = {}
+        self._node = SnapshotNodes(data)
+        self._adj = SnapshotAdjacency(data)
+        if data.directed:
+            self._succ = self._adj
+            self._pred = SnapshotAdjacency(data, reverse=True)
+
+    @property
+    def name(self):
+        return self._data.graph_name
+
+    @name.setter
+    def name(self, v):
+        raise TypeError("Snapshots can't be renamed")
+
+    @property
+    def node(self):
+        return self._node
+
+    @property
+    def adj(self):
+        return self._adj
+
+    @property
+    def edge(self):
+        return self._adj
+
+    def close(self):
+        """Let go of the mapped file. I'm no use after this."""
+        self._data.close()
+
+
+class SnapshotGraph(SnapshotGraphMixin, networkx.Graph):
+    pass
+
+
+class SnapshotDiGraph(SnapshotGraphMixin, networkx.DiGraph):
+    @property
+    def succ(self):
+        return self._succ
+
+    @property
+    def pred(self):
+        return self._pred
+
+
+class SnapshotMultiGraph(SnapshotGraphMixin, networkx.MultiGraph):
+    pass
+
+
+class SnapshotMultiDiGraph(SnapshotGraphMixin, networkx.MultiDiGraph):
+    @property
+    def succ(self):
+        return self._succ
+
+    @property
+    def pred(self):
+        return self._pred
+
+
+def open_snapshot(path):
+    """Map the snapshot file at ``path``, and return a read-only graph of
+    the same type as the one saved.
+
+    """
+    data = SnapshotData(path)
+    cls = {
+        (False, False): SnapshotGraph,
+        (True, False): SnapshotDiGraph,
+        (False, True): SnapshotMultiGraph,
+        (True, True): SnapshotMultiDiGraph
+    }[(data.directed, data.multigraph)]
+    return cls(data)
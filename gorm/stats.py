@@ -0,0 +1,136 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Counting the queries that :class:`gorm.query.QueryEngine` runs, how
+long they take, and how many rows they return, by name.
+
+"""
+from collections import deque
+from threading import Lock
+try:
+    from time import perf_counter
+except ImportError:
+    # python 2
+    from time import time as perf_counter
+
+
+class QueryStats(object):
+    """Tallies of the queries run while I was recording, keyed by the
+    name of the query.
+
+    For each query I count the ``calls``, the ``rows`` fetched from
+    it, and the ``time`` it took in all, in seconds, from starting it
+    to having its first row, or having written. I keep the times of
+    the last ``sample_size`` calls, to work out percentiles from.
+
+    """
+    def __init__(self, sample_size=1000):
+        self.sample_size = sample_size
+        self._lock = Lock()
+        self._tallies = {}
+
+    def _tally(self, name):
+        try:
+            return self._tallies[name]
+        except KeyError:
+            with self._lock:
+                return self._tallies.setdefault(
+                    name, [0, 0.0, 0, deque(maxlen=self.sample_size)]
+                )
+
+    def record(self, name, seconds, rows=0):
+        """Count a call of the query ``name`` that took ``seconds`` and
+        returned ``rows``.
+
+        """
+        tally = self._tally(name)
+        with self._lock:
+            tally[0] += 1
+            tally[1] += seconds
+            tally[2] += rows
+            tally[3].append(seconds)
+
+    def count_rows(self, name, rows):
+        """Count ``rows`` more rows fetched from the query ``name``."""
+        tally = self._tally(name)
+        with self._lock:
+            tally[2] += rows
+
+    def reset(self):
+        """Forget everything I've counted."""
+        with self._lock:
+            self._tallies = {}
+
+    def stats(self):
+        """Return a dict, keyed by the names of queries, of dicts of their
+        ``calls``, ``rows``, total ``time``, ``mean`` time, and the
+        ``p50``, ``p90``, ``p99``, and ``max`` of their recent times.
+
+        """
+        with self._lock:
+            tallies = [
+                (name, calls, time, rows, sorted(samples))
+                for (name, (calls, time, rows, samples))
+                in self._tallies.items()
+            ]
+        r = {}
+        for (name, calls, time, rows, samples) in tallies:
+            r[name] = {
+                'calls': calls,
+                'rows': rows,
+                'time': time,
+                'mean': time / calls if calls else 0.0,
+                'p50': percentile(samples, 50),
+                'p90': percentile(samples, 90),
+                'p99': percentile(samples, 99),
+                'max': samples[-1] if samples else 0.0
+            }
+        return r
+
+
+def percentile(samples, p):
+    """Return the ``p`` percentile of the sorted list ``samples``, or 0.0
+    if it's empty.
+
+    """
+    if not samples:
+        return 0.0
+    return samples[max(0, (len(samples) * p + 99) // 100 - 1)]
+
+
+class Counted(object):
+    """Stands in for a cursor, and tells some :class:`QueryStats` how
+    many rows are fetched from it.
+
+    """
+    def __init__(self, cursor, name, recorders):
+        self._cursor = cursor
+        self._name = name
+        self._recorders = recorders
+
+    def _count(self, rows):
+        for recorder in self._recorders:
+            recorder.count_rows(self._name, rows)
+
+    def __getattr__(self, attr):
+        return getattr(self._cursor, attr)
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._count(1)
+            yield row
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._count(len(rows))
+        return rows
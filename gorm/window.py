@@ -0,0 +1,239 @@
+# This file is part of gorm, an object relational mapper for versioned graphs.
+# Copyright (C) 2014 Zachary Spector.
+"""Dictionaries keyed by revision number, in which looking up a
+revision gets you whatever value was set most recently as of then.
+
+"""
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+from bisect import bisect_left, bisect_right
+from array import array
+
+
+class Deferred(object):
+    """A value still encoded the way it was in the database, and the
+    function to decode it with.
+
+    :class:`WindowDict` decodes me the first time I'm looked up, and
+    keeps the result in my place, so values that never get read never
+    get decoded.
+
+    """
+    __slots__ = ['raw', 'load']
+
+    def __init__(self, raw, load):
+        self.raw = raw
+        self.load = load
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.raw)
+
+
+class WindowDict(MutableMapping):
+    """A dict of revisions to values, where looking up a revision that
+    has no value of its own gets you the value set at the nearest
+    revision before it.
+
+    Revisions are kept sorted, so an arbitrary lookup is a binary
+    search. I also remember where the last lookup landed, so when
+    the cursor moves forward or backward one revision at a time, as it
+    usually does, a lookup costs O(1).
+
+    Iterating over me gets you only those revisions that actually had
+    a value set.
+
+    Revisions are stored in an ``array`` of 64-bit integers, so they
+    have to be integers, but they don't each cost an int object.
+
+    Values may be :class:`Deferred`, in which case I decode them when
+    they're first looked up.
+
+    """
+    __slots__ = ['_revs', '_vals', '_pos']
+
+    def __init__(self, data=None):
+        self._revs = array('q')
+        self._vals = []
+        self._pos = 0
+        if data is not None:
+            if hasattr(data, 'items'):
+                data = data.items()
+            for (rev, v) in sorted(data, key=lambda kv: kv[0]):
+                self[rev] = v
+
+    def _seek(self, rev):
+        """Return the index of the latest revision at or before ``rev``, or
+        -1 if there isn't one.
+
+        """
+        revs = self._revs
+        n = len(revs)
+        i = self._pos
+        if i < n:
+            if revs[i] <= rev:
+                # same window as last time, or the one after
+                if i + 1 == n or rev < revs[i + 1]:
+                    return i
+                if i + 2 == n or rev < revs[i + 2]:
+                    self._pos = i + 1
+                    return i + 1
+            elif i > 0 and revs[i - 1] <= rev:
+                # the window before
+                self._pos = i - 1
+                return i - 1
+        i = bisect_right(revs, rev) - 1
+        if i >= 0:
+            self._pos = i
+        return i
+
+    def __getitem__(self, rev):
+        """Return the value as of ``rev``"""
+        i = self._seek(rev)
+        if i < 0:
+            raise KeyError("Nothing set as of revision {}".format(rev))
+        v = self._vals[i]
+        if type(v) is Deferred:
+            v = self._vals[i] = v.load(v.raw)
+        return v
+
+    def __setitem__(self, rev, v):
+        """Set the value from ``rev`` onward, until the next revision that has
+        one of its own
+
+        """
+        revs = self._revs
+        if not revs or revs[-1] < rev:
+            revs.append(rev)
+            self._vals.append(v)
+            return
+        i = bisect_left(revs, rev)
+        if revs[i] == rev:
+            self._vals[i] = v
+        else:
+            revs.insert(i, rev)
+            self._vals.insert(i, v)
+
+    def __delitem__(self, rev):
+        """Forget the value set at exactly ``rev``"""
+        revs = self._revs
+        i = bisect_left(revs, rev)
+        if i == len(revs) or revs[i] != rev:
+            raise KeyError("Nothing set at revision {}".format(rev))
+        del revs[i]
+        del self._vals[i]
+        if self._pos >= len(revs):
+            self._pos = 0
+
+    def __iter__(self):
+        """Iterate over the revisions that have values of their own"""
+        return iter(list(self._revs))
+
+    def __len__(self):
+        """Number of revisions with values of their own"""
+        return len(self._revs)
+
+    def __repr__(self):
+        return "{}({})".format(
+            self.__class__.__name__,
+            dict(zip(self._revs, self._vals))
+        )
+
+    def load_after(self, rev):
+        """Decode the values set after ``rev`` that are still
+        :class:`Deferred`.
+
+        Do this before the value at ``rev`` changes in the database,
+        since later values may be patches against it.
+
+        """
+        revs = self._revs
+        vals = self._vals
+        for i in range(bisect_right(revs, rev), len(revs)):
+            v = vals[i]
+            if type(v) is Deferred:
+                vals[i] = v.load(v.raw)
+
+
+class SharedWindowDict(WindowDict):
+    """A :class:`WindowDict` that any number of threads can read while
+    one writes, so long as writers hold ``lock``.
+
+    Readers don't take the lock, except to keep a value they decoded,
+    and don't move the cursor; every lookup is a binary search.
+    Setting a value at a new latest revision appends it in place,
+    value first. Any other change of revisions replaces my arrays
+    with new ones, and counts ``_gen`` up before and after, so that
+    readers can tell if they got the revisions of one pair of arrays
+    and the values of another.
+
+    """
+    __slots__ = ['_lock', '_gen']
+
+    def __init__(self, lock, data=None):
+        self._lock = lock
+        self._gen = 0
+        super(SharedWindowDict, self).__init__(data)
+
+    def _arrays(self):
+        """Return my revisions and values, as of the same change"""
+        while True:
+            gen = self._gen
+            revs = self._revs
+            vals = self._vals
+            if not gen & 1 and gen == self._gen:
+                return (revs, vals)
+
+    def _replace(self, revs, vals):
+        self._gen += 1
+        self._revs = revs
+        self._vals = vals
+        self._gen += 1
+
+    def __getitem__(self, rev):
+        """Return the value as of ``rev``"""
+        (revs, vals) = self._arrays()
+        i = bisect_right(revs, rev) - 1
+        if i < 0:
+            raise KeyError("Nothing set as of revision {}".format(rev))
+        v = vals[i]
+        if type(v) is Deferred:
+            loaded = v.load(v.raw)
+            with self._lock:
+                if self._vals is vals and vals[i] is v:
+                    vals[i] = loaded
+            v = loaded
+        return v
+
+    def __setitem__(self, rev, v):
+        """Set the value from ``rev`` onward, until the next revision that has
+        one of its own
+
+        """
+        revs = self._revs
+        if not revs or revs[-1] < rev:
+            self._vals.append(v)
+            revs.append(rev)
+            return
+        i = bisect_left(revs, rev)
+        if revs[i] == rev:
+            self._vals[i] = v
+            return
+        revs = array('q', revs)
+        vals = list(self._vals)
+        revs.insert(i, rev)
+        vals.insert(i, v)
+        self._replace(revs, vals)
+
+    def __delitem__(self, rev):
+        """Forget the value set at exactly ``rev``"""
+        revs = self._revs
+        i = bisect_left(revs, rev)
+        if i == len(revs) or revs[i] != rev:
+            raise KeyError("Nothing set at revision {}".format(rev))
+        revs = array('q', revs)
+        vals = list(self._vals)
+        del revs[i]
+        del vals[i]
+        self._replace(revs, vals)
@@ -1,8 +1,9 @@
 # This file is part of gorm, an object relational mapper for versioned graphs.
 # Copyright (C) 2014 Zachary Spector.
-from collections import MutableMapping, MutableSequence
+from collections import MutableMapping, MutableSequence, OrderedDict
 from json import dumps, loads
 from copy import deepcopy
+from threading import Lock
 
 
 def enc_tuple(o):
@@ -43,31 +44,195 @@ def dec_tuple(o):
         return o
 
 
-json_dump_hints = {}
+DEFAULT_CAPACITY = 65536
+_missing = object()
 
 
-def json_dump(obj):
-    """JSON dumper that distinguishes lists from tuples"""
-    k = str(obj)
-    if k not in json_dump_hints:
-        json_dump_hints[k] = dumps(enc_tuple(obj))
-    return json_dump_hints[k]
+class LRUCache(object):
+    """Dictionary of at most ``capacity`` entries, which forgets the one
+    least recently used when it's full.
+
+    I count my ``hits``, ``misses``, and ``evictions``. Threads can
+    share me: writes take a lock, and reads rely on each operation on
+    the underlying ``OrderedDict`` being atomic, which saves taking
+    the lock on every hit. The counters may be slightly off when
+    threads contend.
+
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise ValueError("LRUCache needs room for at least one entry")
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+        try:
+            self._touch = self._data.move_to_end
+        except AttributeError:
+            # python 2
+            def touch(key):
+                self._data[key] = self._data.pop(key)
+            self._touch = touch
+
+    def get(self, key, default=None):
+        """Return the value for ``key`` and mark it recently used, or
+        return ``default`` if I don't have it.
+
+        """
+        try:
+            v = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        try:
+            self._touch(key)
+        except KeyError:
+            # evicted by another thread just now
+            pass
+        self.hits += 1
+        return v
+
+    def put(self, key, value):
+        """Remember ``value`` for ``key``, forgetting the least recently
+        used entries if I'm over capacity.
+
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Forget everything, but keep counting."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return a dict of my counters, size, and capacity."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'capacity': self.capacity
+            }
+
+
+_scalars = frozenset(
+    type(v) for v in (u'', '', 0, 2 ** 64, 0.0, True, None)
+)
+
+
+def _memo_key(obj):
+    """Return a key for memoizing the JSON of ``obj``, or ``None`` if it
+    shouldn't be memoized.
+
+    The key includes the type, so that ``1``, ``1.0``, ``True`` and
+    ``'1'`` don't share an entry, and does so for each item in a
+    tuple. Lists and dicts are mutable, so they don't get keys.
+
+    """
+    t = type(obj)
+    if t in _scalars:
+        return (t, obj)
+    if isinstance(obj, tuple):
+        inner = tuple(_memo_key(o) for o in obj)
+        if None in inner:
+            return None
+        return (tuple, inner)
+    if isinstance(obj, (list, dict)):
+        return None
+    return (type(obj), obj)
 
 
-json_load_hints = {}
+class JSONCodec(object):
+    """JSON dumper and loader that distinguish lists from tuples, and
+    remember what they've recently dumped and loaded.
+
+    Each direction gets an :class:`LRUCache` of ``capacity`` entries:
+    ``dumped`` and ``loaded``. Values that would be mutable after
+    loading aren't memoized, so nobody can change what somebody else
+    loaded.
+
+    Other encodings can subclass me and override :meth:`encode` and
+    :meth:`decode`. Set ``binary`` to ``True`` if the encoding is
+    ``bytes``, so that the database can use BLOB columns.
+
+    """
+    binary = False
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.dumped = LRUCache(capacity)
+        self.loaded = LRUCache(capacity)
+
+    def encode(self, obj):
+        """Return the JSON for ``obj``, without memoizing"""
+        return dumps(enc_tuple(obj))
+
+    def decode(self, s):
+        """Return the object that ``s`` is the JSON for, without
+        memoizing
+
+        """
+        if s == '["list"]':
+            return []
+        if s == '["tuple"]':
+            return tuple()
+        return dec_tuple(loads(s))
+
+    def dump(self, obj):
+        """Return the encoding of ``obj``"""
+        k = _memo_key(obj)
+        if k is None:
+            return self.encode(obj)
+        try:
+            r = self.dumped.get(k, _missing)
+        except TypeError:
+            # unhashable, somewhere inside
+            return self.encode(obj)
+        if r is _missing:
+            r = self.encode(obj)
+            self.dumped.put(k, r)
+        return r
+
+    def load(self, s):
+        """Return the object that ``s`` is the encoding of"""
+        if s is None:
+            return None
+        r = self.loaded.get(s, _missing)
+        if r is _missing:
+            r = self.decode(s)
+            try:
+                hash(r)
+            except TypeError:
+                return r
+            self.loaded.put(s, r)
+        return r
+
+    def stats(self):
+        """Return the stats of my ``dumped`` and ``loaded`` caches."""
+        return {'dump': self.dumped.stats(), 'load': self.loaded.stats()}
+
+
+codec = JSONCodec()
+
+
+def json_dump(obj):
+    """JSON dumper that distinguishes lists from tuples"""
+    return codec.dump(obj)
 
 
 def json_load(s):
     """JSON loader that distinguishes lists from tuples"""
-    if s is None:
-        return None
-    if s == '["list"]':
-        return []
-    if s == '["tuple"]':
-        return tuple()
-    if s not in json_load_hints:
-        json_load_hints[s] = dec_tuple(loads(s))
-    return json_load_hints[s]
+    return codec.load(s)
 
 
 class JSONWrapper(MutableMapping):
@@ -144,11 +309,17 @@ class JSONListWrapper(JSONWrapper):
 
 
 class JSONReWrapper(MutableMapping):
-    """Like JSONWrapper with a cache."""
+    """Like JSONWrapper with a cache.
+
+    The value in the cache may be shared with other revisions, so I
+    never change it in place. Instead I copy it, change the copy, and
+    write that back to the outer mapping, which copies itself in
+    turn.
+
+    """
     def __init__(self, outer, key, initval):
         self._outer = outer
         self._key = key
-        self._inner = JSONWrapper(outer, key)
         self._v = initval
         if not isinstance(self._v, dict):
             raise TypeError(
@@ -160,6 +331,10 @@ class JSONReWrapper(MutableMapping):
             return self._v
         return self._v[k]
 
+    def _set(self, v):
+        self._outer[self._key] = v
+        self._v = v
+
     def __iter__(self):
         return iter(self._v)
 
@@ -178,27 +353,37 @@ class JSONReWrapper(MutableMapping):
         return r
 
     def __setitem__(self, k, v):
-        self._v[k] = v
-        self._outer[self._key] = self._v
+        new = dict(self._v)
+        new[k] = v
+        self._set(new)
 
     def __delitem__(self, k):
-        del self._inner[k]
-        del self._v[k]
+        new = dict(self._v)
+        del new[k]
+        self._set(new)
 
     def __repr__(self):
         return repr(self._v)
 
 
 class JSONListReWrapper(MutableSequence):
-    """Like JSONListWrapper with a cache."""
+    """Like JSONListWrapper with a cache, copying on write like
+    :class:`JSONReWrapper`.
+
+    """
     def __init__(self, outer, key, initval=None):
-        self._inner = JSONListWrapper(outer, key)
+        self._outer = outer
+        self._key = key
         self._v = initval
         if not isinstance(self._v, list):
             raise TypeError(
                 "JSONListReWrapper only wraps lists"
             )
 
+    def _set(self, v):
+        self._outer[self._key] = v
+        self._v = v
+
     def __iter__(self):
         return iter(self._v)
 
@@ -217,21 +402,102 @@ class JSONListReWrapper(MutableSequence):
         return r
 
     def __setitem__(self, i, v):
-        self._inner[i] = v
-        self._v[i] = v
+        new = list(self._v)
+        new[i] = v
+        self._set(new)
 
-    def __delitem__(self, i, v):
-        del self._inner[i]
-        del self._v[i]
+    def __delitem__(self, i):
+        new = list(self._v)
+        del new[i]
+        self._set(new)
 
     def insert(self, i, v):
-        self._inner.insert(i, v)
-        self._v.insert(i, v)
+        new = list(self._v)
+        new.insert(i, v)
+        self._set(new)
 
     def __repr__(self):
         return repr(self._v)
 
 
+class MutationSession(MutableMapping):
+    """A view on the values of a :class:`gorm.graph.GraphMapping` that
+    you can edit as much as you like, while the database only gets
+    written once per key, when you :meth:`flush` me.
+
+    Looking up a list or dict gets you a copy of it, which you can
+    change in place, however deeply nested. The value in the cache
+    is left alone until then. I flush on leaving a ``with`` block,
+    unless it raised.
+
+    """
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self._vals = {}
+        self._orig = {}
+        self._deleted = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+
+    def __contains__(self, k):
+        if k in self._vals:
+            return True
+        return k not in self._deleted and k in self.mapping
+
+    def __iter__(self):
+        for k in self.mapping:
+            if k not in self._deleted and k not in self._vals:
+                yield k
+        for k in list(self._vals):
+            yield k
+
+    def __len__(self):
+        n = 0
+        for k in self:
+            n += 1
+        return n
+
+    def __getitem__(self, k):
+        if k in self._vals:
+            return self._vals[k]
+        if k in self._deleted:
+            raise KeyError("Key {} deleted in this session".format(k))
+        v = self.mapping._get(k)
+        if isinstance(v, (list, dict)):
+            self._orig[k] = v
+            v = self._vals[k] = deepcopy(v)
+        return v
+
+    def __setitem__(self, k, v):
+        self._vals[k] = v
+        self._orig.pop(k, None)
+        self._deleted.discard(k)
+
+    def __delitem__(self, k):
+        if k not in self:
+            raise KeyError("Key {} not set".format(k))
+        self._vals.pop(k, None)
+        self._orig.pop(k, None)
+        self._deleted.add(k)
+
+    def flush(self):
+        """Write whatever I've changed to the mapping"""
+        for k in self._deleted:
+            del self.mapping[k]
+        for (k, v) in self._vals.items():
+            if k in self._orig and self._orig[k] == v:
+                continue
+            self.mapping[k] = v
+        self._vals = {}
+        self._orig = {}
+        self._deleted = set()
+
+
 def json_deepcopy(obj):
     r = {}
     for (k, v) in obj.items():
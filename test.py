@@ -1,4 +1,5 @@
 import unittest
+import sys
 import gorm
 import networkx as nx
 from networkx.generators.atlas import graph_atlas_g
@@ -86,5 +87,1339 @@ class GormTest(unittest.TestCase):
                     self.assertEqual(g.edge[u][v], gormg.edge[u][v])
 
 
+class SnapshotTest(unittest.TestCase):
+    def test_snapshot(self):
+        """Make sure that a snapshot has the nodes, edges, and attributes the
+        graph had at the revision it was taken, and none since.
+
+        """
+        import os
+        import tempfile
+        from gorm.snapshot import write_snapshot, open_snapshot
+        orm = gorm.ORM('sqlite:///:memory:')
+        g = orm.new_digraph('g')
+        g.graph['title'] = 'test'
+        g.node['a'] = {'pos': (1.0, 2.0)}
+        g.node['b'] = {}
+        g.node['c'] = {}
+        g.adj['a']['b'] = {'weight': 3}
+        g.adj['c']['b'] = {}
+        orm.rev = 1
+        g.adj['b']['a'] = {}
+        (fd, path) = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            write_snapshot(g, path, rev=0)
+            snap = open_snapshot(path)
+            self.assertEqual(snap.name, 'g')
+            self.assertEqual(snap.graph, {'title': 'test'})
+            self.assertEqual(snap.node['a'], {'pos': (1.0, 2.0)})
+            self.assertEqual(sorted(snap.adj), ['a', 'b', 'c'])
+            self.assertEqual(snap.adj['a']['b'], {'weight': 3})
+            self.assertEqual(list(snap.adj['b']), [])
+            self.assertEqual(sorted(snap.pred['b']), ['a', 'c'])
+            self.assertRaises(TypeError, snap.add_node, 'd')
+            snap.close()
+        finally:
+            orm.close()
+            os.remove(path)
+
+
+class JSONCodecTest(unittest.TestCase):
+    def test_memo(self):
+        """Make sure that values equal but of different types don't share
+        memoized JSON, and that the memo stays within its capacity.
+
+        """
+        from gorm.xjson import JSONCodec
+        codec = JSONCodec(2)
+        self.assertEqual(codec.dump(1), '1')
+        self.assertEqual(codec.dump('1'), '"1"')
+        self.assertEqual(codec.dump((1, 2)), '["tuple", 1, 2]')
+        self.assertEqual(codec.dump((1.0, 2)), '["tuple", 1.0, 2]')
+        self.assertEqual(codec.load('{"a": 1}'), {'a': 1})
+        codec.load('{"a": 1}')['b'] = 2
+        self.assertEqual(codec.load('{"a": 1}'), {'a': 1})
+        stats = codec.stats()
+        self.assertEqual(stats['dump']['size'], 2)
+        self.assertEqual(stats['dump']['evictions'], 2)
+        self.assertEqual(stats['dump']['misses'], 4)
+
+
+class BinaryCodecTest(unittest.TestCase):
+    def test_roundtrip(self):
+        """Make sure that everything the binary codec encodes comes back
+        equal and of the same type.
+
+        """
+        from gorm.codec import get_codec
+        codec = get_codec('binary')
+        for v in (
+                None, True, 0, -300, 2 ** 70, 1.5, 'näme', b'\x00',
+                (), [], (1.0, 2.0), [1, 2], (1, 'a', [2, (3.0,)]),
+                {'a': (1, 2), 3: {'x': None}}
+        ):
+            r = codec.decode(codec.encode(v))
+            self.assertEqual(r, v)
+            self.assertIs(type(r), type(v))
+        self.assertEqual(codec.load(codec.dump((1.0, 2.0))), (1.0, 2.0))
+        self.assertRaises(ValueError, get_codec, 'nonesuch')
+
+
+class MutationSessionTest(unittest.TestCase):
+    def test_session(self):
+        """Make sure that a session writes each changed key once, and leaves
+        the original values alone.
+
+        """
+        from gorm.xjson import MutationSession
+
+        class Mapping(dict):
+            writes = 0
+
+            def _get(self, k):
+                return self[k]
+
+            def __setitem__(self, k, v):
+                self.writes += 1
+                super(Mapping, self).__setitem__(k, v)
+        log = [0]
+        mapping = Mapping(log=log, same={'a': [1]}, gone=1)
+        with MutationSession(mapping) as session:
+            for i in range(1, 100):
+                session['log'].append(i)
+            session['same']['a'].append(2)
+            session['same']['a'].pop()
+            del session['gone']
+            self.assertNotIn('gone', session)
+        self.assertEqual(mapping.writes, 1)
+        self.assertEqual(mapping['log'], list(range(100)))
+        self.assertEqual(log, [0])
+        self.assertNotIn('gone', mapping)
+
+
+class NameTest(unittest.TestCase):
+    def test_name_ids(self):
+        """Make sure that each name gets one integer ID, which survives
+        reconnecting, and that names never stored don't get one.
+
+        """
+        from sqlite3 import connect
+        from gorm.query import QueryEngine
+        conn = connect(':memory:')
+        qe = QueryEngine(conn, {}, False)
+        qe.initdb()
+        qe.new_graph('g', 'Graph')
+        qe.exist_node('g', (1, 2), 'master', 0, True)
+        qe.exist_node('g', [1, 2], 'master', 0, True)
+        graph = qe._name_id('g')
+        self.assertEqual(qe._intern_name('g'), graph)
+        self.assertIsNone(qe._name_id('h'))
+        self.assertFalse(qe.have_graph('h'))
+        self.assertEqual(
+            sorted(qe.nodes_extant('g', 'master', 0), key=repr),
+            [(1, 2), [1, 2]]
+        )
+        qe.commit()
+        qe = QueryEngine(conn, {}, False)
+        self.assertEqual(qe._name_id('g'), graph)
+        self.assertTrue(qe.node_exists('g', [1, 2], 'master', 0))
+
+
+class ExecutionTest(unittest.TestCase):
+    def test_one_and_stream(self):
+        """Make sure that a reused cursor gets each lookup's own row, and
+        that streaming a dump in small batches gets every row.
+
+        """
+        from gorm.query import QueryEngine
+        qe = QueryEngine(':memory:', {}, False)
+        qe.fetch_rows = 2
+        qe.initdb()
+        qe.new_graph('g', 'Graph')
+        qe.new_branch('b', 'master', 3)
+        for node in range(5):
+            qe.exist_node('g', node, 'master', 0, True)
+            qe.node_val_set('g', node, 'k', 'master', 0, node)
+            qe.node_val_set('g', node, 'k', 'b', 4, -node)
+        for node in range(5):
+            self.assertEqual(qe.node_val_get('g', node, 'k', 'b', 5), -node)
+            self.assertEqual(
+                qe.node_val_get('g', node, 'k', 'master', 5), node
+            )
+        self.assertIsNone(qe.sqlone('global_get', 'nonesuch'))
+        self.assertEqual(len(list(qe.node_val_dump())), 10)
+        self.assertEqual(
+            sorted(n for (g, n, b, r, x) in qe.nodes_dump('g')),
+            list(range(5))
+        )
+        qe.close()
+
+
+class QueryStatsTest(unittest.TestCase):
+    def test_stats(self):
+        """Make sure that queries get counted, with their rows, while
+        something's recording, and not otherwise.
+
+        """
+        orm = gorm.ORM('sqlite:///:memory:', query_stats=True)
+        g = orm.new_graph('g')
+        for i in range(3):
+            g.node[i] = {'x': i}
+        list(orm.db.nodes_dump())
+        stats = orm.stats()
+        self.assertEqual(stats['node_val_upsert']['calls'], 3)
+        self.assertEqual(stats['nodes_dump']['rows'], 3)
+        self.assertGreaterEqual(stats['nodes_dump']['p99'], 0)
+        orm.reset_stats()
+        with orm.measure() as measured:
+            orm.db.node_val_get('g', 1, 'x', 'master', 0)
+        self.assertEqual(list(measured.stats()), ['node_val_get'])
+        self.assertEqual(measured.stats()['node_val_get']['rows'], 1)
+        orm.db.stop_recording(orm.query_stats)
+        self.assertNotIn('_execute', vars(orm.db))
+        orm.db.have_graph('g')
+        self.assertEqual(list(orm.stats()), ['node_val_get'])
+        orm.close()
+
+
+class IndexTest(unittest.TestCase):
+    def plan(self, qe, stringname):
+        s = qe.strings[stringname]
+        return [
+            row[-1] for row in qe.connection.execute(
+                'EXPLAIN QUERY PLAN ' + s, (1,) * s.count('?')
+            )
+        ]
+
+    def test_plans(self):
+        """Make sure that the queries for one branch, and for predecessors,
+        search the indices meant for them.
+
+        """
+        from gorm.query import QueryEngine
+        qe = QueryEngine(':memory:', {}, False)
+        qe.initdb()
+        for (stringname, index) in (
+                ('nodes_delta', 'nodes_branch_idx'),
+                ('node_val_delta', 'node_val_branch_idx'),
+                ('edges_delta', 'edges_branch_idx'),
+                ('edge_val_delta', 'edge_val_branch_idx'),
+                ('graph_val_delta', 'graph_val_branch_idx'),
+                ('nodeAs', 'edges_reverse_idx')
+        ):
+            plan = self.plan(qe, stringname)
+            self.assertTrue(
+                any('SEARCH' in step and index in step for step in plan),
+                (stringname, plan)
+            )
+        qe.close()
+
+    def test_update(self):
+        """Make sure that updating a database with the old indices
+        replaces them with the new.
+
+        """
+        from gorm.query import QueryEngine, old_indices
+        qe = QueryEngine(':memory:', {}, False)
+        qe.initdb()
+
+        def indices():
+            return set(
+                name for (name,) in qe.connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type='index' "
+                    "AND name NOT LIKE 'sqlite_%'"
+                )
+            )
+        new = indices()
+        for name in new:
+            qe.connection.execute('DROP INDEX ' + name)
+        qe.connection.execute('CREATE INDEX nodes_idx ON nodes (graph, node)')
+        qe.update_indices()
+        self.assertEqual(indices(), new)
+        self.assertFalse(indices().intersection(old_indices))
+        qe.update_indices()
+        self.assertEqual(indices(), new)
+        qe.close()
+
+
+class BulkIngestTest(unittest.TestCase):
+    def test_bulk_ingest(self):
+        """Make sure that ``bulk_ingest`` drops the indices and stops
+        syncing for the duration, then puts both back, keeping what was
+        written.
+
+        """
+        import os
+        import tempfile
+        path = tempfile.mkdtemp() + '/bulk.db'
+        orm = gorm.ORM(path, alchemy=False)
+        qe = orm.db
+
+        def indices():
+            return set(
+                name for (name,) in qe.connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type='index' "
+                    "AND name NOT LIKE 'sqlite_%'"
+                )
+            )
+        before = indices()
+        synchronous = qe._pragma('synchronous')
+        g = orm.new_digraph('g')
+        with orm.bulk_ingest():
+            self.assertFalse(before.intersection(indices()))
+            self.assertEqual(qe._pragma('synchronous'), 0)
+            for i in range(101):
+                g.node[i] = {}
+            for i in range(100):
+                g.adj[i][i + 1] = {'weight': i}
+        self.assertEqual(indices(), before)
+        self.assertEqual(qe._pragma('synchronous'), synchronous)
+        orm.close()
+        orm = gorm.ORM(path, alchemy=False)
+        g = orm.get_graph('g')
+        self.assertEqual(len(g.node), 101)
+        self.assertEqual(g.adj[41][42], {'weight': 41})
+        orm.close()
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+
+class DeltaTest(unittest.TestCase):
+    def test_delta(self):
+        """Make sure that values stored as patches read back the same, at
+        most ``delta_interval`` apart, even when the value they're
+        against is rewritten.
+
+        """
+        from sqlite3 import connect
+        from gorm.query import QueryEngine
+        qe = QueryEngine(connect(':memory:'), {}, False, delta_interval=3)
+        qe.initdb()
+        qe.new_graph('g', 'Graph')
+        values = []
+        for rev in range(6):
+            value = dict(('k{}'.format(i), [i, rev > i]) for i in range(20))
+            values.append(value)
+            qe.node_val_set('g', 'n', 'big', 'master', rev, value)
+        patches = [
+            qe._is_patch(row[-1]) for row in qe.sql('node_val_dump')
+        ]
+        self.assertEqual(patches, [False, True, True, False, True, True])
+        values[3] = {'k0': (0,)}
+        qe.node_val_set('g', 'n', 'big', 'master', 3, values[3])
+        for rev in range(6):
+            self.assertEqual(
+                qe.node_val_get('g', 'n', 'big', 'master', rev),
+                values[rev]
+            )
+        self.assertEqual(
+            [v for (g, n, k, b, r, v) in qe.node_val_dump()], values
+        )
+
+    def test_out_of_order(self):
+        """Make sure that rewriting a value stores whole every later value
+        patched against it, when they were written out of order.
+
+        """
+        from sqlite3 import connect
+        from gorm.query import QueryEngine
+        qe = QueryEngine(connect(':memory:'), {}, False, delta_interval=10)
+        qe.initdb()
+        qe.new_graph('g', 'DiGraph')
+
+        def value(rev):
+            r = dict(('k{}'.format(i), [i, i * i]) for i in range(20))
+            r['rev'] = rev
+            return r
+        for (get, put, dump) in (
+                (
+                    lambda rev: qe.node_val_get(
+                        'g', 'n', 'big', 'master', rev
+                    ),
+                    lambda rev, v: qe.node_val_set(
+                        'g', 'n', 'big', 'master', rev, v
+                    ),
+                    'node_val_dump'
+                ),
+                (
+                    lambda rev: qe.edge_val_get(
+                        'g', 'n', 'm', 0, 'big', 'master', rev
+                    ),
+                    lambda rev, v: qe.edge_val_set(
+                        'g', 'n', 'm', 0, 'big', 'master', rev, v
+                    ),
+                    'edge_val_dump'
+                )
+        ):
+            for rev in (3, 7, 5):
+                put(rev, value(rev))
+            self.assertEqual(
+                [qe._is_patch(row[-1]) for row in qe.sql(dump)],
+                [False, True, True]
+            )
+            put(3, {'k0': (0,)})
+            self.assertEqual(get(3), {'k0': (0,)})
+            for rev in (5, 7):
+                self.assertEqual(get(rev), value(rev))
+
+    def test_cached_rewrite(self):
+        """Make sure that rewriting a value, after the cache has loaded the
+        later patches against it, doesn't apply them to the new value.
+
+        """
+        import os
+        import tempfile
+        path = tempfile.mkdtemp() + '/delta.db'
+        orm = gorm.ORM(path, alchemy=False, delta_interval=10)
+        g = orm.new_digraph('g')
+        g.node['a'] = {}
+        g.node['b'] = {}
+        g.adj['a']['b'] = {}
+        for mapping in (g.node['a'], g.adj['a']['b']):
+            mapping['x'] = ['a'] * 50
+        orm.rev = 1
+        for mapping in (g.node['a'], g.adj['a']['b']):
+            mapping['x'] = ['a'] * 50 + [50]
+        self.assertTrue(all(
+            orm.db._is_patch(row[-1])
+            for table in ('node_val', 'edge_val')
+            for row in orm.db.sql(table + '_dump') if row[-2] == 1
+        ))
+        orm.close()
+        orm = gorm.ORM(path, alchemy=False, delta_interval=10)
+        g = orm.get_graph('g')
+        for get in (lambda: g.node['a'], lambda: g.adj['a']['b']):
+            orm.rev = 0
+            self.assertEqual(get()['x'], ['a'] * 50)
+            get()['x'] = list(range(50))
+            orm.rev = 1
+            self.assertEqual(get()['x'], ['a'] * 50 + [50])
+        orm.close()
+        orm = gorm.ORM(path, alchemy=False, delta_interval=10)
+        g = orm.get_graph('g')
+        orm.rev = 1
+        self.assertEqual(g.node['a']['x'], ['a'] * 50 + [50])
+        self.assertEqual(g.adj['a']['b']['x'], ['a'] * 50 + [50])
+        orm.close()
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+
+class ReaderPoolTest(unittest.TestCase):
+    def test_readers(self):
+        """Make sure that other threads read what was last committed, and
+        keep reading it inside ``consistent_reads``.
+
+        """
+        import os
+        import tempfile
+        from threading import Thread, Event
+        from gorm.query import QueryEngine
+        path = tempfile.mkdtemp() + '/readers.db'
+        qe = QueryEngine(path, {}, False, readers=2)
+        qe.initdb()
+        qe.new_graph('g', 'Graph')
+        qe.exist_node('g', 'committed', 'master', 0, True)
+        qe.commit()
+        qe.exist_node('g', 'uncommitted', 'master', 0, True)
+        seen = []
+        started = Event()
+        committed = Event()
+
+        def read():
+            seen.append(sorted(qe.nodes_extant('g', 'master', 0)))
+            with qe.consistent_reads():
+                seen.append(qe.node_exists('g', 'uncommitted', 'master', 0))
+                started.set()
+                committed.wait()
+                seen.append(qe.node_exists('g', 'uncommitted', 'master', 0))
+            seen.append(qe.node_exists('g', 'uncommitted', 'master', 0))
+        reader = Thread(target=read)
+        reader.start()
+        started.wait()
+        qe.commit()
+        committed.set()
+        reader.join()
+        qe.close()
+        self.assertEqual(seen, [['committed'], False, False, True])
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        os.rmdir(os.path.dirname(path))
+
+
+class ThreadsafeTest(unittest.TestCase):
+    def test_cursors(self):
+        """Make sure that each thread has its own branch and revision, and
+        sees the changes that other threads make.
+
+        """
+        from threading import Thread
+        orm = gorm.ORM('sqlite:///:memory:', threadsafe=True)
+        g = orm.new_digraph('g')
+        g.node['a'] = {'x': 0}
+        g.node['b'] = {}
+        seen = []
+
+        def write():
+            orm.rev = 1
+            g.node['a']['x'] = 1
+            g.adj['a']['b'] = {}
+            seen.append((g.node['a']['x'], list(g.adj['a'])))
+        writer = Thread(target=write)
+        writer.start()
+        writer.join()
+        self.assertEqual(seen, [(1, ['b'])])
+        self.assertEqual(orm.rev, 0)
+        self.assertEqual(g.node['a']['x'], 0)
+        self.assertEqual(list(g.adj['a']), [])
+        orm.rev = 1
+        self.assertEqual(g.node['a']['x'], 1)
+        self.assertEqual(list(g.adj['a']), ['b'])
+        orm.close()
+
+    def test_del_graph(self):
+        """Make sure that a thread doesn't see the edges of a deleted graph in
+        a new one by the same name.
+
+        """
+        from threading import Thread, Event
+        orm = gorm.ORM('sqlite:///:memory:', threadsafe=True)
+        g = orm.new_digraph('g')
+        for n in 'abc':
+            g.node[n] = {}
+        seen = []
+        ready = Event()
+        go = Event()
+
+        def read():
+            seen.append(list(orm.get_graph('g').adj['a']))
+            ready.set()
+            go.wait()
+            seen.append(list(orm.get_graph('g').adj['a']))
+        reader = Thread(target=read)
+        reader.start()
+        ready.wait()
+        g.adj['a']['b'] = {}
+        orm.del_graph('g')
+        g = orm.new_digraph('g')
+        for n in 'abc':
+            g.node[n] = {}
+        g.adj['a']['c'] = {}
+        go.set()
+        reader.join()
+        self.assertEqual(seen, [[], ['c']])
+        self.assertEqual(list(g.adj['a']), ['c'])
+        orm.close()
+
+
+@unittest.skipIf(sys.version_info < (3, 5), "asyncio front end needs 3.5")
+class AsyncORMTest(unittest.TestCase):
+    def test_gather(self):
+        """Make sure lookups gathered together come back right, in one
+        batch, and that changes land at the revision sought.
+
+        """
+        import asyncio
+        from gorm.async_orm import AsyncORM
+        aorm = AsyncORM('sqlite:///:memory:')
+        batches = []
+        run_batch = aorm._run_batch
+
+        def counting(loop):
+            batches.append(len(aorm._batch))
+            run_batch(loop)
+        aorm._run_batch = counting
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        run = loop.run_until_complete
+        g = run(aorm.new_digraph('g'))
+        run(asyncio.gather(*(
+            g.node.set(i, {'x': i}) for i in range(10)
+        )))
+        del batches[:]
+        got = run(asyncio.gather(*(g.node[i].get('x') for i in range(10))))
+        self.assertEqual(got, list(range(10)))
+        self.assertEqual(batches, [10])
+        self.assertEqual(run(g.node.get('nope', 'default')), 'default')
+        run(aorm.seek(rev=1))
+        run(g.adj[0].set(1, {'w': 2}))
+        self.assertEqual(run(g.adj[0].items()), [(1, {'w': 2})])
+        self.assertEqual(run(g.pred.iterate()), [1])
+        run(aorm.seek(rev=0))
+        self.assertEqual(run(g.adj.get(0)), {})
+        run(aorm.close())
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class WindowDictTest(unittest.TestCase):
+    def test_window(self):
+        """Make sure that looking up a revision gets the value set most
+        recently as of that revision, whichever way the cursor moves.
+
+        """
+        from gorm.window import WindowDict
+        wd = WindowDict({0: 'zero', 5: 'five', 10: 'ten'})
+        wd[3] = 'three'
+        self.assertEqual(list(wd), [0, 3, 5, 10])
+        for rev in range(15):
+            expected = 'zero' if rev < 3 else 'three' if rev < 5 \
+                else 'five' if rev < 10 else 'ten'
+            self.assertEqual(wd[rev], expected)
+        for rev in reversed(range(15)):
+            expected = 'zero' if rev < 3 else 'three' if rev < 5 \
+                else 'five' if rev < 10 else 'ten'
+            self.assertEqual(wd[rev], expected)
+        self.assertEqual(wd[100], 'ten')
+        self.assertEqual(wd[2], 'zero')
+        del wd[0]
+        self.assertRaises(KeyError, lambda: wd[2])
+        self.assertNotIn(2, wd)
+        self.assertIn(4, wd)
+        self.assertRaises(KeyError, wd.__delitem__, 4)
+
+    def test_deferred(self):
+        """Make sure that deferred values are decoded once, when first
+        looked up.
+
+        """
+        from gorm.window import WindowDict, Deferred
+        loaded = []
+
+        def load(s):
+            loaded.append(s)
+            return int(s)
+        wd = WindowDict({0: Deferred('0', load), 5: Deferred('5', load)})
+        self.assertEqual(wd[7], 5)
+        self.assertEqual(wd[6], 5)
+        self.assertEqual(loaded, ['5'])
+
+
+class FlatCacheTest(unittest.TestCase):
+    def test_nested_access(self):
+        """Make sure that the flat cache can be read and written as though it
+        were the nested dictionaries it replaced.
+
+        """
+        from gorm.cache import FlatCache
+        cache = FlatCache(2)
+        cache['n0']['k']['master'][0] = 'zero'
+        cache['n0']['k']['branch'][5] = 'five'
+        cache['n1']['j']['branch'][1] = 'one'
+        self.assertEqual(list(cache), ['n0', 'n1'])
+        self.assertEqual(list(cache['n0']), ['k'])
+        self.assertIn('n1', cache)
+        self.assertNotIn('n2', cache)
+        self.assertIn('j', cache['n1'])
+        self.assertNotIn('k', cache['n1'])
+        self.assertIn('master', cache['n0']['k'])
+        self.assertNotIn('master', cache['n1']['j'])
+        self.assertEqual(cache['n0']['k']['master'][3], 'zero')
+        self.assertEqual(cache['n0']['k']['branch'][7], 'five')
+        self.assertEqual(list(cache['n2']), [])
+
+    def test_resolve(self):
+        """Make sure that resolving a key through a lineage of branches
+        gets the value from the nearest branch that has one.
+
+        """
+        from gorm.cache import FlatCache
+        cache = FlatCache(1)
+        cache.window(('k', 'master'))[0] = 'zero'
+        cache.window(('k', 'branch'))[5] = 'five'
+        lineage = (('branch', 7), ('master', 3))
+        self.assertEqual(cache.resolve(('k',), lineage), 'five')
+        lineage = (('branch', 4), ('master', 3))
+        self.assertEqual(cache.resolve(('k',), lineage), 'zero')
+        self.assertRaises(KeyError, cache.resolve, ('j',), lineage)
+
+
+class AdjacencyIndexTest(unittest.TestCase):
+    def test_seek(self):
+        """Make sure the adjacency index follows the cursor through
+        revisions and branches, and keeps up with new edges.
+
+        """
+        from gorm.cache import FlatCache, AdjacencyIndex
+        edges = FlatCache(3)
+        edges.window(('a', 'b', 0, 'master'))[0] = True
+        edges.window(('a', 'b', 0, 'master'))[5] = False
+        edges.window(('a', 'c', 0, 'branch'))[3] = True
+        lineages = {
+            'master': lambda rev: [('master', rev)],
+            'branch': lambda rev: [('branch', rev), ('master', 2)]
+        }
+
+        def active_branches(branch, rev):
+            return lineages[branch](rev)
+        index = AdjacencyIndex(edges)
+        index.seek('master', 1, active_branches)
+        self.assertEqual(index.succ, {'a': {'b': (0,)}})
+        self.assertEqual(index.pred, {'b': {'a': (0,)}})
+        index.seek('master', 7, active_branches)
+        self.assertEqual(index.succ, {})
+        index.seek('branch', 4, active_branches)
+        self.assertEqual(index.succ, {'a': {'b': (0,), 'c': (0,)}})
+        edges.window(('c', 'a', 1, 'branch'))[4] = True
+        index.changed('c', 'a', 1, 'branch', 4)
+        self.assertEqual(index.pred['a'], {'c': (1,)})
+        index.seek('master', 1, active_branches)
+        self.assertNotIn('c', index.succ)
+        self.assertNotIn('a', index.pred)
+
+    def test_mappings(self):
+        """Make sure that the successors and predecessors of a digraph are
+        the same with caching as without.
+
+        """
+        for caching in (True, False):
+            orm = gorm.ORM(':memory:', alchemy=False, caching=caching)
+            g = orm.new_digraph('g')
+            for n in 'abcd':
+                g.node[n] = {}
+            g.adj['a']['b'] = {}
+            g.adj['a']['c'] = {}
+            g.adj['c']['b'] = {}
+            orm.rev = 1
+            del g.adj['a']['c']
+            orm.rev = 0
+            self.assertEqual(sorted(g.adj), ['a', 'c'])
+            self.assertEqual(sorted(g.pred), ['b', 'c'])
+            self.assertIn('c', g.pred)
+            self.assertNotIn('d', g.pred)
+            self.assertEqual(sorted(g.pred['b']), ['a', 'c'])
+            orm.rev = 1
+            self.assertEqual(sorted(g.adj), ['a', 'c'])
+            self.assertEqual(sorted(g.pred), ['b'])
+            self.assertNotIn('c', g.pred)
+            self.assertEqual(sorted(g.adj['a']), ['b'])
+            orm.close()
+
+
+class WriteBufferTest(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from gorm.query import QueryEngine
+        self.path = tempfile.mkdtemp() + '/buffer.db'
+        self.qe = QueryEngine(self.path, {}, False)
+        self.qe.initdb()
+        self.qe.new_graph('g', 'Graph')
+        for n in range(5):
+            self.qe.exist_node('g', n, 'master', 0, True)
+            self.qe.node_val_set('g', n, 'k', 'master', 0, 0)
+        self.qe.commit()
+
+    def tearDown(self):
+        import os
+        self.qe.close()
+        os.remove(self.path)
+        os.rmdir(os.path.dirname(self.path))
+
+    def written(self):
+        """Count the node values in the database, without flushing."""
+        return self.qe.connection.execute(
+            'SELECT COUNT(*) FROM node_val'
+        ).fetchone()[0]
+
+    def test_limit(self):
+        """Make sure the buffer is flushed when it's full, and keeps only
+        the last write of a record.
+
+        """
+        self.qe.buffer_writes(3)
+        self.qe.node_val_set('g', 0, 'k', 'master', 1, 1)
+        self.qe.node_val_set('g', 0, 'k', 'master', 1, 2)
+        self.qe.node_val_set('g', 1, 'k', 'master', 1, 1)
+        self.assertEqual(self.written(), 5)
+        self.qe.node_val_set('g', 2, 'k', 'master', 1, 1)
+        self.assertEqual(self.written(), 8)
+        self.qe.node_val_set('g', 3, 'k', 'master', 1, 1)
+        self.assertEqual(self.written(), 8)
+        self.qe.unbuffer_writes()
+        self.assertEqual(self.written(), 9)
+        self.assertEqual(self.qe.node_val_get('g', 0, 'k', 'master', 1), 2)
+
+    def test_reads(self):
+        """Make sure that reading flushes the buffer first, so it sees what
+        was written.
+
+        """
+        self.qe.buffer_writes()
+        self.qe.node_val_set('g', 0, 'k', 'master', 1, 'new')
+        self.qe.exist_node('g', 5, 'master', 1, True)
+        self.assertEqual(self.written(), 5)
+        self.assertEqual(
+            self.qe.node_val_get('g', 0, 'k', 'master', 1), 'new'
+        )
+        self.assertEqual(self.written(), 6)
+        self.assertTrue(self.qe.node_exists('g', 5, 'master', 1))
+        self.assertEqual(
+            sorted(self.qe.nodes_extant('g', 'master', 1)), list(range(6))
+        )
+
+    def test_cached_reads(self):
+        """Make sure that an ORM with caches reads what's in the buffer
+        without flushing it.
+
+        """
+        self.qe.close()
+        orm = gorm.ORM(self.path, alchemy=False, write_buffer=100)
+        self.qe = orm.db
+        orm.rev = 1
+        g = orm.get_graph('g')
+        # loading the caches reads the database, which flushes
+        (dict(g.graph), dict(g.node[0]), list(g.adj))
+        g.node[0]['k'] = 'new'
+        g.node[5] = {'k': 5}
+        self.assertEqual(g.node[0]['k'], 'new')
+        self.assertEqual(g.node[5], {'k': 5})
+        self.assertEqual(self.written(), 5)
+        orm.commit()
+        self.assertEqual(self.written(), 7)
+
+    def test_commit_and_close(self):
+        """Make sure that committing and closing write what's in the
+        buffer.
+
+        """
+        from sqlite3 import connect
+        from gorm.query import QueryEngine
+
+        def committed():
+            conn = connect(self.path)
+            r = conn.execute('SELECT COUNT(*) FROM node_val').fetchone()[0]
+            conn.close()
+            return r
+        self.qe.buffer_writes()
+        self.qe.node_val_set('g', 0, 'k', 'master', 1, 1)
+        self.assertEqual(committed(), 5)
+        self.qe.commit()
+        self.assertEqual(committed(), 6)
+        self.qe.node_val_set('g', 1, 'k', 'master', 1, 1)
+        self.qe.close()
+        self.assertEqual(committed(), 7)
+        self.qe = QueryEngine(self.path, {}, False)
+        self.assertEqual(self.qe.node_val_get('g', 1, 'k', 'master', 1), 1)
+
+
+class BulkLoadTest(unittest.TestCase):
+    def test_new_graph(self):
+        """Make sure that every type of graph made from networkx data has
+        the same graph, node, and edge attributes, including when the
+        nodes can't be compared to one another.
+
+        """
+        for caching in (True, False):
+            orm = gorm.ORM(':memory:', alchemy=False, caching=caching)
+            for type_s in ('Graph', 'DiGraph', 'MultiGraph', 'MultiDiGraph'):
+                data = getattr(nx, type_s)(title=type_s)
+                data.add_node(1, x=1)
+                data.add_node('a', x='a')
+                data.add_node((2, 3))
+                data.add_edge('a', 1, w=0)
+                data.add_edge(1, (2, 3), w=1)
+                data.add_edge((2, 3), (2, 3), w=2)
+                if data.is_multigraph():
+                    data.add_edge('a', 1, w=3)
+                name = type_s + str(caching)
+                g = getattr(orm, 'new_' + type_s.lower())(
+                    name, data, extra=True
+                )
+                self.assertEqual(
+                    dict(g.graph), {'title': type_s, 'extra': True}
+                )
+                self.assertEqual(
+                    sorted(g.node, key=repr), sorted(data.nodes, key=repr)
+                )
+                for (n, d) in data.nodes(data=True):
+                    self.assertEqual(dict(g.node[n]), d)
+                if data.is_multigraph():
+                    edges = data.edges(keys=True, data=True)
+                else:
+                    edges = ((u, v, None, d) for (u, v, d) in data.edges(
+                        data=True
+                    ))
+                for (u, v, k, d) in edges:
+                    ends = [(u, v)]
+                    if not data.is_directed():
+                        ends.append((v, u))
+                    for (a, b) in ends:
+                        e = g.adj[a][b]
+                        if k is not None:
+                            e = e[k]
+                        self.assertEqual(dict(e), d, (type_s, a, b, k))
+                self.assertNotIn('a', g.adj[(2, 3)])
+            orm.close()
+
+
+class UpsertTest(unittest.TestCase):
+    def test_upsert(self):
+        """Make sure that writing records works the same with native
+        upserts as when inserting, then updating if that fails, both one
+        at a time and flushed from the buffer.
+
+        """
+        from sqlite3 import sqlite_version_info
+        from gorm.query import QueryEngine
+        for (dbstring, alchemy) in (
+                (':memory:', False), ('sqlite:///:memory:', True)
+        ):
+            qe = QueryEngine(dbstring, {}, alchemy)
+            self.assertEqual(qe.upsert, sqlite_version_info >= (3, 24))
+            if alchemy:
+                self.assertEqual(
+                    qe.alchemist.supports_upsert, qe.upsert
+                )
+            qe.initdb()
+            for upsert in (True, False):
+                if upsert and sqlite_version_info < (3, 24):
+                    continue
+                qe.upsert = upsert
+                graph = 'g{}'.format(upsert)
+                qe.new_graph(graph, 'Graph')
+                qe.global_set('k', 1)
+                qe.global_set('k', 2)
+                self.assertEqual(qe.global_get('k'), 2)
+                for value in ('first', 'second'):
+                    qe.graph_val_set(graph, 'k', 'master', 0, value)
+                    qe.exist_node(graph, 'n', 'master', 0, value == 'first')
+                    qe.node_val_set(graph, 'n', 'k', 'master', 0, value)
+                    qe.edge_val_set(
+                        graph, 'n', 'm', 0, 'k', 'master', 0, value
+                    )
+                self.assertEqual(
+                    qe.graph_val_get(graph, 'k', 'master', 0), 'second'
+                )
+                self.assertFalse(qe.node_exists(graph, 'n', 'master', 0))
+                self.assertEqual(
+                    qe.node_val_get(graph, 'n', 'k', 'master', 0), 'second'
+                )
+                self.assertEqual(
+                    qe.edge_val_get(graph, 'n', 'm', 0, 'k', 'master', 0),
+                    'second'
+                )
+                qe.buffer_writes()
+                for n in ('n', 'o'):
+                    qe.node_val_set(graph, n, 'k', 'master', 0, 'third')
+                qe.unbuffer_writes()
+                for n in ('n', 'o'):
+                    self.assertEqual(
+                        qe.node_val_get(graph, n, 'k', 'master', 0), 'third'
+                    )
+                self.assertEqual(
+                    len(list(qe.node_val_dump(graph))), 2
+                )
+            qe.close()
+
+
+class DeleteInBranchTest(unittest.TestCase):
+    def test_delete(self):
+        """Make sure that a key deleted in a child branch is gone from
+        the graph, node, and edge there, but not from the parent branch.
+
+        """
+        for caching in (True, False):
+            orm = gorm.ORM(':memory:', alchemy=False, caching=caching)
+            g = orm.new_digraph('g')
+            g.node['a'] = {}
+            g.node['b'] = {}
+            g.adj['a']['b'] = {}
+            mappings = (g.graph, g.node['a'], g.adj['a']['b'])
+            for mapping in mappings:
+                mapping['x'] = 1
+                mapping['y'] = 2
+            orm.rev = 1
+            orm.branch = 'child'
+            for mapping in mappings:
+                del mapping['x']
+            for mapping in mappings:
+                self.assertNotIn('x', mapping)
+                self.assertRaises(KeyError, lambda: mapping['x'])
+                self.assertEqual(dict(mapping), {'y': 2})
+            orm.branch = 'master'
+            for mapping in mappings:
+                self.assertIn('x', mapping)
+                self.assertEqual(mapping['x'], 1)
+                self.assertEqual(dict(mapping), {'x': 1, 'y': 2})
+            orm.close()
+
+
+class KeysTest(unittest.TestCase):
+    def test_keys(self):
+        """Make sure that the keys of graphs, nodes, and edges are looked up
+        through the lineage of branches the same way, leaving out those
+        deleted, with keyframes and without.
+
+        """
+        from gorm.query import QueryEngine
+        qe = QueryEngine(':memory:', {}, False)
+        qe.initdb()
+        qe.new_graph('g', 'DiGraph')
+        qe.exist_node('g', 'a', 'master', 0, True)
+        qe.exist_node('g', 'b', 'master', 0, True)
+        qe.exist_edge('g', 'a', 'b', 0, 'master', 0, True)
+        setters = (
+            lambda k, b, r, v: qe.graph_val_set('g', k, b, r, v),
+            lambda k, b, r, v: qe.node_val_set('g', 'a', k, b, r, v),
+            lambda k, b, r, v: qe.edge_val_set('g', 'a', 'b', 0, k, b, r, v)
+        )
+        deleters = (
+            lambda k, b, r: qe.graph_val_del('g', k, b, r),
+            lambda k, b, r: qe.node_val_del('g', 'a', k, b, r),
+            lambda k, b, r: qe.edge_val_del('g', 'a', 'b', 0, k, b, r)
+        )
+
+        def keys(branch, rev):
+            return [
+                sorted(qe.graph_val_keys('g', branch, rev)),
+                sorted(qe.node_val_keys('g', 'a', branch, rev)),
+                sorted(qe.edge_val_keys('g', 'a', 'b', 0, branch, rev))
+            ]
+        for setter in setters:
+            setter('x', 'master', 0, 0)
+            setter('y', 'master', 1, 1)
+        qe.new_branch('b', 'master', 1)
+        for (setter, deleter) in zip(setters, deleters):
+            deleter('x', 'b', 2)
+            setter('z', 'b', 2, 2)
+            deleter('y', 'master', 3)
+        self.assertEqual(keys('master', 0), [['x']] * 3)
+        self.assertEqual(keys('master', 2), [['x', 'y']] * 3)
+        self.assertEqual(keys('master', 3), [['x']] * 3)
+        self.assertEqual(keys('b', 1), [['x', 'y']] * 3)
+        self.assertEqual(keys('b', 3), [['y', 'z']] * 3)
+        qe.keyframe('g', 'b', 2)
+        qe.keyframe('g', 'master', 1)
+        self.assertEqual(keys('b', 3), [['y', 'z']] * 3)
+        self.assertEqual(keys('master', 3), [['x']] * 3)
+        qe.close()
+
+
+class KeyframeTest(unittest.TestCase):
+    def test_keyframes(self):
+        """Make sure that reading from keyframes gets the same as reading
+        the whole history, in a child branch too, and after a revision
+        with a keyframe later than it is rewritten.
+
+        """
+        from gorm.query import QueryEngine
+        plain = QueryEngine(':memory:', {}, False)
+        framed = QueryEngine(':memory:', {}, False)
+        engines = (plain, framed)
+        for qe in engines:
+            qe.initdb()
+            qe.new_graph('g', 'DiGraph')
+            qe.new_branch('b', 'master', 3)
+
+        def write(rev, branch='master'):
+            for qe in engines:
+                qe.exist_node('g', rev, branch, rev, True)
+                qe.node_val_set('g', rev, 'rev', branch, rev, rev)
+                qe.node_val_set('g', 0, 'last', branch, rev, rev)
+                if rev:
+                    qe.exist_edge('g', rev - 1, rev, 0, branch, rev, True)
+                    qe.edge_val_set(
+                        'g', rev - 1, rev, 0, 'w', branch, rev, branch
+                    )
+                if rev > 2:
+                    qe.exist_node('g', rev - 2, branch, rev, False)
+                    qe.node_val_set('g', rev - 2, 'rev', branch, rev, None)
+                    qe.exist_edge('g', rev - 3, rev - 2, 0, branch, rev, False)
+
+        def check(branch, rev):
+            for qe in engines:
+                qe.flush()
+            self.assertEqual(
+                framed.graph_state('g', branch, rev),
+                plain.graph_state('g', branch, rev)
+            )
+            self.assertEqual(
+                sorted(framed.nodes_extant('g', branch, rev)),
+                sorted(plain.nodes_extant('g', branch, rev))
+            )
+            for n in range(9):
+                for (method, args) in (
+                        ('node_exists', ('g', n)),
+                        ('node_val_get', ('g', n, 'rev')),
+                        ('edge_val_get', ('g', n - 1, n, 0, 'w'))
+                ):
+                    self.assertEqual(
+                        get(framed, method, args + (branch, rev)),
+                        get(plain, method, args + (branch, rev))
+                    )
+
+        def get(qe, method, args):
+            try:
+                return getattr(qe, method)(*args)
+            except KeyError:
+                return KeyError
+        for rev in range(6):
+            write(rev)
+            if rev in (1, 3, 5):
+                framed.keyframe('g', 'master', rev)
+        for rev in range(4, 8):
+            write(rev, 'b')
+        framed.keyframe('g', 'b', 6)
+        g = framed._name_id('g')
+        self.assertEqual(framed._keyframes[g]['master'], [1, 3, 5])
+        self.assertEqual(framed._keyframes[g]['b'], [6])
+        for rev in range(7):
+            check('master', rev)
+        for rev in range(3, 9):
+            check('b', rev)
+        # rewrite the past, before some keyframes
+        for qe in engines:
+            qe.node_val_set('g', 0, 'last', 'master', 4, 'rewritten')
+            qe.exist_node('g', 1, 'master', 4, True)
+            qe.edge_val_set('g', 4, 5, 0, 'w', 'b', 5, 'rewritten')
+        self.assertEqual(framed._keyframes[g]['master'], [1, 3])
+        self.assertEqual(framed._keyframes[g]['b'], [])
+        for rev in range(7):
+            check('master', rev)
+        for rev in range(3, 9):
+            check('b', rev)
+        self.assertEqual(
+            framed.node_val_get('g', 0, 'last', 'master', 5), 5
+        )
+        self.assertEqual(
+            framed.graph_state('g', 'master', 4)[1][(0, 'last')],
+            'rewritten'
+        )
+        for qe in engines:
+            qe.close()
+
+
+class PerGraphCacheTest(unittest.TestCase):
+    def test_lazy_load(self):
+        """Make sure that the caches only load the graphs that get used, and
+        that a deleted graph doesn't come back when one is made with its
+        name.
+
+        """
+        import os
+        import tempfile
+        path = tempfile.mkdtemp() + '/lazy.db'
+        orm = gorm.ORM(path, alchemy=False)
+        for name in ('g', 'h'):
+            g = orm.new_digraph(name)
+            g.graph['name'] = name
+            g.node[0] = {'x': name}
+            g.node[1] = {}
+            g.adj[0][1] = {'w': name}
+        orm.close()
+        orm = gorm.ORM(path, alchemy=False)
+        g = orm.get_graph('g')
+        self.assertEqual(g.node[0], {'x': 'g'})
+        self.assertEqual(g.adj[0][1], {'w': 'g'})
+        for cache in (
+                orm._graph_val_cache, orm._node_val_cache, orm._nodes_cache,
+                orm._edge_val_cache, orm._edges_cache
+        ):
+            self.assertNotIn('h', cache)
+        h = orm.get_graph('h')
+        self.assertEqual(h.graph['name'], 'h')
+        self.assertIn('h', orm._graph_val_cache)
+        orm.del_graph('h')
+        self.assertFalse(orm.db.have_graph('h'))
+        h = orm.new_digraph('h')
+        self.assertEqual(list(h.node), [])
+        self.assertEqual(list(h.adj), [])
+        orm.close()
+        orm = gorm.ORM(path, alchemy=False)
+        h = orm.get_graph('h')
+        self.assertEqual(list(h.node), [])
+        self.assertEqual(list(h.graph), [])
+        self.assertEqual(orm.get_graph('g').node[0], {'x': 'g'})
+        orm.close()
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+
+class ArraysTest(unittest.TestCase):
+    def arrays(self, g):
+        """Return what ``g.to_arrays()`` says, as lists."""
+        a = g.to_arrays()
+        nodes = list(a.nodes)
+        edges = [
+            (nodes[i], nodes[a.indices[j]], a.idx[j])
+            for i in range(len(nodes))
+            for j in range(a.indptr[i], a.indptr[i + 1])
+        ]
+        return (
+            nodes, edges,
+            dict((k, list(v)) for (k, v) in a.node_attrs.items()),
+            dict((k, list(v)) for (k, v) in a.edge_attrs.items())
+        )
+
+    def test_arrays(self):
+        """Make sure that the arrays show the graph as of the present
+        revision and branch, including writes that are still buffered.
+
+        """
+        orm = gorm.ORM(':memory:', alchemy=False, write_buffer=100)
+        g = orm.new_digraph('g')
+        for n in 'abc':
+            g.node[n] = {}
+        g.node['a']['x'] = 1
+        g.adj['a']['b'] = {'w': 1}
+        g.adj['b']['c'] = {'w': 2}
+        rev0 = (
+            ['a', 'b', 'c'],
+            [('a', 'b', 0), ('b', 'c', 0)],
+            {'x': [1, None, None]},
+            {'w': [1, 2]}
+        )
+        self.assertTrue(orm.db._write_buffer)
+        self.assertEqual(self.arrays(g), rev0)
+        orm.rev = 1
+        del g.adj['a']['b']
+        g.node['d'] = {'x': 4}
+        g.adj['c']['d'] = {'w': 3}
+        g.node['b']['x'] = 2
+        rev1 = (
+            ['a', 'b', 'c', 'd'],
+            [('b', 'c', 0), ('c', 'd', 0)],
+            {'x': [1, 2, None, 4]},
+            {'w': [2, 3]}
+        )
+        self.assertTrue(orm.db._write_buffer)
+        self.assertEqual(self.arrays(g), rev1)
+        orm.rev = 0
+        self.assertEqual(self.arrays(g), rev0)
+        orm.rev = 2
+        orm.branch = 'child'
+        del g.node['c']
+        g.adj['a']['d'] = {}
+        g.adj['a']['d']['w'] = 'new'
+        child = (
+            ['a', 'b', 'd'],
+            [('a', 'd', 0)],
+            {'x': [1, 2, 4]},
+            {'w': ['new']}
+        )
+        self.assertTrue(orm.db._write_buffer)
+        self.assertEqual(self.arrays(g), child)
+        orm.branch = 'master'
+        self.assertEqual(self.arrays(g), rev1)
+        orm.close()
+
+    def test_undirected(self):
+        """Make sure that an undirected graph or multigraph lists each edge
+        under both its nodes, once for a loop.
+
+        """
+        orm = gorm.ORM(':memory:', alchemy=False)
+        g = orm.new_graph('g')
+        m = orm.new_multigraph('m')
+        for graph in (g, m):
+            for n in 'abc':
+                graph.node[n] = {}
+        g.adj['a']['b'] = {'w': 1}
+        g.adj['b']['c'] = {'w': 2}
+        g.adj['c']['c'] = {'w': 3}
+        self.assertEqual(self.arrays(g), (
+            ['a', 'b', 'c'],
+            [('a', 'b', 0), ('b', 'a', 0), ('b', 'c', 0), ('c', 'b', 0),
+             ('c', 'c', 0)],
+            {},
+            {'w': [1, 1, 2, 2, 3]}
+        ))
+        m.adj['a']['b'] = {0: {'w': 1}, 1: {'w': 4}}
+        m.adj['b']['c'] = {0: {'w': 2}}
+        m.adj['c']['c'] = {0: {'w': 3}}
+        self.assertEqual(self.arrays(m), (
+            ['a', 'b', 'c'],
+            [('a', 'b', 0), ('a', 'b', 1), ('b', 'a', 0), ('b', 'a', 1),
+             ('b', 'c', 0), ('c', 'b', 0), ('c', 'c', 0)],
+            {},
+            {'w': [1, 4, 1, 4, 2, 2, 3]}
+        ))
+        orm.close()
+
+
+class MigrateTest(unittest.TestCase):
+    def test_convert_names(self):
+        """Make sure that a database from when names were stored as text
+        won't open, and that migrating it gives names IDs without losing
+        anything.
+
+        """
+        import os
+        import sqlite3
+        import tempfile
+        from gorm.migrate import main
+        from gorm.query import OldSchemaError
+        path = tempfile.mkdtemp() + '/old.db'
+        conn = sqlite3.connect(path)
+        for (table, columns, rows) in (
+                ('graphs', 'graph, type', [
+                    ('"g"', 'DiGraph'), ('"h"', 'Graph')
+                ]),
+                ('graph_val', 'graph, "key", branch, rev, value', [
+                    ('"g"', '"title"', 'master', 0, '"old"')
+                ]),
+                ('nodes', 'graph, node, branch, rev, extant', [
+                    ('"g"', '"a"', 'master', 0, 1),
+                    ('"g"', '["tuple", 1, 2]', 'master', 0, 1),
+                    ('"g"', '3', 'master', 0, 1),
+                    ('"g"', '3', 'master', 1, 0),
+                    ('"h"', '"a"', 'master', 0, 1)
+                ]),
+                ('node_val', 'graph, node, "key", branch, rev, value', [
+                    ('"g"', '"a"', '"pos"', 'master', 0, '["tuple", 1, 2]'),
+                    ('"g"', '"a"', '"tags"', 'master', 0, '["list", "x"]'),
+                    ('"g"', '"a"', '"tags"', 'master', 1, None)
+                ]),
+                ('edges', 'graph, "nodeA", "nodeB", idx, branch, rev, '
+                 'extant', [
+                     ('"g"', '"a"', '["tuple", 1, 2]', 0, 'master', 0, 1),
+                     ('"g"', '3', '"a"', 0, 'master', 0, 1),
+                     ('"g"', '3', '"a"', 0, 'master', 1, 0)
+                 ]),
+                ('edge_val', 'graph, "nodeA", "nodeB", idx, "key", branch, '
+                 'rev, value', [
+                     ('"g"', '"a"', '["tuple", 1, 2]', 0, '"w"', 'master', 0,
+                      '3')
+                 ])
+        ):
+            conn.execute('CREATE TABLE {} ({})'.format(table, columns))
+            conn.executemany(
+                'INSERT INTO {} VALUES ({})'.format(
+                    table, ', '.join('?' * len(rows[0]))
+                ), rows
+            )
+        conn.commit()
+        conn.close()
+        with self.assertRaises(OldSchemaError):
+            gorm.ORM(path, alchemy=False)
+        self.assertEqual(main([path]), 0)
+        orm = gorm.ORM(path, alchemy=False)
+        g = orm.get_graph('g')
+        self.assertIsInstance(g, gorm.graph.DiGraph)
+        self.assertEqual(list(orm.get_graph('h').node), ['a'])
+        self.assertEqual(g.graph['title'], 'old')
+        self.assertEqual(
+            g.node['a'], {'pos': (1, 2), 'tags': ['x']}
+        )
+        self.assertEqual(g.adj['a'][(1, 2)], {'w': 3})
+        self.assertIn(3, g.node)
+        orm.rev = 1
+        self.assertEqual(g.node['a'], {'pos': (1, 2)})
+        self.assertNotIn(3, g.node)
+        self.assertEqual(sorted(map(repr, g.node)), ["'a'", '(1, 2)'])
+        self.assertEqual(list(g.adj['a']), [(1, 2)])
+        orm.close()
+        tables = set(
+            name for (name,) in sqlite3.connect(path).execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"
+            )
+        )
+        self.assertFalse(any(name.endswith('_old') for name in tables))
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+
 if __name__ == '__main__':
     unittest.main()